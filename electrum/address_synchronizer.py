@@ -21,11 +21,14 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import sys
 import threading
 import asyncio
 import itertools
-from collections import defaultdict
-from typing import TYPE_CHECKING, Dict, Optional
+import bisect
+from collections import defaultdict, deque, OrderedDict
+from collections.abc import MutableMapping
+from typing import TYPE_CHECKING, Dict, Optional, Set, List, Sequence, Tuple, Union
 
 from . import bitcoin
 from .bitcoin import COINBASE_MATURITY, TYPE_ADDRESS, TYPE_PUBKEY
@@ -45,6 +48,9 @@ TX_HEIGHT_LOCAL = -2
 TX_HEIGHT_UNCONF_PARENT = -1
 TX_HEIGHT_UNCONFIRMED = 0
 
+# number of deserialized transactions kept by LazyTransactions
+TX_CACHE_SIZE = 1000
+
 class AddTransactionException(Exception):
     pass
 
@@ -54,6 +60,89 @@ class UnrelatedTransactionException(AddTransactionException):
         return _("Transaction is unrelated to this wallet.")
 
 
+def sort_by_dependencies(txs: Sequence[Tuple[str, Transaction, int]]) -> List[Tuple[str, Transaction, int]]:
+    """Sorts (tx_hash, tx, tx_height) items so that a tx comes after the
+    txs it spends from. Otherwise the order is kept.
+    """
+    items = {item[0]: item for item in txs}
+    num_parents = {}  # type: Dict[str, int]
+    children = defaultdict(list)  # type: Dict[str, List[str]]
+    for tx_hash, tx, tx_height in items.values():
+        parents = set(txin['prevout_hash'] for txin in tx.inputs()
+                      if txin['type'] != 'coinbase' and txin['prevout_hash'] in items)
+        parents.discard(tx_hash)
+        num_parents[tx_hash] = len(parents)
+        for parent in parents:
+            children[parent].append(tx_hash)
+    ready = deque(tx_hash for tx_hash in items if num_parents[tx_hash] == 0)
+    result = []
+    while ready:
+        tx_hash = ready.popleft()
+        result.append(items[tx_hash])
+        for child in children[tx_hash]:
+            num_parents[child] -= 1
+            if num_parents[child] == 0:
+                ready.append(child)
+    assert len(result) == len(items)
+    return result
+
+
+class LazyTransactions(MutableMapping):
+    """txid -> Transaction, holding the raw transactions. A Transaction is
+    only created when its txid is looked up, and the ones most recently
+    used are kept in a bounded LRU cache.
+    """
+
+    def __init__(self, raw_txs: Dict[str, str] = None, cache_size: int = TX_CACHE_SIZE):
+        self.lock = threading.Lock()
+        self._raw_txs = raw_txs if raw_txs is not None else {}  # type: Dict[str, str]
+        self._cache = OrderedDict()  # type: OrderedDict  # txid -> Transaction, in LRU order
+        self.cache_size = cache_size
+
+    def __getitem__(self, txid: str) -> Transaction:
+        with self.lock:
+            tx = self._cache.get(txid)
+            if tx is None:
+                tx = Transaction(self._raw_txs[txid])
+                self._cache_tx(txid, tx)
+            else:
+                self._cache.move_to_end(txid)
+            return tx
+
+    def __setitem__(self, txid: str, tx: Transaction) -> None:
+        with self.lock:
+            self._raw_txs[txid] = str(tx)
+            self._cache_tx(txid, tx)
+
+    def __delitem__(self, txid: str) -> None:
+        with self.lock:
+            del self._raw_txs[txid]
+            self._cache.pop(txid, None)
+
+    def _cache_tx(self, txid: str, tx: Transaction) -> None:
+        self._cache[txid] = tx
+        self._cache.move_to_end(txid)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __contains__(self, txid) -> bool:
+        # without creating the Transaction
+        return txid in self._raw_txs
+
+    def __iter__(self):
+        return iter(self._raw_txs)
+
+    def __len__(self) -> int:
+        return len(self._raw_txs)
+
+    def get_raw(self, txid: str) -> Optional[str]:
+        return self._raw_txs.get(txid)
+
+    def raw_items(self):
+        with self.lock:
+            return list(self._raw_txs.items())
+
+
 class AddressSynchronizer(PrintError):
     """
     inherited by wallet
@@ -69,16 +158,21 @@ class AddressSynchronizer(PrintError):
         self.lock = threading.RLock()
         self.transaction_lock = threading.RLock()
         # address -> list(txid, height)
-        self.history = storage.get('addr_history',{})
+        self.history = {sys.intern(addr): [(sys.intern(txid), height) for txid, height in hist]
+                        for addr, hist in storage.get('addr_history', {}, readonly=True).items()}
         # Verified transactions.  txid -> TxMinedInfo.  Access with self.lock.
-        verified_tx = storage.get('verified_tx3', {})
+        # Only modify with _set_verified_tx and _pop_verified_tx, which also
+        # maintain the index: height -> txids, and the sorted list of its keys.
         self.verified_tx = {}  # type: Dict[str, TxMinedInfo]
+        self._verified_tx_by_height = {}  # type: Dict[int, Set[str]]
+        self._verified_tx_heights = []  # type: List[int]
+        verified_tx = storage.get('verified_tx3', {}, readonly=True)
         for txid, (height, timestamp, txpos, header_hash) in verified_tx.items():
-            self.verified_tx[txid] = TxMinedInfo(height=height,
-                                                 conf=None,
-                                                 timestamp=timestamp,
-                                                 txpos=txpos,
-                                                 header_hash=header_hash)
+            self._set_verified_tx(sys.intern(txid), TxMinedInfo(height=height,
+                                                                conf=None,
+                                                                timestamp=timestamp,
+                                                                txpos=txpos,
+                                                                header_hash=header_hash))
         # Transactions pending verification.  txid -> tx_height. Access with self.lock.
         self.unverified_tx = defaultdict(int)
         # true when synchronized
@@ -128,12 +222,35 @@ class AddressSynchronizer(PrintError):
             return addr
         prevout_hash = txi.get('prevout_hash')
         prevout_n = txi.get('prevout_n')
-        dd = self.txo.get(prevout_hash, {})
-        for addr, l in dd.items():
-            for n, v, is_cb in l:
-                if n == prevout_n:
-                    return addr
-        return None
+        return self._get_txo_address(prevout_hash, prevout_n)
+
+    def _get_txo_address(self, prevout_hash, prevout_n):
+        outpoints = self._txo_address.get(prevout_hash)
+        if outpoints is None:
+            return None
+        if type(outpoints) is tuple:
+            return outpoints[prevout_n] if prevout_n < len(outpoints) else None
+        return outpoints.get(prevout_n)
+
+    @staticmethod
+    def _pack_txo_addresses(outpoints: Dict[int, str]):
+        """Returns the addresses of the outputs as a tuple indexed by n,
+        with None for outputs that are not ours; a dict if that would be
+        much larger."""
+        size = max(outpoints) + 1
+        if size > 2 * len(outpoints) + 8:
+            return outpoints
+        return tuple(outpoints.get(n) for n in range(size))
+
+    def get_txo(self, prevout_hash, prevout_n):
+        """Returns (address, value, is_coinbase) of an is_mine output,
+        or None if the output is not known to be ours."""
+        with self.transaction_lock:
+            addr = self._get_txo_address(prevout_hash, prevout_n)
+            if addr is None:
+                return None
+            v, is_cb = self.txo[prevout_hash][addr][prevout_n]
+            return addr, v, is_cb
 
     def get_txout_address(self, txo: TxOutput):
         if txo.type == TYPE_ADDRESS:
@@ -164,6 +281,7 @@ class AddressSynchronizer(PrintError):
                 self.synchronizer = None
             if self.verifier:
                 asyncio.run_coroutine_threadsafe(self.verifier.stop(), self.network.asyncio_loop)
+                self.network.unregister_callback(self.verifier.on_blockchain_updated)
                 self.verifier = None
             self.storage.put('stored_height', self.get_local_height())
         if write_to_disk:
@@ -191,7 +309,7 @@ class AddressSynchronizer(PrintError):
                     continue
                 prevout_hash = txin['prevout_hash']
                 prevout_n = txin['prevout_n']
-                spending_tx_hash = self.spent_outpoints[prevout_hash].get(prevout_n)
+                spending_tx_hash = self.spent_outpoints.get(prevout_hash, {}).get(prevout_n)
                 if spending_tx_hash is None:
                     continue
                 # this outpoint has already been spent, by spending_tx
@@ -209,6 +327,7 @@ class AddressSynchronizer(PrintError):
         assert tx, tx
         assert tx.is_complete()
         # assert tx_hash == tx.txid()  # disabled as expensive; test done by Synchronizer.
+        tx_hash = sys.intern(tx_hash)
         # we need self.transaction_lock but get_tx_height will take self.lock
         # so we need to take that too here, to enforce order of locks
         with self.lock, self.transaction_lock:
@@ -255,46 +374,42 @@ class AddressSynchronizer(PrintError):
                 for tx_hash2 in to_remove:
                     self.remove_transaction(tx_hash2)
             # add inputs
-            def add_value_from_prev_output():
-                dd = self.txo.get(prevout_hash, {})
-                # note: this nested loop takes linear time in num is_mine outputs of prev_tx
-                for addr, outputs in dd.items():
-                    # note: instead of [(n, v, is_cb), ...]; we could store: {n -> (v, is_cb)}
-                    for n, v, is_cb in outputs:
-                        if n == prevout_n:
-                            if addr and self.is_mine(addr):
-                                if d.get(addr) is None:
-                                    d[addr] = set()
-                                d[addr].add((ser, v))
-                            return
             self.txi[tx_hash] = d = {}
             for txi in tx.inputs():
                 if txi['type'] == 'coinbase':
                     continue
-                prevout_hash = txi['prevout_hash']
+                prevout_hash = sys.intern(txi['prevout_hash'])
                 prevout_n = txi['prevout_n']
                 ser = prevout_hash + ':%d' % prevout_n
                 self.spent_outpoints[prevout_hash][prevout_n] = tx_hash
-                add_value_from_prev_output()
+                prev_txo = self.get_txo(prevout_hash, prevout_n)
+                if prev_txo is not None and self.is_mine(prev_txo[0]):
+                    addr, v, is_cb = prev_txo
+                    d.setdefault(addr, {})[ser] = v
             # add outputs
             self.txo[tx_hash] = d = {}
+            outpoints = {}
             for n, txo in enumerate(tx.outputs()):
                 v = txo[2]
                 ser = tx_hash + ':%d'%n
                 addr = self.get_txout_address(txo)
                 if addr and self.is_mine(addr):
-                    if d.get(addr) is None:
-                        d[addr] = []
-                    d[addr].append((n, v, is_coinbase))
+                    addr = sys.intern(addr)
+                    d.setdefault(addr, {})[n] = (v, is_coinbase)
+                    outpoints[n] = addr
+                    if is_coinbase:
+                        self._coinbase_addrs.add(addr)
                     # give v to txi that spends me
-                    next_tx = self.spent_outpoints[tx_hash].get(n)
+                    next_tx = self.spent_outpoints.get(tx_hash, {}).get(n)
                     if next_tx is not None:
                         dd = self.txi.get(next_tx, {})
-                        if dd.get(addr) is None:
-                            dd[addr] = set()
-                        if (ser, v) not in dd[addr]:
-                            dd[addr].add((ser, v))
+                        dd.setdefault(addr, {})[ser] = v
                         self._add_tx_to_local_history(next_tx)
+            # only txs with is_mine outputs are indexed
+            if outpoints:
+                self._txo_address[tx_hash] = self._pack_txo_addresses(outpoints)
+            else:
+                self._txo_address.pop(tx_hash, None)
             # add to local history
             self._add_tx_to_local_history(tx_hash)
             # save
@@ -333,11 +448,12 @@ class AddressSynchronizer(PrintError):
             self._remove_tx_from_local_history(tx_hash)
             self.txi.pop(tx_hash, None)
             self.txo.pop(tx_hash, None)
+            self._txo_address.pop(tx_hash, None)
 
     def get_depending_transactions(self, tx_hash):
         """Returns all (grand-)children of tx_hash in this wallet."""
         children = set()
-        for other_hash in self.spent_outpoints[tx_hash].values():
+        for other_hash in self.spent_outpoints.get(tx_hash, {}).values():
             children.add(other_hash)
             children |= self.get_depending_transactions(other_hash)
         return children
@@ -346,6 +462,15 @@ class AddressSynchronizer(PrintError):
         self.add_unverified_tx(tx_hash, tx_height)
         self.add_transaction(tx_hash, tx, allow_unrelated=True)
 
+    def receive_tx_batch_callback(self, txs: Sequence[Tuple[str, Transaction, int]]):
+        """Like receive_tx_callback, for (tx_hash, tx, tx_height) items.
+        Parents are added before their children, so that their outputs are
+        known when the spending inputs are processed. The locks are taken once.
+        """
+        with self.lock, self.transaction_lock:
+            for tx_hash, tx, tx_height in sort_by_dependencies(txs):
+                self.receive_tx_callback(tx_hash, tx, tx_height)
+
     def receive_history_callback(self, addr, hist, tx_fees):
         with self.lock:
             old_hist = self.get_address_history(addr)
@@ -353,10 +478,15 @@ class AddressSynchronizer(PrintError):
                 if (tx_hash, height) not in hist:
                     # make tx local
                     self.unverified_tx.pop(tx_hash, None)
-                    self.verified_tx.pop(tx_hash, None)
+                    self._pop_verified_tx(tx_hash)
+                    self._invalidate_balances(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
+            hist = [(sys.intern(tx_hash), height) for tx_hash, height in hist]
             self.history[addr] = hist
+            # the deltas of these txs now include addr
+            with self.transaction_lock:
+                self._dirty_txs.update(tx_hash for tx_hash, height in hist)
 
         for tx_hash, tx_height in hist:
             # add it in case it was previously unconfirmed
@@ -372,35 +502,78 @@ class AddressSynchronizer(PrintError):
 
     @profiler
     def load_transactions(self):
+        # The stored maps are rebuilt rather than copied. Their txids and
+        # addresses are interned, so that each of them is kept in memory
+        # only once, and shared by all the maps.
+        intern = sys.intern
         # load txi, txo, tx_fees
-        self.txi = self.storage.get('txi', {})
-        for txid, d in list(self.txi.items()):
-            for addr, lst in d.items():
-                self.txi[txid][addr] = set([tuple(x) for x in lst])
-        self.txo = self.storage.get('txo', {})
-        self.tx_fees = self.storage.get('tx_fees', {})
-        tx_list = self.storage.get('transactions', {})
-        # load transactions
-        self.transactions = {}
+        # txi: txid -> address -> {prevout_ser -> value}
+        self.txi = {intern(txid): {intern(addr): dict(inputs) for addr, inputs in d.items()}
+                    for txid, d in self.storage.get('txi', {}, readonly=True).items()}
+        # txo: txid -> address -> {n -> (value, is_coinbase)}
+        self.txo = {}
+        # outpoint index: txid -> n -> address, for the outputs in txo.
+        # Txs without is_mine outputs are left out; see _pack_txo_addresses
+        self._txo_address = {}  # type: Dict[str, Union[Tuple[Optional[str], ...], Dict[int, str]]]
+        # addresses with coinbase outputs, whose balance depends on the local height
+        self._coinbase_addrs = set()  # type: Set[str]
+        for txid, d in self.storage.get('txo', {}, readonly=True).items():
+            txid = intern(txid)
+            self.txo[txid] = d2 = {}
+            outpoints = {}
+            for addr, outputs in d.items():
+                addr = intern(addr)
+                # json keys are strings
+                d2[addr] = {int(n): tuple(x) for n, x in outputs.items()}
+                for n, (v, is_cb) in d2[addr].items():
+                    outpoints[n] = addr
+                    if is_cb:
+                        self._coinbase_addrs.add(addr)
+            if outpoints:
+                self._txo_address[txid] = self._pack_txo_addresses(outpoints)
+        self.tx_fees = dict(self.storage.get('tx_fees', {}, readonly=True))
+        tx_list = self.storage.get('transactions', {}, readonly=True)
+        # load transactions; they are deserialized when used
+        raw_txs = {}
         for tx_hash, raw in tx_list.items():
-            tx = Transaction(raw)
-            self.transactions[tx_hash] = tx
             if self.txi.get(tx_hash) is None and self.txo.get(tx_hash) is None:
                 self.print_error("removing unreferenced tx", tx_hash)
-                self.transactions.pop(tx_hash)
+                continue
+            raw_txs[intern(tx_hash)] = raw
+        self.transactions = LazyTransactions(raw_txs)
         # load spent_outpoints
-        _spent_outpoints = self.storage.get('spent_outpoints', {})
+        _spent_outpoints = self.storage.get('spent_outpoints', {}, readonly=True)
         self.spent_outpoints = defaultdict(dict)
         for prevout_hash, d in _spent_outpoints.items():
             for prevout_n_str, spending_txid in d.items():
                 prevout_n = int(prevout_n_str)
                 if spending_txid not in self.transactions:
                     continue  # only care about txns we have
-                self.spent_outpoints[prevout_hash][prevout_n] = spending_txid
+                self.spent_outpoints[intern(prevout_hash)][prevout_n] = intern(spending_txid)
 
     @profiler
     def load_local_history(self):
         self._history_local = {}  # address -> set(txid)
+        # Caches for is_mine addresses: the balance (confirmed, unconfirmed,
+        # unmatured), if non-zero, and their sum; the utxos (outpoint -> coin),
+        # if any. Addresses touched by a tx that was added, removed or changed
+        # height are marked dirty, and are recomputed on the next query.
+        # Access with self.lock and self.transaction_lock.
+        self._addr_balances = {}  # type: Dict[str, Tuple[int, int, int]]
+        self._total_balance = (0, 0, 0)
+        self._addr_utxos = {}  # type: Dict[str, Dict[str, dict]]
+        self._dirty_addrs = set()  # type: Set[str]
+        self._balance_local_height = None
+        # Cache of the history of the whole wallet: the (txpos, txid) of its
+        # txs sorted oldest first, the delta of each tx, and the running
+        # balance after each of them. Txs that were added, removed or changed
+        # height are marked dirty, and are moved on the next query.
+        # Access with self.lock and self.transaction_lock.
+        self._history_keys = []  # type: List[Tuple[Tuple[int, int], str]]
+        self._history_txpos = {}  # type: Dict[str, Tuple[int, int]]
+        self._history_deltas = {}  # type: Dict[str, int]
+        self._history_balances = []  # type: List[int]
+        self._dirty_txs = set()  # type: Set[str]
         for txid in itertools.chain(self.txi, self.txo):
             self._add_tx_to_local_history(txid)
 
@@ -435,8 +608,8 @@ class AddressSynchronizer(PrintError):
     def save_transactions(self, write=False):
         with self.transaction_lock:
             tx = {}
-            for k,v in self.transactions.items():
-                tx[k] = str(v)
+            for k, raw in self.transactions.raw_items():
+                tx[k] = raw
             self.storage.put('transactions', tx)
             self.storage.put('txi', self.txi)
             self.storage.put('txo', self.txo)
@@ -461,11 +634,16 @@ class AddressSynchronizer(PrintError):
             with self.transaction_lock:
                 self.txi = {}
                 self.txo = {}
+                self._txo_address = {}
+                self._coinbase_addrs = set()
                 self.tx_fees = {}
                 self.spent_outpoints = defaultdict(dict)
                 self.history = {}
                 self.verified_tx = {}
-                self.transactions = {}  # type: Dict[str, Transaction]
+                self._verified_tx_by_height = {}
+                self._verified_tx_heights = []
+                self.transactions = LazyTransactions()
+                self.load_local_history()
                 self.save_transactions()
 
     def get_txpos(self, tx_hash):
@@ -494,45 +672,61 @@ class AddressSynchronizer(PrintError):
 
     @with_local_height_cached
     def get_history(self, domain=None):
-        # get domain
-        if domain is None:
-            domain = self.history.keys()
-        domain = set(domain)
-        # 1. Get the history of each address in the domain, maintain the
-        #    delta of a tx as the sum of its deltas on domain addresses
-        tx_deltas = defaultdict(int)
-        for addr in domain:
-            h = self.get_address_history(addr)
-            for tx_hash, height in h:
-                delta = self.get_tx_delta(tx_hash, addr)
-                if delta is None or tx_deltas[tx_hash] is None:
-                    tx_deltas[tx_hash] = None
-                else:
-                    tx_deltas[tx_hash] += delta
-        # 2. create sorted history
-        history = []
-        for tx_hash in tx_deltas:
-            delta = tx_deltas[tx_hash]
-            tx_mined_status = self.get_tx_height(tx_hash)
-            history.append((tx_hash, tx_mined_status, delta))
-        history.sort(key = lambda x: self.get_txpos(x[0]), reverse=True)
-        # 3. add balance
-        c, u, x = self.get_balance(domain)
-        balance = c + u + x
-        h2 = []
-        for tx_hash, tx_mined_status, delta in history:
-            h2.append((tx_hash, tx_mined_status, delta, balance))
-            if balance is None or delta is None:
-                balance = None
+        with self.lock, self.transaction_lock:
+            self._refresh_history()
+            if domain is None:
+                keys = self._history_keys
+                tx_deltas = self._history_deltas
+                balances = self._history_balances
             else:
-                balance -= delta
-        h2.reverse()
+                # only the txs of the domain addresses, ordered as in the cache
+                domain = set(domain)
+                tx_deltas = defaultdict(int)
+                for addr in domain:
+                    for tx_hash in self._history_local.get(addr, ()):
+                        tx_deltas[tx_hash] += self.get_tx_delta(tx_hash, addr)
+                keys = sorted((self._history_txpos.get(tx_hash) or self.get_txpos(tx_hash), tx_hash)
+                              for tx_hash in tx_deltas)
+                balances = list(itertools.accumulate(tx_deltas[tx_hash] for txpos, tx_hash in keys))
+            h = [(tx_hash, self.get_tx_height(tx_hash), tx_deltas[tx_hash], balance)
+                 for (txpos, tx_hash), balance in zip(keys, balances)]
         # fixme: this may happen if history is incomplete
-        if balance not in [None, 0]:
+        balance = balances[-1] if balances else 0
+        if balance != sum(self.get_balance(domain)):
             self.print_error("Error: history not synchronized")
             return []
+        return h
 
-        return h2
+    def _refresh_history(self):
+        """Moves the stale txs in the history cache to their position, and
+        recomputes the running balances from the first one that moved.
+        Call with self.lock and self.transaction_lock."""
+        keys = self._history_keys
+        start = len(self._history_balances)
+        for tx_hash in self._dirty_txs:
+            txpos = self._history_txpos.pop(tx_hash, None)
+            self._history_deltas.pop(tx_hash, None)
+            if txpos is not None:
+                idx = bisect.bisect_left(keys, (txpos, tx_hash))
+                del keys[idx]
+                start = min(start, idx)
+            addrs = set(itertools.chain(self.txi.get(tx_hash, []), self.txo.get(tx_hash, [])))
+            addrs = [addr for addr in addrs if addr in self.history]
+            if not addrs:
+                continue
+            txpos = self.get_txpos(tx_hash)
+            idx = bisect.bisect_left(keys, (txpos, tx_hash))
+            keys.insert(idx, (txpos, tx_hash))
+            start = min(start, idx)
+            self._history_txpos[tx_hash] = txpos
+            self._history_deltas[tx_hash] = sum(self.get_tx_delta(tx_hash, addr) for addr in addrs)
+        self._dirty_txs = set()
+        balances = self._history_balances
+        del balances[start:]
+        balance = balances[-1] if balances else 0
+        for txpos, tx_hash in keys[start:]:
+            balance += self._history_deltas[tx_hash]
+            balances.append(balance)
 
     def _add_tx_to_local_history(self, txid):
         with self.transaction_lock:
@@ -540,6 +734,8 @@ class AddressSynchronizer(PrintError):
                 cur_hist = self._history_local.get(addr, set())
                 cur_hist.add(txid)
                 self._history_local[addr] = cur_hist
+                self._dirty_addrs.add(addr)
+            self._dirty_txs.add(txid)
 
     def _remove_tx_from_local_history(self, txid):
         with self.transaction_lock:
@@ -551,30 +747,47 @@ class AddressSynchronizer(PrintError):
                     pass
                 else:
                     self._history_local[addr] = cur_hist
+                self._dirty_addrs.add(addr)
+            self._dirty_txs.add(txid)
+
+    def _invalidate_balances(self, txid):
+        """Marks the balances of the addresses touched by txid, and its
+        position in the history, as stale, e.g. because its height changed."""
+        with self.transaction_lock:
+            for addr in itertools.chain(self.txi.get(txid, []), self.txo.get(txid, [])):
+                self._dirty_addrs.add(addr)
+            self._dirty_txs.add(txid)
 
     def add_unverified_tx(self, tx_hash, tx_height):
         if tx_hash in self.verified_tx:
             if tx_height in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT):
                 with self.lock:
-                    self.verified_tx.pop(tx_hash)
+                    self._pop_verified_tx(tx_hash)
+                    self._invalidate_balances(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             with self.lock:
                 # tx will be verified only if height > 0
-                self.unverified_tx[tx_hash] = tx_height
+                if self.unverified_tx.get(tx_hash) != tx_height:
+                    self.unverified_tx[tx_hash] = tx_height
+                    self._invalidate_balances(tx_hash)
+            if self.verifier and tx_height > 0:
+                self.verifier.wake_up()
 
     def remove_unverified_tx(self, tx_hash, tx_height):
         with self.lock:
             new_height = self.unverified_tx.get(tx_hash)
             if new_height == tx_height:
                 self.unverified_tx.pop(tx_hash, None)
+                self._invalidate_balances(tx_hash)
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
         # Remove from the unverified map and add to the verified map
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
-            self.verified_tx[tx_hash] = info
+            self._set_verified_tx(tx_hash, info)
+            self._invalidate_balances(tx_hash)
         tx_mined_status = self.get_tx_height(tx_hash)
         self.network.trigger_callback('verified', self, tx_hash, tx_mined_status)
 
@@ -583,16 +796,42 @@ class AddressSynchronizer(PrintError):
         with self.lock:
             return dict(self.unverified_tx)  # copy
 
+    def _set_verified_tx(self, tx_hash: str, info: TxMinedInfo) -> None:
+        self._pop_verified_tx(tx_hash)
+        if info.header_hash is not None:
+            # shared by the txs of the same block
+            info = info._replace(header_hash=sys.intern(info.header_hash))
+        self.verified_tx[tx_hash] = info
+        txids = self._verified_tx_by_height.get(info.height)
+        if txids is None:
+            txids = self._verified_tx_by_height[info.height] = set()
+            bisect.insort(self._verified_tx_heights, info.height)
+        txids.add(tx_hash)
+
+    def _pop_verified_tx(self, tx_hash: str) -> Optional[TxMinedInfo]:
+        info = self.verified_tx.pop(tx_hash, None)
+        if info is None:
+            return None
+        txids = self._verified_tx_by_height[info.height]
+        txids.discard(tx_hash)
+        if not txids:
+            del self._verified_tx_by_height[info.height]
+            idx = bisect.bisect_left(self._verified_tx_heights, info.height)
+            del self._verified_tx_heights[idx]
+        return info
+
     def undo_verifications(self, blockchain, height):
         '''Used by the verifier when a reorg has happened'''
         txs = set()
         with self.lock:
-            for tx_hash, info in list(self.verified_tx.items()):
-                tx_height = info.height
-                if tx_height >= height:
-                    header = blockchain.read_header(tx_height)
-                    if not header or hash_header(header) != info.header_hash:
-                        self.verified_tx.pop(tx_hash, None)
+            idx = bisect.bisect_left(self._verified_tx_heights, height)
+            for tx_height in self._verified_tx_heights[idx:]:
+                header = blockchain.read_header(tx_height)
+                header_hash = hash_header(header) if header else None
+                for tx_hash in list(self._verified_tx_by_height[tx_height]):
+                    info = self.verified_tx[tx_hash]
+                    if header_hash != info.header_hash:
+                        self._pop_verified_tx(tx_hash)
                         # NOTE: we should add these txns to self.unverified_tx,
                         # but with what height?
                         # If on the new fork after the reorg, the txn is at the
@@ -603,6 +842,7 @@ class AddressSynchronizer(PrintError):
                         # into unverified_tx with the old height, and if we get
                         # a status update, that will overwrite it.
                         self.unverified_tx[tx_hash] = tx_height
+                        self._invalidate_balances(tx_hash)
                         txs.add(tx_hash)
         return txs
 
@@ -646,12 +886,12 @@ class AddressSynchronizer(PrintError):
         """effect of tx on address"""
         delta = 0
         # substract the value of coins sent from address
-        d = self.txi.get(tx_hash, {}).get(address, [])
-        for n, v in d:
+        d = self.txi.get(tx_hash, {}).get(address, {})
+        for v in d.values():
             delta -= v
         # add the value of the coins received at address
-        d = self.txo.get(tx_hash, {}).get(address, [])
-        for n, v, cb in d:
+        d = self.txo.get(tx_hash, {}).get(address, {})
+        for v, cb in d.values():
             delta += v
         return delta
 
@@ -660,10 +900,10 @@ class AddressSynchronizer(PrintError):
         """effect of tx on the entire domain"""
         delta = 0
         for addr, d in self.txi.get(txid, {}).items():
-            for n, v in d:
+            for v in d.values():
                 delta -= v
         for addr, d in self.txo.get(txid, {}).items():
-            for n, v, cb in d:
+            for v, cb in d.values():
                 delta += v
         return delta
 
@@ -679,13 +919,8 @@ class AddressSynchronizer(PrintError):
             if self.is_mine(addr):
                 is_mine = True
                 is_relevant = True
-                d = self.txo.get(txin['prevout_hash'], {}).get(addr, [])
-                for n, v, cb in d:
-                    if n == txin['prevout_n']:
-                        value = v
-                        break
-                else:
-                    value = None
+                d = self.txo.get(txin['prevout_hash'], {}).get(addr, {})
+                value, cb = d.get(txin['prevout_n'], (None, None))
                 if value is None:
                     is_pruned = True
                 else:
@@ -740,16 +975,29 @@ class AddressSynchronizer(PrintError):
             received = {}
             sent = {}
             for tx_hash, height in h:
-                l = self.txo.get(tx_hash, {}).get(address, [])
-                for n, v, is_cb in l:
+                l = self.txo.get(tx_hash, {}).get(address, {})
+                for n, (v, is_cb) in l.items():
                     received[tx_hash + ':%d'%n] = (height, v, is_cb)
             for tx_hash, height in h:
-                l = self.txi.get(tx_hash, {}).get(address, [])
-                for txi, v in l:
+                l = self.txi.get(tx_hash, {}).get(address, {})
+                for txi in l:
                     sent[txi] = height
         return received, sent
 
     def get_addr_utxo(self, address):
+        with self.lock, self.transaction_lock:
+            utxos = self._get_addr_utxo(address)
+            return {txo: dict(x) for txo, x in utxos.items()}
+
+    def _get_addr_utxo(self, address):
+        """Like get_addr_utxo, but the coins are not copied and must
+        not be modified. Call with self.lock and self.transaction_lock."""
+        if not self.is_mine(address):
+            return self._compute_addr_utxo(address)
+        self._refresh_addr_caches({address})
+        return self._addr_utxos.get(address, {})
+
+    def _compute_addr_utxo(self, address):
         coins, spent = self.get_addr_io(address)
         for txi in spent:
             coins.pop(txi)
@@ -778,6 +1026,42 @@ class AddressSynchronizer(PrintError):
         """Return the balance of a bitcoin address:
         confirmed and matured, unconfirmed, unmatured
         """
+        with self.lock, self.transaction_lock:
+            if not self.is_mine(address):
+                return self._compute_addr_balance(address)
+            self._refresh_addr_caches({address})
+            return self._addr_balances.get(address, (0, 0, 0))
+
+    def _refresh_addr_caches(self, addresses=None):
+        """Recomputes the stale balances and utxos in the cache, only those
+        of addresses if given. Call with self.lock and self.transaction_lock."""
+        local_height = self.get_local_height()
+        if local_height != self._balance_local_height:
+            # coinbase outputs may have matured
+            self._dirty_addrs |= self._coinbase_addrs
+            self._balance_local_height = local_height
+        if addresses is None:
+            stale, self._dirty_addrs = self._dirty_addrs, set()
+        else:
+            stale = self._dirty_addrs & addresses
+            self._dirty_addrs -= stale
+        total = self._total_balance
+        for addr in stale:
+            is_mine = self.is_mine(addr)
+            old = self._addr_balances.pop(addr, (0, 0, 0))
+            new = self._compute_addr_balance(addr) if is_mine else (0, 0, 0)
+            if new != (0, 0, 0):
+                self._addr_balances[addr] = new
+            total = tuple(t - o + n for t, o, n in zip(total, old, new))
+            utxos = self._compute_addr_utxo(addr) if is_mine else {}
+            if utxos:
+                self._addr_utxos[addr] = utxos
+            else:
+                self._addr_utxos.pop(addr, None)
+        self._total_balance = total
+
+    @with_local_height_cached
+    def _compute_addr_balance(self, address):
         received, sent = self.get_addr_io(address)
         c = u = x = 0
         local_height = self.get_local_height()
@@ -798,27 +1082,33 @@ class AddressSynchronizer(PrintError):
     @with_local_height_cached
     def get_utxos(self, domain=None, excluded=None, mature=False, confirmed_only=False, nonlocal_only=False):
         coins = []
-        if domain is None:
-            domain = self.get_addresses()
-        domain = set(domain)
-        if excluded:
-            domain = set(domain) - excluded
-        for addr in domain:
-            utxos = self.get_addr_utxo(addr)
-            for x in utxos.values():
-                if confirmed_only and x['height'] <= 0:
-                    continue
-                if nonlocal_only and x['height'] == TX_HEIGHT_LOCAL:
-                    continue
-                if mature and x['coinbase'] and x['height'] + COINBASE_MATURITY > self.get_local_height():
-                    continue
-                coins.append(x)
-                continue
+        local_height = self.get_local_height()
+        with self.lock, self.transaction_lock:
+            if domain is None:
+                # only the addresses that have coins
+                self._refresh_addr_caches()
+                domain = self._addr_utxos.keys()
+            domain = set(domain)
+            if excluded:
+                domain -= set(excluded)
+            for addr in domain:
+                utxos = self._get_addr_utxo(addr)
+                for x in utxos.values():
+                    if confirmed_only and x['height'] <= 0:
+                        continue
+                    if nonlocal_only and x['height'] == TX_HEIGHT_LOCAL:
+                        continue
+                    if mature and x['coinbase'] and x['height'] + COINBASE_MATURITY > local_height:
+                        continue
+                    coins.append(dict(x))
         return coins
 
+    @with_local_height_cached
     def get_balance(self, domain=None):
         if domain is None:
-            domain = self.get_addresses()
+            with self.lock, self.transaction_lock:
+                self._refresh_addr_caches()
+                return self._total_balance
         domain = set(domain)
         cc = uu = xx = 0
         for addr in domain:
@@ -21,11 +21,15 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
+import json
+import mmap
+import time
 import threading
-from typing import Optional, Dict
+import hashlib
+from typing import Optional, Dict, Tuple
 
 from . import util
-from .bitcoin import hash_encode, int_to_hex, rev_hex
+from .bitcoin import hash_encode, hash_decode, int_to_hex, rev_hex
 from .crypto import sha256d
 from . import constants
 from .util import bfh, bh2u
@@ -33,6 +37,18 @@ from .simple_config import SimpleConfig
 
 
 HEADER_SIZE = 80  # bytes
+NULL_HEADER = bytes(HEADER_SIZE)
+HASH_SIZE = 32  # bytes
+NULL_HASH_BYTES = bytes(HASH_SIZE)
+# header hashes are cached in memory in segments of this many headers
+HASH_CACHE_SEGMENT_SIZE = 2016
+# appended headers are buffered in memory and written to disk in batches,
+# after at most this many seconds ('headers_flush_interval' config; 0 disables)...
+DEFAULT_HEADERS_FLUSH_INTERVAL = 5
+# ...or as soon as this many bytes are pending
+HEADERS_FLUSH_MAX_PENDING = 8 * 2016 * HEADER_SIZE
+# number of most recent headers of each chain that are in the hash index
+HASH_INDEX_WINDOW = 2016
 MAX_TARGET = 0x00000000FFFF0000000000000000000000000000000000000000000000000000
 
 
@@ -97,6 +113,7 @@ def read_blockchains(config: 'SimpleConfig'):
         header_after_cp = best_chain.read_header(constants.net.max_checkpoint()+1)
         if not header_after_cp or not best_chain.can_connect(header_after_cp, check_height=False):
             util.print_error("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
+            best_chain.close_headers_file()
             os.unlink(best_chain.path())
             best_chain.update_size()
     # forks
@@ -106,8 +123,10 @@ def read_blockchains(config: 'SimpleConfig'):
     l = filter(lambda x: x.startswith('fork2_') and '.' not in x, os.listdir(fdir))
     l = sorted(l, key=lambda x: int(x.split('_')[1]))  # sort by forkpoint
 
-    def delete_chain(filename, reason):
+    def delete_chain(filename, reason, chain: 'Blockchain'=None):
         util.print_error(f"[blockchain] deleting chain {filename}: {reason}")
+        if chain is not None:
+            chain.close_headers_file()
         os.unlink(os.path.join(fdir, filename))
 
     def instantiate_chain(filename):
@@ -134,10 +153,10 @@ def read_blockchains(config: 'SimpleConfig'):
         # consistency checks
         h = b.read_header(b.forkpoint)
         if first_hash != hash_header(h):
-            delete_chain(filename, "incorrect first hash for chain")
+            delete_chain(filename, "incorrect first hash for chain", b)
             return
         if not b.parent.can_connect(h, check_height=False):
-            delete_chain(filename, "cannot connect chain to parent")
+            delete_chain(filename, "cannot connect chain to parent", b)
             return
         chain_id = b.get_id()
         assert first_hash == chain_id, (first_hash, chain_id)
@@ -145,15 +164,94 @@ def read_blockchains(config: 'SimpleConfig'):
 
     for filename in l:
         instantiate_chain(filename)
+    for b in blockchains.values():
+        b.update_hash_index()
+    load_chainwork_cache(config)
+
+
+# block hash -> (chain id, height), for the most recent headers of each chain
+# and all forkpoints. hits are checked against the chain, so stale entries are harmless.
+_HASH_INDEX = {}  # type: Dict[str, Tuple[str, int]]
+_hash_index_lock = threading.Lock()
+
+
+def _lookup_hash(header_hash: str, height: int) -> Optional['Blockchain']:
+    entry = _HASH_INDEX.get(header_hash)
+    if entry is None:
+        return None
+    chain_id, indexed_height = entry
+    if indexed_height != height:
+        return None
+    with blockchains_lock:
+        b = blockchains.get(chain_id)
+    if b is None or not b.check_hash(height, header_hash):
+        return None
+    return b
 
 
 def get_best_chain() -> 'Blockchain':
     return blockchains[constants.net.GENESIS]
 
-# block hash -> chain work; up to and including that block
+
+def flush_blockchains(force: bool=True) -> None:
+    with blockchains_lock: chains = list(blockchains.values())
+    for b in chains:
+        b.flush(force=force)
+
+# block hash -> (height, chain work); up to and including that block
+# only blocks at the end of retarget periods are cached
 _CHAINWORK_CACHE = {
-    "0000000000000000000000000000000000000000000000000000000000000000": 0,  # virtual block at height -1
-}  # type: Dict[str, int]
+    "0000000000000000000000000000000000000000000000000000000000000000": (-1, 0),  # virtual block at height -1
+}  # type: Dict[str, Tuple[int, int]]
+_chainwork_cache_lock = threading.RLock()
+_chainwork_cache_dirty = False
+
+
+def _chainwork_cache_path(config: 'SimpleConfig') -> str:
+    return os.path.join(util.get_headers_dir(config), 'chainwork_cache')
+
+
+def load_chainwork_cache(config: 'SimpleConfig') -> None:
+    """Reads the persisted chainwork cache. Entries are keyed by block hash,
+    and only used if the header stored at that height has the same hash.
+    """
+    path = _chainwork_cache_path(config)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.loads(f.read())
+        entries = {block_hash: (int(height), int(work, 16))
+                   for block_hash, (height, work) in data.items()}
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        util.print_error(f"[blockchain] ignoring chainwork cache: {repr(e)}")
+        return
+    with _chainwork_cache_lock:
+        for block_hash, entry in entries.items():
+            _CHAINWORK_CACHE.setdefault(block_hash, entry)
+
+
+def save_chainwork_cache(config: 'SimpleConfig') -> None:
+    global _chainwork_cache_dirty
+    with _chainwork_cache_lock:
+        if not _chainwork_cache_dirty:
+            return
+        data = {block_hash: (height, hex(work))
+                for block_hash, (height, work) in _CHAINWORK_CACHE.items()
+                if height >= 0}
+        s = json.dumps(data, indent=4, sort_keys=True)
+        path = _chainwork_cache_path(config)
+        temp_path = "%s.tmp.%s" % (path, os.getpid())
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(s)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except OSError as e:
+            util.print_error(f"[blockchain] failed to save chainwork cache: {repr(e)}")
+            return
+        _chainwork_cache_dirty = False
 
 
 class Blockchain(util.PrintError):
@@ -174,6 +272,16 @@ class Blockchain(util.PrintError):
         self._forkpoint_hash = forkpoint_hash  # blockhash at forkpoint. "first hash"
         self._prev_hash = prev_hash  # blockhash immediately before forkpoint
         self.lock = threading.RLock()
+        self._mmap = None  # type: Optional[mmap.mmap]
+        # segment index -> raw header hashes of that segment (NULL_HASH_BYTES if not yet computed)
+        self._header_hashes = {}  # type: Dict[int, bytearray]
+        # headers appended after the end of our file, not yet written to disk
+        self._pending = bytearray()
+        self._pending_since = None  # type: Optional[float]
+        # highest height of ours in _HASH_INDEX. the HASH_INDEX_WINDOW
+        # headers up to and including it (above our forkpoint) are indexed.
+        self._hash_index_height = forkpoint - 1
+        self._truncate_partial_header()
         self.update_size()
 
     def with_lock(func):
@@ -220,6 +328,38 @@ class Blockchain(util.PrintError):
         except Exception:
             return False
 
+    def _is_hash_indexed(self, height: int) -> bool:
+        first_indexed = max(self.forkpoint, self._hash_index_height - HASH_INDEX_WINDOW + 1)
+        return first_indexed <= height <= self._hash_index_height
+
+    @with_lock
+    def update_hash_index(self) -> None:
+        """Adds our headers that are within HASH_INDEX_WINDOW of our tip
+        to _HASH_INDEX, and drops the ones that fell out of the window.
+        """
+        chain_id = self.get_id()
+        tip = self.height()
+        start = max(self.forkpoint, tip - HASH_INDEX_WINDOW + 1, self._hash_index_height + 1)
+        added, removed = {}, {}
+        for height in range(start, tip + 1):
+            try:
+                added[self.get_hash(height)] = (chain_id, height)
+            except MissingHeader:
+                pass
+            old_height = height - HASH_INDEX_WINDOW
+            if old_height > self.forkpoint:
+                try:
+                    removed[self.get_hash(old_height)] = (chain_id, old_height)
+                except MissingHeader:
+                    pass
+        added[self._forkpoint_hash] = (chain_id, self.forkpoint)
+        with _hash_index_lock:
+            for header_hash, entry in removed.items():
+                if _HASH_INDEX.get(header_hash) == entry:
+                    del _HASH_INDEX[header_hash]
+            _HASH_INDEX.update(added)
+        self._hash_index_height = tip
+
     def fork(parent, header: dict) -> 'Blockchain':
         if not parent.can_connect(header, check_height=False):
             raise Exception("forking header does not connect to parent chain")
@@ -236,6 +376,7 @@ class Blockchain(util.PrintError):
         chain_id = self.get_id()
         with blockchains_lock:
             blockchains[chain_id] = self
+        self.update_hash_index()
         return self
 
     @with_lock
@@ -248,9 +389,73 @@ class Blockchain(util.PrintError):
 
     @with_lock
     def update_size(self) -> None:
+        """Re-reads the size of the headers file from disk, dropping
+        the file mapping and all cached header hashes.
+        """
+        self.flush()
+        self.close_headers_file()
+        self._header_hashes.clear()
+        self._hash_index_height = self.forkpoint - 1
         p = self.path()
         self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
 
+    @with_lock
+    def close_headers_file(self) -> None:
+        """Releases the memory mapping of the headers file, if any.
+        Must be called before the file is truncated, replaced or deleted.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _get_mmap(self) -> mmap.mmap:
+        """Returns a read-only memory mapping of the headers file,
+        (re)mapping the file if it has grown since it was last mapped.
+        """
+        if self._mmap is None or len(self._mmap) < self._flushed_size() * HEADER_SIZE:
+            self.close_headers_file()
+            name = self.path()
+            self.assert_headers_file_available(name)
+            with open(name, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _flushed_size(self) -> int:
+        """Number of headers in our file on disk; the rest are pending."""
+        return self._size - len(self._pending) // HEADER_SIZE
+
+    def _truncate_partial_header(self) -> None:
+        """Crash recovery: an interrupted write might have left
+        a partially written header at the end of our file.
+        """
+        p = self.path()
+        if not os.path.exists(p):
+            return
+        size = os.path.getsize(p)
+        if size % HEADER_SIZE == 0:
+            return
+        self.print_error(f"truncating partially written header at the end of {p}")
+        with open(p, 'rb+') as f:
+            f.truncate(size - size % HEADER_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _invalidate_header_hashes(self, from_delta: int, to_delta: int=None) -> None:
+        """Forgets the cached hashes of headers at positions [from_delta, to_delta)
+        in our file. If to_delta is None, everything from from_delta onwards is forgotten.
+        """
+        for seg_idx, seg in list(self._header_hashes.items()):
+            seg_start = seg_idx * HASH_CACHE_SEGMENT_SIZE
+            seg_end = seg_start + HASH_CACHE_SEGMENT_SIZE
+            start = max(from_delta, seg_start)
+            end = seg_end if to_delta is None else min(to_delta, seg_end)
+            if start >= end:
+                continue
+            if start == seg_start and end == seg_end:
+                del self._header_hashes[seg_idx]
+            else:
+                seg[(start-seg_start)*HASH_SIZE:(end-seg_start)*HASH_SIZE] = bytes((end-start)*HASH_SIZE)
+
     @classmethod
     def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None) -> None:
         _hash = hash_header(header)
@@ -268,20 +473,54 @@ class Blockchain(util.PrintError):
             raise Exception(f"insufficient proof of work: {block_hash_as_num} vs target {target}")
 
     def verify_chunk(self, index: int, data: bytes) -> None:
+        """Verifies a chunk of raw headers, raising on failure.
+        Works directly on the raw bytes: each header is hashed once, and its
+        prev_block_hash and bits fields are compared by byte offset,
+        without deserializing headers into dicts or converting to hex.
+        """
         num = len(data) // HEADER_SIZE
         start_height = index * 2016
-        prev_hash = self.get_hash(start_height - 1)
+        prev_hash = hash_decode(self.get_hash(start_height - 1))
         target = self.get_target(index-1)
+        check_pow = not constants.net.TESTNET
+        if check_pow:
+            bits = self.target_to_bits(target).to_bytes(4, byteorder='little')
+        # we might already have some of these headers; if so, they must match
+        max_known_height = max(self.height(), constants.net.max_checkpoint())
+        data = memoryview(data)
         for i in range(num):
             height = start_height + i
-            try:
-                expected_header_hash = self.get_hash(height)
-            except MissingHeader:
-                expected_header_hash = None
             raw_header = data[i*HEADER_SIZE : (i+1)*HEADER_SIZE]
-            header = deserialize_header(raw_header, index*2016 + i)
-            self.verify_header(header, prev_hash, target, expected_header_hash)
-            prev_hash = hash_header(header)
+            _hash = hashlib.sha256(hashlib.sha256(raw_header).digest()).digest()
+            if height <= max_known_height:
+                expected_header_hash = self._get_raw_header_hash_if_known(height)
+                if expected_header_hash is not None and expected_header_hash != _hash:
+                    raise Exception("hash mismatches with expected: {} vs {}"
+                                    .format(hash_encode(expected_header_hash), hash_encode(_hash)))
+            if raw_header[4:36] != prev_hash:
+                raise Exception("prev hash mismatch: %s vs %s"
+                                % (hash_encode(prev_hash), hash_encode(bytes(raw_header[4:36]))))
+            if check_pow:
+                if raw_header[72:76] != bits:
+                    raise Exception("bits mismatch: %s vs %s"
+                                    % (int.from_bytes(bits, byteorder='little'),
+                                       int.from_bytes(raw_header[72:76], byteorder='little')))
+                block_hash_as_num = int.from_bytes(_hash, byteorder='little')
+                if block_hash_as_num > target:
+                    raise Exception(f"insufficient proof of work: {block_hash_as_num} vs target {target}")
+            prev_hash = _hash
+
+    def _get_raw_header_hash_if_known(self, height: int) -> Optional[bytes]:
+        within_cp_range = height <= constants.net.max_checkpoint()
+        if height == 0:
+            return hash_decode(constants.net.GENESIS)
+        if within_cp_range and (height+1) % 2016 == 0:
+            h, t = self.checkpoints[height // 2016]
+            return hash_decode(h)
+        try:
+            return self._get_raw_header_hash(height)
+        except MissingHeader:
+            return None
 
     @with_lock
     def path(self):
@@ -316,6 +555,8 @@ class Blockchain(util.PrintError):
         truncate = not chunk_within_checkpoint_region
         self.write(chunk, delta_bytes, truncate)
         self.swap_with_parent()
+        self.update_hash_index()
+        self.update_chainwork_cache()
 
     def swap_with_parent(self) -> None:
         parent_lock = self.parent.lock if self.parent is not None else threading.Lock()
@@ -337,6 +578,8 @@ class Blockchain(util.PrintError):
         if self.parent.get_chainwork() >= self.get_chainwork():
             return False
         self.print_error("swap", self.forkpoint, self.parent.forkpoint)
+        self.flush()
+        self.parent.flush()
         parent_branch_size = self.parent.height() - self.forkpoint + 1
         forkpoint = self.forkpoint  # type: Optional[int]
         parent = self.parent  # type: Optional[Blockchain]
@@ -355,6 +598,8 @@ class Blockchain(util.PrintError):
             parent_data = f.read(parent_branch_size*HEADER_SIZE)
         self.write(parent_data, 0)
         parent.write(my_data, (forkpoint - parent.forkpoint)*HEADER_SIZE)
+        self.flush()
+        parent.flush()
         # swap parameters
         self.parent, parent.parent = parent.parent, self  # type: Optional[Blockchain], Optional[Blockchain]
         self.forkpoint, parent.forkpoint = parent.forkpoint, self.forkpoint
@@ -369,6 +614,8 @@ class Blockchain(util.PrintError):
         blockchains.pop(parent_old_id, None)
         blockchains[self.get_id()] = self
         blockchains[parent.get_id()] = parent
+        self.update_hash_index()
+        parent.update_hash_index()
         return True
 
     def get_id(self) -> str:
@@ -384,8 +631,16 @@ class Blockchain(util.PrintError):
 
     @with_lock
     def write(self, data: bytes, offset: int, truncate: bool=True) -> None:
+        is_append = offset == self._size * HEADER_SIZE and len(data) % HEADER_SIZE == 0
+        if is_append and self.config.get('headers_flush_interval', DEFAULT_HEADERS_FLUSH_INTERVAL) > 0:
+            self._append_pending(data)
+            return
+        self.flush()
         filename = self.path()
         self.assert_headers_file_available(filename)
+        # accessing a truncated region of a memory mapped file is fatal,
+        # so the mapping must go first. it is re-created lazily when reading.
+        self.close_headers_file()
         with open(filename, 'rb+') as f:
             if truncate and offset != self._size * HEADER_SIZE:
                 f.seek(offset)
@@ -394,7 +649,47 @@ class Blockchain(util.PrintError):
             f.write(data)
             f.flush()
             os.fsync(f.fileno())
-        self.update_size()
+        first_delta = offset // HEADER_SIZE
+        end_delta = (offset + len(data)) // HEADER_SIZE
+        self._hash_index_height = min(self._hash_index_height, self.forkpoint + first_delta - 1)
+        if truncate:
+            self._invalidate_header_hashes(first_delta)
+            self._size = end_delta
+        else:
+            last_delta = (offset + len(data) + HEADER_SIZE - 1) // HEADER_SIZE
+            self._invalidate_header_hashes(first_delta, last_delta)
+            self._size = max(self._size, end_delta)
+
+    def _append_pending(self, data: bytes) -> None:
+        first_delta = self._size
+        self._pending += data
+        self._size += len(data) // HEADER_SIZE
+        self._invalidate_header_hashes(first_delta, self._size)
+        if self._pending_since is None:
+            self._pending_since = time.time()
+        self.flush(force=len(self._pending) >= HEADERS_FLUSH_MAX_PENDING)
+
+    @with_lock
+    def flush(self, force: bool=True) -> None:
+        """Writes pending headers to disk. Unless force is set, only does so
+        if they have been pending for longer than the flush interval.
+        """
+        if not self._pending:
+            return
+        if not force:
+            interval = self.config.get('headers_flush_interval', DEFAULT_HEADERS_FLUSH_INTERVAL)
+            if time.time() - self._pending_since < interval:
+                return
+        filename = self.path()
+        self.assert_headers_file_available(filename)
+        self.close_headers_file()
+        with open(filename, 'rb+') as f:
+            f.seek(self._flushed_size() * HEADER_SIZE)
+            f.write(self._pending)
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = bytearray()
+        self._pending_since = None
 
     @with_lock
     def save_header(self, header: dict) -> None:
@@ -405,6 +700,8 @@ class Blockchain(util.PrintError):
         assert len(data) == HEADER_SIZE
         self.write(data, delta*HEADER_SIZE)
         self.swap_with_parent()
+        self.update_hash_index()
+        self.update_chainwork_cache()
 
     @with_lock
     def read_header(self, height: int) -> Optional[dict]:
@@ -414,18 +711,53 @@ class Blockchain(util.PrintError):
             return self.parent.read_header(height)
         if height > self.height():
             return
-        delta = height - self.forkpoint
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            if len(h) < HEADER_SIZE:
-                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
-        if h == bytes([0])*HEADER_SIZE:
+        h = self._read_raw_header(height)
+        if h == NULL_HEADER:
             return None
         return deserialize_header(h, height)
 
+    def _read_raw_header(self, height: int) -> bytes:
+        """Returns the raw header at given height from our own file.
+        Caller must hold self.lock, and height must be within our file.
+        """
+        delta = height - self.forkpoint
+        flushed_size = self._flushed_size()
+        if delta >= flushed_size:
+            offset = (delta - flushed_size) * HEADER_SIZE
+            h = bytes(self._pending[offset:offset + HEADER_SIZE])
+        else:
+            h = self._get_mmap()[delta * HEADER_SIZE:(delta + 1) * HEADER_SIZE]
+        if len(h) < HEADER_SIZE:
+            raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
+        return h
+
+    @with_lock
+    def _get_raw_header_hash(self, height: int) -> bytes:
+        """Returns the hash of the header at given height, in internal byte order.
+        Hashes are cached in memory, so repeated lookups neither touch
+        the headers file nor re-hash the header.
+        """
+        if height < 0:
+            raise MissingHeader(height)
+        if height < self.forkpoint:
+            return self.parent._get_raw_header_hash(height)
+        if height > self.height():
+            raise MissingHeader(height)
+        delta = height - self.forkpoint
+        seg_idx, pos = divmod(delta, HASH_CACHE_SEGMENT_SIZE)
+        seg = self._header_hashes.get(seg_idx)
+        if seg is None:
+            seg = self._header_hashes[seg_idx] = bytearray(HASH_CACHE_SEGMENT_SIZE * HASH_SIZE)
+        h = bytes(seg[pos * HASH_SIZE:(pos + 1) * HASH_SIZE])
+        if h != NULL_HASH_BYTES:
+            return h
+        raw_header = self._read_raw_header(height)
+        if raw_header == NULL_HEADER:
+            raise MissingHeader(height)
+        h = sha256d(raw_header)
+        seg[pos * HASH_SIZE:(pos + 1) * HASH_SIZE] = h
+        return h
+
     def get_hash(self, height: int) -> str:
         def is_height_checkpoint():
             within_cp_range = height <= constants.net.max_checkpoint()
@@ -441,10 +773,7 @@ class Blockchain(util.PrintError):
             h, t = self.checkpoints[index]
             return h
         else:
-            header = self.read_header(height)
-            if header is None:
-                raise MissingHeader(height)
-            return hash_header(header)
+            return hash_encode(self._get_raw_header_hash(height))
 
     def get_target(self, index: int) -> int:
         # compute target from chunk x, used in chunk x+1
@@ -507,25 +836,51 @@ class Blockchain(util.PrintError):
             # On testnet/regtest, difficulty works somewhat different.
             # It's out of scope to properly implement that.
             return height
+        global _chainwork_cache_dirty
         last_retarget = height // 2016 * 2016 - 1
         cached_height = last_retarget
-        while _CHAINWORK_CACHE.get(self.get_hash(cached_height)) is None:
+        while self._get_cached_chainwork(cached_height) is None:
             if cached_height <= -1:
                 break
             cached_height -= 2016
         assert cached_height >= -1, cached_height
-        running_total = _CHAINWORK_CACHE[self.get_hash(cached_height)]
+        running_total = self._get_cached_chainwork(cached_height)
         while cached_height < last_retarget:
             cached_height += 2016
             work_in_single_header = self.chainwork_of_header_at_height(cached_height)
             work_in_chunk = 2016 * work_in_single_header
             running_total += work_in_chunk
-            _CHAINWORK_CACHE[self.get_hash(cached_height)] = running_total
+            with _chainwork_cache_lock:
+                _CHAINWORK_CACHE[self.get_hash(cached_height)] = (cached_height, running_total)
+                _chainwork_cache_dirty = True
         cached_height += 2016
         work_in_single_header = self.chainwork_of_header_at_height(cached_height)
         work_in_last_partial_chunk = (height % 2016 + 1) * work_in_single_header
         return running_total + work_in_last_partial_chunk
 
+    def _get_cached_chainwork(self, height: int) -> Optional[int]:
+        try:
+            block_hash = self.get_hash(height)
+        except MissingHeader:
+            return None
+        entry = _CHAINWORK_CACHE.get(block_hash)
+        if entry is None:
+            return None
+        cached_height, work = entry
+        if cached_height != height:
+            return None
+        return work
+
+    def update_chainwork_cache(self) -> None:
+        """Extends the chainwork cache up to our tip and persists new entries."""
+        if constants.net.TESTNET:
+            return
+        try:
+            self.get_chainwork()
+        except MissingHeader:
+            return
+        save_chainwork_cache(self.config)
+
     def can_connect(self, header: dict, check_height: bool=True) -> bool:
         if header is None:
             return False
@@ -577,14 +932,24 @@ class Blockchain(util.PrintError):
 def check_header(header: dict) -> Optional[Blockchain]:
     if type(header) is not dict:
         return None
+    header_hash = hash_header(header)
+    height = header.get('block_height')
+    b = _lookup_hash(header_hash, height)
+    if b is not None:
+        return b
+    # the header can still be in a chain that has it outside the indexed window
     with blockchains_lock: chains = list(blockchains.values())
     for b in chains:
-        if b.check_header(header):
+        if b.forkpoint <= height and not b._is_hash_indexed(height) and b.check_hash(height, header_hash):
             return b
     return None
 
 
 def can_connect(header: dict) -> Optional[Blockchain]:
+    height = header['block_height']
+    b = _lookup_hash(header['prev_block_hash'], height - 1) if height > 0 else None
+    if b is not None and b.can_connect(header):
+        return b
     with blockchains_lock: chains = list(blockchains.values())
     for b in chains:
         if b.can_connect(header):
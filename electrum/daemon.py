@@ -46,6 +46,10 @@ from .exchange_rate import FxThread
 from .plugin import run_hook
 
 
+# how often (in seconds) Daemon.run checks that the parent thread is still alive
+DAEMON_CHECK_INTERVAL = 1
+
+
 def get_lockfile(config: SimpleConfig):
     return os.path.join(config.path, 'daemon')
 
@@ -139,6 +143,7 @@ class Daemon(DaemonThread):
             self.network.start([self.fx.run])
         self.gui = None
         self.wallets = {}  # type: Dict[str, Abstract_Wallet]
+        self._stopped = threading.Event()
         # Setup JSONRPC server
         self.server = None
         if listen_jsonrpc:
@@ -160,7 +165,6 @@ class Daemon(DaemonThread):
         os.write(fd, bytes(repr((server.socket.getsockname(), time.time())), 'utf8'))
         os.close(fd)
         self.server = server
-        server.timeout = 0.1
         server.register_function(self.ping, 'ping')
         server.register_function(self.run_gui, 'gui')
         server.register_function(self.run_daemon, 'daemon')
@@ -176,7 +180,7 @@ class Daemon(DaemonThread):
         asyncio.set_event_loop(self.asyncio_loop)
         config = SimpleConfig(config_options)
         sub = config.get('subcommand')
-        assert sub in [None, 'start', 'stop', 'status', 'load_wallet', 'close_wallet']
+        assert sub in [None, 'start', 'stop', 'status', 'load_wallet', 'close_wallet', 'rpc_stats']
         if sub in [None, 'start']:
             response = "Daemon already running"
         elif sub == 'load_wallet':
@@ -212,9 +216,18 @@ class Daemon(DaemonThread):
                                 for k, w in self.wallets.items()},
                     'current_wallet': current_wallet_path,
                     'fee_per_kb': self.config.fee_per_kb(),
+                    'rpc_stats': self.network.rpc_stats.get_summary(),
+                    'subscriptions': self.network.subscription_manager.get_queue_depths(),
+                    'sync_queues': {k: w.synchronizer.get_queue_depths()
+                                    for k, w in self.wallets.items() if w.synchronizer},
                 }
             else:
                 response = "Daemon offline"
+        elif sub == 'rpc_stats':
+            if self.network:
+                response = self.network.rpc_stats.to_json()
+            else:
+                response = "Daemon offline"
         elif sub == 'stop':
             self.stop()
             response = "Daemon stopped"
@@ -298,8 +311,13 @@ class Daemon(DaemonThread):
         return result
 
     def run(self):
+        if self.server:
+            # requests are served in their own thread; this one waits until we are stopped
+            threading.Thread(target=self.server.serve_forever, name='JSONRPC', daemon=True).start()
         while self.is_running():
-            self.server.handle_request() if self.server else time.sleep(0.1)
+            self._stopped.wait(DAEMON_CHECK_INTERVAL)  # also notices if the parent thread died
+        if self.server:
+            self.server.shutdown()
         # stop network/wallets
         for k, wallet in self.wallets.items():
             wallet.stop_threads()
@@ -317,6 +335,7 @@ class Daemon(DaemonThread):
         self.print_error("stopping, removing lockfile")
         remove_lockfile(get_lockfile(self.config))
         DaemonThread.stop(self)
+        self._stopped.set()
 
     def init_gui(self, config, plugins):
         threading.current_thread().setName('GUI')
@@ -15,7 +15,6 @@ from typing import Sequence
 from .bitcoin import COIN
 from .i18n import _
 from .util import PrintError, ThreadJob, make_dir, log_exceptions
-from .util import make_aiohttp_session
 from .network import Network
 from .simple_config import SimpleConfig
 
@@ -40,17 +39,17 @@ class ExchangeBase(PrintError):
     async def get_raw(self, site, get_string):
         # APIs must have https
         url = ''.join(['https://', site, get_string])
-        async with make_aiohttp_session(Network.get_instance().proxy) as session:
-            async with session.get(url) as response:
-                return await response.text()
+        session = Network.get_instance().get_http_session()
+        async with session.get(url) as response:
+            return await response.text()
 
     async def get_json(self, site, get_string):
         # APIs must have https
         url = ''.join(['https://', site, get_string])
-        async with make_aiohttp_session(Network.get_instance().proxy) as session:
-            async with session.get(url) as response:
-                # set content_type to None to disable checking MIME type
-                return await response.json(content_type=None)
+        session = Network.get_instance().get_http_session()
+        async with session.get(url) as response:
+            # set content_type to None to disable checking MIME type
+            return await response.json(content_type=None)
 
     async def get_csv(self, site, get_string):
         raw = await self.get_raw(site, get_string)
@@ -26,10 +26,15 @@ import os
 import re
 import ssl
 import sys
+import time
+import math
+import json
+import bisect
+import threading
 import traceback
 import asyncio
-from typing import Tuple, Union, List, TYPE_CHECKING, Optional
-from collections import defaultdict
+from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Dict, Sequence, Any
+from collections import defaultdict, deque
 
 import aiorpcx
 from aiorpcx import RPCSession, Notification
@@ -51,17 +56,357 @@ if TYPE_CHECKING:
 
 ca_path = certifi.where()
 
+# max number of requests in a single JSON-RPC batch
+MAX_BATCH_REQUEST_SIZE = 100
+
 
 class NetworkTimeout:
     # seconds
     class Generic:
+        MIN = 10
         NORMAL = 30
         RELAXED = 45
         MOST_RELAXED = 180
     class Urgent(Generic):
+        MIN = 5
         NORMAL = 10
         RELAXED = 20
         MOST_RELAXED = 60
+    # adaptive timeouts are this multiple of the 95th percentile of a server's
+    # request latency, clamped between MIN and RELAXED
+    ADAPTIVE_FACTOR = 10
+
+
+class ServerStats:
+    """Connection and request statistics of a server.
+    Kept by the network across sessions, and saved alongside recent_servers.
+    """
+    MAX_LATENCY_SAMPLES = 100
+    MIN_LATENCY_SAMPLES = 10  # for percentiles
+    DEFAULT_LATENCY = 1.0  # seconds; assumed for servers we know nothing about
+    MAX_NUM_ATTEMPTS = 1000  # older attempts are forgotten gradually
+
+    def __init__(self, d: dict=None):
+        d = d or {}
+        self.connect_time = d.get('connect_time')  # type: Optional[float]  # seconds; moving average
+        self.ping_time = d.get('ping_time')  # type: Optional[float]  # seconds; moving average
+        self.latencies = [float(x) for x in d.get('latencies', [])][-self.MAX_LATENCY_SAMPLES:]
+        self.num_attempts = int(d.get('num_attempts', 0))  # connections and requests
+        self.num_failures = int(d.get('num_failures', 0))  # failed connections and timeouts
+        self.last_seen = d.get('last_seen', 0)
+
+    def to_json(self) -> dict:
+        return {
+            'connect_time': self.connect_time,
+            'ping_time': self.ping_time,
+            'latencies': [round(x, 4) for x in self.latencies],
+            'num_attempts': self.num_attempts,
+            'num_failures': self.num_failures,
+            'last_seen': self.last_seen,
+        }
+
+    @staticmethod
+    def _moving_average(old: Optional[float], new: float) -> float:
+        return new if old is None else 0.8 * old + 0.2 * new
+
+    def _add_attempt(self, failed: bool) -> None:
+        if self.num_attempts >= self.MAX_NUM_ATTEMPTS:
+            self.num_attempts //= 2
+            self.num_failures //= 2
+        self.num_attempts += 1
+        self.num_failures += int(failed)
+
+    def record_connect(self, seconds: float) -> None:
+        self.connect_time = self._moving_average(self.connect_time, seconds)
+        self.last_seen = int(time.time())
+        self._add_attempt(failed=False)
+
+    def record_connect_failure(self) -> None:
+        self._add_attempt(failed=True)
+
+    def record_ping(self, seconds: float) -> None:
+        self.ping_time = self._moving_average(self.ping_time, seconds)
+        self.last_seen = int(time.time())
+
+    def record_request(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+        del self.latencies[:-self.MAX_LATENCY_SAMPLES]
+        self._add_attempt(failed=False)
+
+    def record_timeout(self) -> None:
+        self._add_attempt(failed=True)
+
+    def get_latency_percentile(self, percentile: float) -> Optional[float]:
+        if len(self.latencies) < self.MIN_LATENCY_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def get_expected_latency(self) -> float:
+        for latency in (self.get_latency_percentile(50), self.ping_time, self.connect_time):
+            if latency is not None:
+                return latency
+        return self.DEFAULT_LATENCY
+
+    def get_score(self) -> float:
+        """Higher is better. Used as weight when picking servers."""
+        success_rate = (1 + self.num_attempts - self.num_failures) / (1 + self.num_attempts)
+        return success_rate ** 2 / max(self.get_expected_latency(), 0.01)
+
+    def get_timeout(self, request_type=NetworkTimeout.Generic, *, max_timeout: int=None) -> Optional[int]:
+        """Adaptive timeout, or None if we do not know enough about the server."""
+        latency = self.get_latency_percentile(95)
+        if latency is None:
+            return None
+        if max_timeout is None:
+            max_timeout = request_type.RELAXED
+        timeout = int(math.ceil(NetworkTimeout.ADAPTIVE_FACTOR * latency))
+        return min(max(timeout, request_type.MIN), max_timeout)
+
+
+def _json_size(obj) -> int:
+    """Length of obj encoded as JSON. Cheap for the large results
+    (hex strings) that most bytes on the wire are spent on."""
+    if isinstance(obj, str):
+        return len(obj) + 2
+    try:
+        return len(json.dumps(obj))
+    except (TypeError, ValueError):
+        return 0
+
+
+class MethodStats:
+    """Counters for the requests of one RPC method sent to one server.
+    Sizes are those of the JSON payloads, without JSON-RPC framing.
+    """
+    # upper bounds of the latency histogram buckets, in seconds;
+    # the last bucket has no upper bound
+    LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.errors = defaultdict(int)  # type: Dict[int, int]  # RPC error code -> count
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+
+    def record_request(self, latency: float, bytes_out: int, bytes_in: int, error_code: int=None) -> None:
+        self.count += 1
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        if error_code is not None:
+            self.errors[error_code] += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.latency_histogram[bisect.bisect_left(self.LATENCY_BUCKETS, latency)] += 1
+
+    def record_timeout(self, bytes_out: int) -> None:
+        self.count += 1
+        self.timeouts += 1
+        self.bytes_out += bytes_out
+
+    def get_latency_percentile(self, percentile: float) -> Optional[float]:
+        """Upper bound of the histogram bucket the percentile falls in."""
+        num_answered = sum(self.latency_histogram)
+        if num_answered == 0:
+            return None
+        rank = num_answered * percentile / 100
+        seen = 0
+        for bucket, n in enumerate(self.latency_histogram):
+            seen += n
+            if seen >= rank and n > 0:
+                break
+        if bucket < len(self.LATENCY_BUCKETS):
+            return min(self.LATENCY_BUCKETS[bucket], self.latency_max)
+        return self.latency_max
+
+    def to_json(self) -> dict:
+        num_answered = self.count - self.timeouts
+        return {
+            'count': self.count,
+            'timeouts': self.timeouts,
+            'errors': {str(code): n for code, n in self.errors.items()},
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'latency_avg': self.latency_sum / num_answered if num_answered else None,
+            'latency_p50': self.get_latency_percentile(50),
+            'latency_p95': self.get_latency_percentile(95),
+            'latency_max': self.latency_max,
+            'latency_histogram': dict(zip(['<=%s' % bound for bound in self.LATENCY_BUCKETS]
+                                          + ['>%s' % self.LATENCY_BUCKETS[-1]],
+                                          self.latency_histogram)),
+        }
+
+
+class RpcStats:
+    """Statistics of the requests we send, per server and RPC method.
+    Written to by the sessions on the network thread, read from others.
+    Payload sizes are only measured if measure_sizes, as that means
+    encoding the results again; otherwise they are counted as 0.
+    """
+
+    def __init__(self, measure_sizes: bool=False):
+        self.lock = threading.Lock()
+        self.measure_sizes = measure_sizes
+        self.since = time.time()
+        self.servers = defaultdict(lambda: defaultdict(MethodStats))  # type: Dict[str, Dict[str, MethodStats]]
+
+    def for_server(self, server: str) -> 'ServerRpcStats':
+        return ServerRpcStats(self, server)
+
+    def record_request(self, server: str, method: str, latency: float, bytes_out: int,
+                       bytes_in: int, error_code: int=None) -> None:
+        with self.lock:
+            self.servers[server][method].record_request(latency, bytes_out, bytes_in, error_code)
+
+    def record_timeout(self, server: str, method: str, bytes_out: int) -> None:
+        with self.lock:
+            self.servers[server][method].record_timeout(bytes_out)
+
+    def to_json(self) -> dict:
+        with self.lock:
+            return {
+                'since': int(self.since),
+                'sizes_measured': self.measure_sizes,
+                'servers': {server: {method: stats.to_json() for method, stats in methods.items()}
+                            for server, methods in self.servers.items()},
+            }
+
+    def get_summary(self) -> dict:
+        """Totals per server."""
+        summary = {}
+        with self.lock:
+            for server, methods in self.servers.items():
+                summary[server] = {
+                    'count': sum(stats.count for stats in methods.values()),
+                    'timeouts': sum(stats.timeouts for stats in methods.values()),
+                    'errors': sum(sum(stats.errors.values()) for stats in methods.values()),
+                    'bytes_out': sum(stats.bytes_out for stats in methods.values()),
+                    'bytes_in': sum(stats.bytes_in for stats in methods.values()),
+                }
+        return summary
+
+    def clear(self) -> None:
+        with self.lock:
+            self.servers.clear()
+            self.since = time.time()
+
+
+class ServerRpcStats:
+    """The part of RpcStats that a session writes to."""
+
+    def __init__(self, rpc_stats: RpcStats, server: str):
+        self.rpc_stats = rpc_stats
+        self.server = server
+
+    def record_request(self, method: str, params, result, latency: float) -> None:
+        error_code = None
+        if isinstance(result, aiorpcx.jsonrpc.RPCError):
+            error_code = result.code
+            result = result.message
+        bytes_out = bytes_in = 0
+        if self.rpc_stats.measure_sizes:
+            bytes_out = len(method) + _json_size(params)
+            bytes_in = _json_size(result)
+        self.rpc_stats.record_request(self.server, method, latency, bytes_out, bytes_in, error_code)
+
+    def record_timeout(self, method: str, params) -> None:
+        bytes_out = len(method) + _json_size(params) if self.rpc_stats.measure_sizes else 0
+        self.rpc_stats.record_timeout(self.server, method, bytes_out)
+
+
+class RequestPriority:
+    URGENT = 0       # e.g. broadcasts, block headers
+    INTERACTIVE = 1  # something the user is waiting for
+    BULK = 2         # e.g. wallet synchronization
+
+
+class PrioritySemaphore:
+    """Limits the number of requests in flight. Free slots go to the
+    waiting requests of the highest priority first, FIFO within a priority.
+    Each priority can only use up to its own limit of slots, so that the
+    higher ones always find some free. A waiting request is passed over
+    at most MAX_SKIPS times by requests of higher priority.
+    """
+    MAX_SKIPS = 10
+
+    def __init__(self, size: int, limits: Dict[int, int]):
+        self.size = size
+        self.limits = limits
+        self.num_in_use = 0
+        self.in_use = {priority: 0 for priority in limits}
+        self.waiters = {priority: deque() for priority in limits}  # type: Dict[int, deque]
+        self.skips = {priority: 0 for priority in limits}
+
+    async def acquire(self, priority: int) -> None:
+        fut = asyncio.get_event_loop().create_future()
+        self.waiters[priority].append(fut)
+        self._wake_up()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.cancelled():
+                # it may have been dropped by _wake_up already
+                if fut in self.waiters[priority]:
+                    self.waiters[priority].remove(fut)
+            else:  # we got a slot, but we are not going to use it
+                self.release(priority)
+            raise
+
+    def release(self, priority: int) -> None:
+        self.num_in_use -= 1
+        self.in_use[priority] -= 1
+        self._wake_up()
+
+    def slot(self, priority: int) -> '_PrioritySemaphoreSlot':
+        """Usage: async with semaphore.slot(priority): ..."""
+        return _PrioritySemaphoreSlot(self, priority)
+
+    def _wake_up(self) -> None:
+        while self.num_in_use < self.size:
+            priority = self._pick_priority()
+            if priority is None:
+                return
+            fut = self.waiters[priority].popleft()
+            if fut.done():
+                continue  # cancelled, and not yet removed by its waiter
+            self.num_in_use += 1
+            self.in_use[priority] += 1
+            fut.set_result(None)
+
+    def _pick_priority(self) -> Optional[int]:
+        runnable = [priority for priority in sorted(self.waiters)
+                    if self.waiters[priority] and self.in_use[priority] < self.limits[priority]]
+        if not runnable:
+            return None
+        starving = [priority for priority in runnable if self.skips[priority] >= self.MAX_SKIPS]
+        chosen = starving[-1] if starving else runnable[0]
+        for priority in runnable:
+            if priority > chosen:
+                self.skips[priority] += 1
+        self.skips[chosen] = 0
+        return chosen
+
+    def get_queue_sizes(self) -> Dict[int, int]:
+        return {priority: len(waiters) for priority, waiters in self.waiters.items()}
+
+
+class _PrioritySemaphoreSlot:
+
+    def __init__(self, semaphore: PrioritySemaphore, priority: int):
+        self.semaphore = semaphore
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.semaphore.acquire(self.priority)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.semaphore.release(self.priority)
+
 
 class NotificationSession(RPCSession):
 
@@ -69,8 +414,19 @@ class NotificationSession(RPCSession):
         super(NotificationSession, self).__init__(*args, **kwargs)
         self.subscriptions = defaultdict(list)
         self.cache = {}
-        self.in_flight_requests_semaphore = asyncio.Semaphore(100)
+        self.in_flight_requests_semaphore = PrioritySemaphore(100, {
+            RequestPriority.URGENT: 100,
+            RequestPriority.INTERACTIVE: 90,
+            RequestPriority.BULK: 80,
+        })
         self.default_timeout = NetworkTimeout.Generic.NORMAL
+        self.bulk_timeout = NetworkTimeout.Generic.RELAXED  # for batches and header chunks
+        # request statistics, used to spread requests over servers
+        self.latency = None  # type: Optional[float]  # seconds; moving average
+        self.num_requests = 0
+        self.num_errors = 0  # timeouts
+        self.server_stats = None  # type: Optional[ServerStats]  # shared with the network
+        self.rpc_stats = None  # type: Optional[ServerRpcStats]
 
     async def handle_request(self, request):
         # note: if server sends malformed request and we raise, the superclass
@@ -85,20 +441,90 @@ class NotificationSession(RPCSession):
             else:
                 raise Exception('unexpected request: {}'.format(repr(request)))
 
-    async def send_request(self, *args, timeout=None, **kwargs):
+    async def send_request(self, *args, timeout=None, priority=RequestPriority.INTERACTIVE, **kwargs):
         # note: the timeout starts after the request touches the wire!
         if timeout is None:
             timeout = self.default_timeout
         # note: the semaphore implementation guarantees no starvation
-        async with self.in_flight_requests_semaphore:
+        method, params = args[0], (args[1] if len(args) > 1 else ())
+        async with self.in_flight_requests_semaphore.slot(priority):
+            self.num_requests += 1
+            start = time.time()
             try:
-                return await asyncio.wait_for(
+                response = await asyncio.wait_for(
                     super().send_request(*args, **kwargs),
                     timeout)
             except asyncio.TimeoutError as e:
+                self._record_timeout()
+                if self.rpc_stats is not None:
+                    self.rpc_stats.record_timeout(method, params)
                 raise RequestTimedOut('request timed out: {}'.format(args)) from e
+            except aiorpcx.jsonrpc.RPCError as e:
+                # the server did answer
+                latency = time.time() - start
+                self._record_request(latency)
+                if self.rpc_stats is not None:
+                    self.rpc_stats.record_request(method, params, e, latency)
+                raise
+            latency = time.time() - start
+            self._record_request(latency)
+            if self.rpc_stats is not None:
+                self.rpc_stats.record_request(method, params, response, latency)
+            return response
+
+    async def send_request_batch(self, requests: Sequence[Tuple[str, list]], *, timeout=None,
+                                 priority=RequestPriority.INTERACTIVE) -> List[Any]:
+        """Sends the (method, params) requests as a single JSON-RPC batch.
+        Returns their results in order. The result of a request that failed
+        is the exception (e.g. RPCError) instead.
+        """
+        if timeout is None:
+            timeout = self.bulk_timeout
+        batch = self.send_batch()
+        for method, params in requests:
+            batch.add_request(method, params)
+        async def send_batch():
+            async with batch:
+                pass
+        # note: a batch only takes a single slot
+        async with self.in_flight_requests_semaphore.slot(priority):
+            self.num_requests += 1
+            start = time.time()
+            try:
+                await asyncio.wait_for(send_batch(), timeout)
+            except asyncio.TimeoutError as e:
+                self._record_timeout()
+                if self.rpc_stats is not None:
+                    for method, params in requests:
+                        self.rpc_stats.record_timeout(method + ' (batch)', params)
+                raise RequestTimedOut('batch request timed out: {} requests'.format(len(requests))) from e
+            # note: not added to server_stats, as batches take longer than single requests
+            latency = time.time() - start
+            self._update_latency(latency)
+            if self.rpc_stats is not None:
+                # each item counts as a request that took as long as the batch
+                for (method, params), result in zip(requests, batch.results):
+                    self.rpc_stats.record_request(method + ' (batch)', params, result, latency)
+            return list(batch.results)
+
+    def _update_latency(self, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+
+    def _record_request(self, latency: float) -> None:
+        self._update_latency(latency)
+        if self.server_stats is not None:
+            self.server_stats.record_request(latency)
 
-    async def subscribe(self, method: str, params: List, queue: asyncio.Queue):
+    def _record_timeout(self) -> None:
+        self.num_errors += 1
+        if self.server_stats is not None:
+            self.server_stats.record_timeout()
+
+    async def subscribe(self, method: str, params: List, queue: asyncio.Queue, *,
+                        priority=RequestPriority.INTERACTIVE):
         # note: until the cache is written for the first time,
         # each 'subscribe' call might make a request on the network.
         key = self.get_hashable_key_for_rpc_call(method, params)
@@ -106,7 +532,7 @@ class NotificationSession(RPCSession):
         if key in self.cache:
             result = self.cache[key]
         else:
-            result = await self.send_request(method, params)
+            result = await self.send_request(method, params, priority=priority)
             self.cache[key] = result
         await queue.put(params + [result])
 
@@ -341,36 +767,103 @@ class Interface(PrintError):
     async def get_block_header(self, height, assert_mode):
         self.print_error('requesting block header {} in mode {}'.format(height, assert_mode))
         # use lower timeout as we usually have network.bhi_lock here
-        timeout = self.network.get_network_timeout_seconds(NetworkTimeout.Urgent)
-        res = await self.session.send_request('blockchain.block.header', [height], timeout=timeout)
+        timeout = self.network.get_network_timeout_seconds(NetworkTimeout.Urgent, self.server)
+        res = await self.session.send_request('blockchain.block.header', [height], timeout=timeout,
+                                              priority=RequestPriority.URGENT)
         return blockchain.deserialize_header(bytes.fromhex(res), height)
 
-    async def request_chunk(self, height, tip=None, *, can_return_early=False):
+    async def request_chunk(self, height, tip=None, *, can_return_early=False,
+                            prefetched: asyncio.Future=None):
         index = height // 2016
         if can_return_early and index in self._requested_chunks:
             return
         self.print_error("requesting chunk from height {}".format(height))
-        size = 2016
-        if tip is not None:
-            size = min(size, tip - index * 2016 + 1)
-            size = max(size, 0)
         try:
             self._requested_chunks.add(index)
-            res = await self.session.send_request('blockchain.block.headers', [index * 2016, size])
+            server, res = None, None
+            if prefetched is not None:
+                server, res = await prefetched
+            if res is None:
+                server, res = self.server, await self._fetch_chunk(index, tip)
+            conn = self.blockchain.connect_chunk(index, res['hex'])
+            if not conn and server != self.server:
+                # the other server might be on a different chain; ask ours
+                self.print_error(f"chunk {index} from {server} did not connect. retrying")
+                res = await self._fetch_chunk(index, tip)
+                conn = self.blockchain.connect_chunk(index, res['hex'])
         finally:
             try: self._requested_chunks.remove(index)
             except KeyError: pass
-        conn = self.blockchain.connect_chunk(index, res['hex'])
         if not conn:
             return conn, 0
         return conn, res['count']
 
+    async def _fetch_chunk(self, index: int, tip: Optional[int]) -> dict:
+        size = 2016
+        if tip is not None:
+            size = min(size, tip - index * 2016 + 1)
+            size = max(size, 0)
+        return await self.session.send_request('blockchain.block.headers', [index * 2016, size],
+                                               timeout=self.session.bulk_timeout)
+
+    async def _prefetch_chunk(self, interface: 'Interface', index: int, tip: int):
+        """Returns (server, response). The response is None if the request failed,
+        in which case the chunk is fetched again when it is needed.
+        """
+        try:
+            return interface.server, await interface._fetch_chunk(index, tip)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            self.print_error(f"prefetching chunk {index} from {interface.server} failed: {repr(e)}")
+            return interface.server, None
+
+    def _get_chunk_sources(self) -> List['Interface']:
+        """Interfaces that are on the same chain as ours. Ours comes first."""
+        sources = [self]
+        with self.network.interfaces_lock:
+            interfaces = list(self.network.interfaces.values())
+        for interface in interfaces:
+            if interface is self or not interface.ready.done():
+                continue
+            if interface.tip_header is None or interface.tip_header != self.tip_header:
+                continue
+            if not interface.session or interface.session.is_closing():
+                continue
+            sources.append(interface)
+        return sources
+
+    def _prefetch_chunks(self, prefetched: Dict[int, asyncio.Future], height: int, tip: int) -> None:
+        """Keeps up to 'chunk_pipeline_size' chunk requests in flight,
+        starting with the chunk that contains height.
+        """
+        pipeline_size = max(1, self.network.config.get('chunk_pipeline_size', 4))
+        first_index = height // 2016
+        last_index = min(first_index + pipeline_size - 1, tip // 2016)
+        sources = None
+        for index in range(first_index, last_index + 1):
+            if index in prefetched:
+                continue
+            if sources is None:
+                sources = self._get_chunk_sources()
+            interface = sources[index % len(sources)]
+            prefetched[index] = asyncio.ensure_future(self._prefetch_chunk(interface, index, tip))
+
+    @staticmethod
+    def _cancel_prefetches(prefetched: Dict[int, asyncio.Future]) -> None:
+        for fut in prefetched.values():
+            fut.cancel()
+        prefetched.clear()
+
     async def open_session(self, sslc, exit_early=False):
         async with aiorpcx.Connector(NotificationSession,
                                      host=self.host, port=self.port,
                                      ssl=sslc, proxy=self.proxy) as session:
             self.session = session  # type: NotificationSession
-            self.session.default_timeout = self.network.get_network_timeout_seconds(NetworkTimeout.Generic)
+            self.session.server_stats = self.network.get_server_stats(self.server)
+            self.session.rpc_stats = self.network.rpc_stats.for_server(self.server)
+            self.session.default_timeout = self.network.get_network_timeout_seconds(NetworkTimeout.Generic, self.server)
+            self.session.bulk_timeout = self.network.get_bulk_timeout_seconds(NetworkTimeout.Generic)
             try:
                 ver = await session.send_request('server.version', [ELECTRUM_VERSION, PROTOCOL_VERSION])
             except aiorpcx.jsonrpc.RPCError as e:
@@ -394,7 +887,10 @@ class Interface(PrintError):
     async def ping(self):
         while True:
             await asyncio.sleep(300)
-            await self.session.send_request('server.ping')
+            start = time.time()
+            await self.session.send_request('server.ping', priority=RequestPriority.URGENT)
+            self.session.server_stats.record_ping(time.time() - start)
+            self.session.default_timeout = self.network.get_network_timeout_seconds(NetworkTimeout.Generic, self.server)
 
     async def close(self):
         if self.session:
@@ -403,7 +899,8 @@ class Interface(PrintError):
 
     async def run_fetch_blocks(self):
         header_queue = asyncio.Queue()
-        await self.session.subscribe('blockchain.headers.subscribe', [], header_queue)
+        await self.session.subscribe('blockchain.headers.subscribe', [], header_queue,
+                                     priority=RequestPriority.URGENT)
         while True:
             item = await header_queue.get()
             raw_header = item[0]
@@ -436,22 +933,32 @@ class Interface(PrintError):
         if next_height is None:
             next_height = self.tip
         last = None
-        while last is None or height <= next_height:
-            prev_last, prev_height = last, height
-            if next_height > height + 10:
-                could_connect, num_headers = await self.request_chunk(height, next_height)
-                if not could_connect:
-                    if height <= constants.net.max_checkpoint():
-                        raise GracefulDisconnect('server chain conflicts with checkpoints or genesis')
+        # chunk index -> (server, response); requested ahead of time so that
+        # catching up is not bounded by round-trip latency
+        prefetched = {}  # type: Dict[int, asyncio.Future]
+        try:
+            while last is None or height <= next_height:
+                prev_last, prev_height = last, height
+                if next_height > height + 10:
+                    self._prefetch_chunks(prefetched, height, next_height)
+                    index = height // 2016
+                    could_connect, num_headers = await self.request_chunk(
+                        height, next_height, prefetched=prefetched.pop(index, None))
+                    if not could_connect:
+                        if height <= constants.net.max_checkpoint():
+                            raise GracefulDisconnect('server chain conflicts with checkpoints or genesis')
+                        self._cancel_prefetches(prefetched)
+                        last, height = await self.step(height)
+                        continue
+                    self.network.trigger_callback('network_updated')
+                    height = (height // 2016 * 2016) + num_headers
+                    assert height <= next_height+1, (height, self.tip)
+                    last = 'catchup'
+                else:
                     last, height = await self.step(height)
-                    continue
-                self.network.trigger_callback('network_updated')
-                height = (height // 2016 * 2016) + num_headers
-                assert height <= next_height+1, (height, self.tip)
-                last = 'catchup'
-            else:
-                last, height = await self.step(height)
-            assert (prev_last, prev_height) != (last, height), 'had to prevent infinite loop in interface.sync_until'
+                assert (prev_last, prev_height) != (last, height), 'had to prevent infinite loop in interface.sync_until'
+        finally:
+            self._cancel_prefetches(prefetched)
         return last, height
 
     async def step(self, height, header=None):
@@ -0,0 +1,402 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2018 The Electrum developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""A stand-in for an ElectrumX server, serving a fixed dataset.
+
+This is meant for benchmarking and regression-testing Network, Interface,
+Synchronizer and SPV without a network connection. It speaks the subset of
+the Electrum protocol that the client uses. Latency, bandwidth and failures
+can be injected.
+
+To point Network at it, set the 'local_server' config option, e.g.:
+    {"dataset": "/path/to/dataset.json", "latency": 0.05, "error_rate": 0.01}
+
+The served chain is a regtest chain (regtest genesis block and difficulty),
+so the client must run with --regtest; other nets would reject it.
+"""
+
+import asyncio
+import json
+import random
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple, NamedTuple
+
+import aiorpcx
+from aiorpcx import RPCSession, RPCError, JSONRPC
+
+from . import blockchain, constants
+from .bitcoin import (TYPE_ADDRESS, address_to_script, address_to_scripthash, hash_encode,
+                      hash_decode, int_to_hex, var_int)
+from .crypto import sha256d
+from .synchronizer import history_status
+from .transaction import Transaction
+from .util import PrintError, bfh, bh2u
+from .version import PROTOCOL_VERSION
+
+
+SERVER_VERSION = 'ElectrumX-local 1.0'
+MAX_CHUNK_SIZE = 2016
+
+REGTEST_GENESIS_HEADER = {
+    'version': 1,
+    'prev_block_hash': '00' * 32,
+    'merkle_root': '4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b',
+    'timestamp': 1296688602,
+    'bits': 0x207fffff,
+    'nonce': 2,
+    'block_height': 0,
+}
+
+
+def merkle_root_and_branches(tx_hashes: Sequence[str]) -> Tuple[str, List[List[str]]]:
+    """Return the merkle root of a block with the given txids, and the
+    merkle branch of each of them, in the format of
+    blockchain.transaction.get_merkle.
+    """
+    level = [hash_decode(tx_hash) for tx_hash in tx_hashes]
+    branches = [[] for _ in tx_hashes]
+    positions = list(range(len(tx_hashes)))
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        for i, pos in enumerate(positions):
+            branches[i].append(hash_encode(level[pos ^ 1]))
+            positions[i] = pos // 2
+        level = [sha256d(level[j] + level[j + 1]) for j in range(0, len(level), 2)]
+    return hash_encode(level[0]), branches
+
+
+class ServerDataset:
+    """What the server knows about: a chain of headers, and the
+    transactions, histories and merkle proofs of some scripthashes.
+
+    A dataset is either synthetic (see make_synthetic), or recorded from a
+    real server; it is stored as a JSON file.
+    """
+
+    def __init__(self, headers: bytes, *, histories: Dict[str, List[Tuple[str, int]]]=None,
+                 transactions: Dict[str, str]=None, merkles: Dict[str, dict]=None):
+        assert len(headers) % blockchain.HEADER_SIZE == 0 and len(headers) > 0
+        self.headers = headers
+        self.histories = {sh: [tuple(item) for item in h] for sh, h in (histories or {}).items()}
+        self.transactions = dict(transactions or {})
+        self.merkles = dict(merkles or {})
+
+    def height(self) -> int:
+        return len(self.headers) // blockchain.HEADER_SIZE - 1
+
+    def get_header(self, height: int) -> bytes:
+        if not 0 <= height <= self.height():
+            raise RPCError(JSONRPC.INVALID_ARGS, f'height {height} out of range')
+        return self.headers[height * blockchain.HEADER_SIZE:(height + 1) * blockchain.HEADER_SIZE]
+
+    def get_headers(self, start_height: int, count: int) -> bytes:
+        count = max(0, min(count, MAX_CHUNK_SIZE))
+        start = start_height * blockchain.HEADER_SIZE
+        return self.headers[start:start + count * blockchain.HEADER_SIZE]
+
+    def get_history(self, scripthash: str) -> List[Tuple[str, int]]:
+        return self.histories.get(scripthash, [])
+
+    def get_status(self, scripthash: str) -> Optional[str]:
+        return history_status(self.get_history(scripthash))
+
+    def add_block(self, transactions: Dict[str, str]=None, *, scripthashes: Dict[str, List[str]]=None) -> int:
+        """Append a block containing the given transactions (txid -> raw tx).
+        scripthashes maps each txid to the scripthashes whose history it
+        belongs to. Returns the height of the new block.
+        """
+        transactions = transactions or {}
+        height = self.height() + 1
+        tx_hashes = list(transactions)
+        if tx_hashes:
+            merkle_root, branches = merkle_root_and_branches(tx_hashes)
+            for pos, tx_hash in enumerate(tx_hashes):
+                self.merkles[tx_hash] = {'block_height': height, 'merkle': branches[pos], 'pos': pos}
+        else:
+            merkle_root = hash_encode(sha256d(int_to_hex(height, 4)))
+        self.transactions.update(transactions)
+        for tx_hash, shs in (scripthashes or {}).items():
+            for sh in shs:
+                self.histories.setdefault(sh, []).append((tx_hash, height))
+        prev_header = blockchain.deserialize_header(self.get_header(height - 1), height - 1)
+        header = dict(REGTEST_GENESIS_HEADER, prev_block_hash=blockchain.hash_header(prev_header),
+                      merkle_root=merkle_root, timestamp=prev_header['timestamp'] + 1,
+                      block_height=height)
+        self.headers += bfh(blockchain.serialize_header(header))
+        return height
+
+    @classmethod
+    def make_synthetic(cls, addresses: Sequence[str], *, num_blocks: int=4032,
+                       txs_per_address: int=2, seed: int=0) -> 'ServerDataset':
+        """Regtest chain of num_blocks headers, in which each of the given
+        addresses receives txs_per_address payments at random heights.
+        """
+        assert num_blocks > 1
+        rand = random.Random(seed)
+        payments = defaultdict(list)  # type: Dict[int, List[str]]
+        for addr in addresses:
+            for _ in range(txs_per_address):
+                payments[rand.randrange(1, num_blocks)].append(addr)
+        dataset = cls(bfh(blockchain.serialize_header(REGTEST_GENESIS_HEADER)))
+        for height in range(1, num_blocks):
+            transactions = {}
+            scripthashes = {}
+            for addr in payments[height]:
+                raw_tx = cls._make_payment(addr, rand.randrange(1000, 10 ** 8), rand)
+                tx_hash = hash_encode(sha256d(bfh(raw_tx)))
+                transactions[tx_hash] = raw_tx
+                scripthashes[tx_hash] = [address_to_scripthash(addr)]
+            dataset.add_block(transactions, scripthashes=scripthashes)
+        return dataset
+
+    @staticmethod
+    def _make_payment(address: str, value: int, rand: random.Random) -> str:
+        """Serialized tx paying value to address, spending a random outpoint."""
+        prevout_hash = bh2u(bytes(rand.getrandbits(8) for _ in range(32)))
+        script = address_to_script(address)
+        return ('01000000'                       # version
+                + '01' + prevout_hash + '00000000' + '00' + 'ffffffff'
+                + '01' + int_to_hex(value, 8) + var_int(len(script) // 2) + script
+                + '00000000')                    # locktime
+
+    @classmethod
+    def load(cls, path: str) -> 'ServerDataset':
+        with open(path, 'r', encoding='utf-8') as f:
+            d = json.load(f)
+        return cls(bfh(d['headers']), histories=d.get('histories'),
+                   transactions=d.get('transactions'), merkles=d.get('merkles'))
+
+    def save(self, path: str) -> None:
+        d = {
+            'headers': bh2u(self.headers),
+            'histories': self.histories,
+            'transactions': self.transactions,
+            'merkles': self.merkles,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(d, f)
+
+
+class FaultInjection(NamedTuple):
+    latency: float = 0                 # seconds, added to every response
+    bandwidth: Optional[float] = None  # bytes/s; delays responses by their size
+    error_rate: float = 0              # probability of answering with an error
+    drop_rate: float = 0               # probability of never answering
+    disconnect_rate: float = 0         # probability of closing the connection
+    seed: Optional[int] = None
+
+
+class LocalServerHandler(PrintError):
+    """Answers Electrum protocol requests from a ServerDataset.
+    Independent from the transport, so that it can be tested directly.
+    """
+
+    verbosity_filter = 'n'
+
+    def __init__(self, dataset: ServerDataset):
+        self.dataset = dataset
+        self.methods = {
+            'server.version': self.server_version,
+            'server.banner': lambda *args: 'local test server',
+            'server.donation_address': lambda *args: '',
+            'server.peers.subscribe': lambda *args: [],
+            'server.ping': lambda *args: None,
+            'blockchain.relayfee': lambda *args: 0.00001,
+            'blockchain.estimatefee': lambda *args: 0.0001,
+            'mempool.get_fee_histogram': lambda *args: [],
+            'blockchain.headers.subscribe': self.headers_subscribe,
+            'blockchain.block.header': self.block_header,
+            'blockchain.block.headers': self.block_headers,
+            'blockchain.scripthash.subscribe': self.dataset.get_status,
+            'blockchain.scripthash.get_history': self.scripthash_get_history,
+            'blockchain.scripthash.listunspent': self.scripthash_listunspent,
+            'blockchain.scripthash.get_balance': self.scripthash_get_balance,
+            'blockchain.transaction.get': self.transaction_get,
+            'blockchain.transaction.get_merkle': self.transaction_get_merkle,
+            'blockchain.transaction.broadcast': self.transaction_broadcast,
+        }
+
+    def handle(self, method: str, args: Sequence):
+        func = self.methods.get(method)
+        if func is None:
+            raise RPCError(JSONRPC.METHOD_NOT_FOUND, f'unknown method {method}')
+        try:
+            return func(*args)
+        except TypeError as e:
+            raise RPCError(JSONRPC.INVALID_ARGS, str(e))
+
+    def server_version(self, client_name='', protocol_version=PROTOCOL_VERSION):
+        return [SERVER_VERSION, PROTOCOL_VERSION]
+
+    def headers_subscribe(self):
+        height = self.dataset.height()
+        return {'hex': bh2u(self.dataset.get_header(height)), 'height': height}
+
+    def block_header(self, height):
+        return bh2u(self.dataset.get_header(height))
+
+    def block_headers(self, start_height, count):
+        data = self.dataset.get_headers(start_height, count)
+        return {'hex': bh2u(data), 'count': len(data) // blockchain.HEADER_SIZE, 'max': MAX_CHUNK_SIZE}
+
+    def scripthash_get_history(self, scripthash):
+        return [{'tx_hash': tx_hash, 'height': height}
+                for tx_hash, height in self.dataset.get_history(scripthash)]
+
+    def _get_utxos(self, scripthash):
+        utxos = []
+        spent = set()
+        for tx_hash, height in self.dataset.get_history(scripthash):
+            tx = Transaction(self.dataset.transactions[tx_hash])
+            for txin in tx.inputs():
+                spent.add((txin['prevout_hash'], txin['prevout_n']))
+            for n, o in enumerate(tx.outputs()):
+                if o.type == TYPE_ADDRESS and address_to_scripthash(o.address) == scripthash:
+                    utxos.append({'tx_hash': tx_hash, 'tx_pos': n, 'height': height, 'value': o.value})
+        return [u for u in utxos if (u['tx_hash'], u['tx_pos']) not in spent]
+
+    def scripthash_listunspent(self, scripthash):
+        return self._get_utxos(scripthash)
+
+    def scripthash_get_balance(self, scripthash):
+        utxos = self._get_utxos(scripthash)
+        return {'confirmed': sum(u['value'] for u in utxos if u['height'] > 0),
+                'unconfirmed': sum(u['value'] for u in utxos if u['height'] <= 0)}
+
+    def transaction_get(self, tx_hash, verbose=False):
+        raw_tx = self.dataset.transactions.get(tx_hash)
+        if raw_tx is None:
+            raise RPCError(JSONRPC.INVALID_ARGS, f'unknown transaction {tx_hash}')
+        return raw_tx
+
+    def transaction_get_merkle(self, tx_hash, height):
+        merkle = self.dataset.merkles.get(tx_hash)
+        if merkle is None or merkle['block_height'] != height:
+            raise RPCError(JSONRPC.INVALID_ARGS, f'tx {tx_hash} not in block at height {height}')
+        return merkle
+
+    def transaction_broadcast(self, raw_tx):
+        return hash_encode(sha256d(bfh(raw_tx)))
+
+
+class LocalServerSession(RPCSession):
+
+    def __init__(self, server: 'LocalServer', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+        self.subscribed_headers = False
+        self.subscribed_scripthashes = set()
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.server.sessions.add(self)
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.server.sessions.discard(self)
+
+    async def handle_request(self, request):
+        faults = self.server.faults
+        r = self.server.random.random()
+        if r < faults.disconnect_rate:
+            self.abort()
+            raise RPCError(JSONRPC.INTERNAL_ERROR, 'injected disconnect')
+        r -= faults.disconnect_rate
+        if r < faults.drop_rate:
+            await asyncio.Future()  # cancelled when the session closes
+        r -= faults.drop_rate
+        if faults.latency:
+            await asyncio.sleep(faults.latency)
+        if r < faults.error_rate:
+            raise RPCError(JSONRPC.INTERNAL_ERROR, 'injected error')
+        result = self.server.handler.handle(request.method, request.args)
+        if faults.bandwidth:
+            await asyncio.sleep(len(json.dumps(result)) / faults.bandwidth)
+        if request.method == 'blockchain.headers.subscribe':
+            self.subscribed_headers = True
+        elif request.method == 'blockchain.scripthash.subscribe':
+            self.subscribed_scripthashes.add(request.args[0])
+        return result
+
+
+class LocalServer(PrintError):
+    """Listens on localhost and serves a ServerDataset over TCP."""
+
+    verbosity_filter = 'n'
+
+    def __init__(self, dataset: ServerDataset, faults: FaultInjection=None, *, port: int=0):
+        self.dataset = dataset
+        self.handler = LocalServerHandler(dataset)
+        self.faults = faults or FaultInjection()
+        self.random = random.Random(self.faults.seed)
+        self.sessions = set()
+        self.server = None  # type: Optional[aiorpcx.Server]
+        self.port = port  # 0: pick a free one
+
+    @classmethod
+    def from_config(cls, config) -> 'LocalServer':
+        if constants.net.GENESIS != constants.BitcoinRegtest.GENESIS:
+            raise Exception('local_server serves a regtest chain; run with --regtest')
+        options = dict(config.get('local_server'))
+        path = options.pop('dataset', None)
+        if path:
+            dataset = ServerDataset.load(path)
+        else:
+            dataset = ServerDataset.make_synthetic([], num_blocks=options.pop('num_blocks', 2016))
+        port = options.pop('port', 0)
+        return cls(dataset, FaultInjection(**options), port=port)
+
+    def get_server_str(self) -> str:
+        return f'localhost:{self.port}:t'
+
+    async def start(self) -> None:
+        self.server = aiorpcx.Server(lambda: LocalServerSession(self), '127.0.0.1', self.port)
+        await self.server.listen()
+        self.port = self.server.server.sockets[0].getsockname()[1]
+        self.print_error(f'listening on port {self.port}, chain height {self.dataset.height()}')
+
+    async def stop(self) -> None:
+        if self.server:
+            await self.server.close()
+            self.server = None
+        for session in list(self.sessions):
+            session.abort()
+
+    async def add_block(self, transactions: Dict[str, str]=None, *,
+                        scripthashes: Dict[str, List[str]]=None) -> int:
+        """Mine a block (see ServerDataset.add_block) and send the
+        notifications to subscribed sessions.
+        """
+        height = self.dataset.add_block(transactions, scripthashes=scripthashes)
+        header = self.handler.headers_subscribe()
+        changed = set(sh for shs in (scripthashes or {}).values() for sh in shs)
+        for session in list(self.sessions):
+            if session.is_closing():
+                continue
+            if session.subscribed_headers:
+                await session.send_notification('blockchain.headers.subscribe', [header])
+            for sh in changed & session.subscribed_scripthashes:
+                await session.send_notification('blockchain.scripthash.subscribe',
+                                                [sh, self.dataset.get_status(sh)])
+        return height
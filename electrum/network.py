@@ -32,12 +32,13 @@ import json
 import sys
 import ipaddress
 import asyncio
-from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple
+from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple, Union
 import traceback
 
 import dns
 import dns.resolver
-from aiorpcx import TaskGroup
+from aiorpcx import TaskGroup, run_in_thread
+import aiohttp
 from aiohttp import ClientResponse
 
 from . import util
@@ -49,13 +50,23 @@ from . import constants
 from . import blockchain
 from . import bitcoin
 from .blockchain import Blockchain, HEADER_SIZE
+from .network_cache import NetworkCache
+from .local_server import LocalServer
+from .synchronizer import SubscriptionManager
 from .interface import (Interface, serialize_server, deserialize_server,
-                        RequestTimedOut, NetworkTimeout)
+                        RequestTimedOut, NetworkTimeout, MAX_BATCH_REQUEST_SIZE, ServerStats,
+                        RequestPriority, RpcStats)
+from .transaction import Transaction
+from .verifier import verify_tx_is_in_block
 from .version import PROTOCOL_VERSION
 from .simple_config import SimpleConfig
 
 NODES_RETRY_INTERVAL = 60
 SERVER_RETRY_INTERVAL = 10
+# _maintain_sessions runs when woken up (e.g. an interface went down), and at
+# least this often (in seconds), for the timers above and other periodic work
+MAINTAIN_SESSIONS_INTERVAL = 1
+MAX_NUM_SERVER_STATS = 100
 
 
 def parse_servers(result: Sequence[Tuple[str, str, List[str]]]) -> Dict[str, dict]:
@@ -108,11 +119,26 @@ def filter_protocol(hostmap, protocol='s'):
     return eligible
 
 
-def pick_random_server(hostmap = None, protocol = 's', exclude_set = set()):
+def pick_random_server(hostmap = None, protocol = 's', exclude_set = set(),
+                       server_stats: Dict[str, ServerStats] = None):
+    """If server_stats is given, servers that are known to be fast
+    and reliable are more likely to be picked."""
     if hostmap is None:
         hostmap = constants.net.DEFAULT_SERVERS
     eligible = list(set(filter_protocol(hostmap, protocol)) - exclude_set)
-    return random.choice(eligible) if eligible else None
+    if not eligible:
+        return None
+    if not server_stats:
+        return random.choice(eligible)
+    weights = [get_server_score(server_stats, server) for server in eligible]
+    return random.choices(eligible, weights=weights)[0]
+
+
+def get_server_score(server_stats: Dict[str, ServerStats], server: str) -> float:
+    stats = server_stats.get(server)
+    if stats is None:
+        stats = ServerStats()
+    return stats.get_score()
 
 
 class NetworkParameters(NamedTuple):
@@ -186,6 +212,7 @@ class Network(PrintError):
         self.print_error("blockchains", list(map(lambda b: b.forkpoint, blockchain.blockchains.values())))
         self._blockchain_preferred_block = self.config.get('blockchain_preferred_block', None)  # type: Optional[Dict]
         self._blockchain = blockchain.get_best_chain()
+        self.server_stats = self._read_server_stats()  # type: Dict[str, ServerStats]  # note: needs self.recent_servers_lock
         # Server for addresses and transactions
         self.default_server = self.config.get('server', None)
         # Sanitize default server
@@ -196,7 +223,7 @@ class Network(PrintError):
                 self.print_error('Warning: failed to parse server-string; falling back to random.')
                 self.default_server = None
         if not self.default_server:
-            self.default_server = pick_random_server()
+            self.default_server = pick_random_server(server_stats=self.server_stats)
 
         self.main_taskgroup = None  # type: TaskGroup
 
@@ -219,6 +246,16 @@ class Network(PrintError):
         dir_path = os.path.join(self.config.path, 'certs')
         util.make_dir(dir_path)
 
+        # raw txs and merkle proofs, shared by all wallets
+        self.network_cache = NetworkCache(self.config)
+        # per server and method statistics of our requests;
+        # payload sizes only when they are dumped to a file
+        self.rpc_stats = RpcStats(measure_sizes=bool(self.config.get('rpc_stats_file')))
+        # stand-in server serving a fixed dataset, for benchmarks
+        self.local_server = None  # type: Optional[LocalServer]
+        if self.config.get('local_server'):
+            self.local_server = LocalServer.from_config(self.config)
+
         # retry times
         self.server_retry_time = time.time()
         self.nodes_retry_time = time.time()
@@ -226,12 +263,16 @@ class Network(PrintError):
         self.interface = None  # type: Interface
         # set of servers we have an ongoing connection with
         self.interfaces = {}  # type: Dict[str, Interface]
-        self.auto_connect = self.config.get('auto_connect', True)
+        self.auto_connect = self.config.get('auto_connect', True) and not self.local_server
         self.connecting = set()
         self.server_queue = None
         self.proxy = None
+        self._http_session = None  # type: Optional[aiohttp.ClientSession]
+        self._maintain_sessions_event = None  # type: Optional[asyncio.Event]
 
         self._set_status('disconnected')
+        # scripthash subscriptions, shared by all wallets and watchers
+        self.subscription_manager = SubscriptionManager(self)
 
     def run_from_another_thread(self, coro):
         assert self._loop_thread != threading.current_thread(), 'must not be called from network thread'
@@ -391,6 +432,46 @@ class Network(PrintError):
         else:
             self.trigger_callback(key, self.get_status_value(key))
 
+    def _read_server_stats(self) -> Dict[str, ServerStats]:
+        if not self.config.path:
+            return {}
+        path = os.path.join(self.config.path, "server_stats")
+        try:
+            with open(path, "r", encoding='utf-8') as f:
+                data = json.loads(f.read())
+            return {server: ServerStats(d) for server, d in data.items()}
+        except:
+            return {}
+
+    @with_recent_servers_lock
+    def _save_server_stats(self):
+        if not self.config.path:
+            return
+        # forget about servers we have not seen for a long time
+        servers = sorted(self.server_stats, key=lambda server: self.server_stats[server].last_seen)
+        for server in servers[:-MAX_NUM_SERVER_STATS]:
+            self.server_stats.pop(server)
+        path = os.path.join(self.config.path, "server_stats")
+        s = json.dumps({server: stats.to_json() for server, stats in self.server_stats.items()},
+                       indent=4, sort_keys=True)
+        try:
+            with open(path, "w", encoding='utf-8') as f:
+                f.write(s)
+        except:
+            pass
+
+    @with_recent_servers_lock
+    def get_server_stats(self, server: str) -> ServerStats:
+        if server not in self.server_stats:
+            self.server_stats[server] = ServerStats()
+        return self.server_stats[server]
+
+    def _pick_fast_interface(self, interfaces: Sequence[Interface]) -> Interface:
+        """Picks one of the interfaces at random, preferring fast and reliable servers."""
+        with self.recent_servers_lock:
+            weights = [get_server_score(self.server_stats, iface.server) for iface in interfaces]
+        return random.choices(interfaces, weights=weights)[0]
+
     def get_parameters(self) -> NetworkParameters:
         host, port, protocol = deserialize_server(self.default_server)
         return NetworkParameters(host=host,
@@ -437,11 +518,14 @@ class Network(PrintError):
                 self._set_status('connecting')
             self.connecting.add(server)
             self.server_queue.put(server)
+            self._wake_up_maintain_sessions()
 
     def _start_random_interface(self):
         with self.interfaces_lock:
             exclude_set = self.disconnected_servers | set(self.interfaces) | self.connecting
-        server = pick_random_server(self.get_servers(), self.protocol, exclude_set)
+        with self.recent_servers_lock:
+            server = pick_random_server(self.get_servers(), self.protocol, exclude_set,
+                                        server_stats=self.server_stats)
         if server:
             self._start_interface(server)
         return server
@@ -463,8 +547,24 @@ class Network(PrintError):
                 socket.getaddrinfo = self._fast_getaddrinfo
             else:
                 socket.getaddrinfo = socket._getaddrinfo
+        self._close_http_session()
         self.trigger_callback('proxy_set', self.proxy)
 
+    def get_http_session(self) -> aiohttp.ClientSession:
+        """Returns the HTTP session shared by the whole process. It keeps
+        connections alive between requests, and goes through our proxy.
+        Must be called on the network's event loop. Callers must not close it.
+        """
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = make_aiohttp_session(self.proxy)
+        return self._http_session
+
+    def _close_http_session(self):
+        """The session is created again (e.g. with the new proxy) on next use."""
+        session, self._http_session = self._http_session, None
+        if session is not None and not session.closed:
+            asyncio.run_coroutine_threadsafe(session.close(), self.asyncio_loop)
+
     @staticmethod
     def _fast_getaddrinfo(host, *args, **kwargs):
         def needs_dns_resolving(host2):
@@ -528,18 +628,20 @@ class Network(PrintError):
                 await self.switch_to_interface(server_str)
             else:
                 await self.switch_lagging_interface()
+            self._wake_up_maintain_sessions()
 
     def _set_oneserver(self, oneserver: bool):
         self.num_server = 10 if not oneserver else 0
         self.oneserver = bool(oneserver)
 
     async def _switch_to_random_interface(self):
-        '''Switch to a random connected server other than the current one'''
-        servers = self.get_interfaces()    # Those in connected state
-        if self.default_server in servers:
-            servers.remove(self.default_server)
-        if servers:
-            await self.switch_to_interface(random.choice(servers))
+        '''Switch to a random connected server other than the current one,
+        preferring fast ones'''
+        with self.interfaces_lock:
+            interfaces = [iface for server, iface in self.interfaces.items()
+                          if server != self.default_server]
+        if interfaces:
+            await self.switch_to_interface(self._pick_fast_interface(interfaces).server)
 
     async def switch_lagging_interface(self):
         '''If auto_connect and lagging, switch interface'''
@@ -549,7 +651,7 @@ class Network(PrintError):
             with self.interfaces_lock: interfaces = list(self.interfaces.values())
             filtered = list(filter(lambda iface: iface.tip_header == best_header, interfaces))
             if filtered:
-                chosen_iface = random.choice(filtered)
+                chosen_iface = self._pick_fast_interface(filtered)
                 await self.switch_to_interface(chosen_iface.server)
 
     async def switch_unwanted_fork_interface(self):
@@ -569,7 +671,7 @@ class Network(PrintError):
                                    interfaces))
             if filtered:
                 self.print_error("switching to preferred fork")
-                chosen_iface = random.choice(filtered)
+                chosen_iface = self._pick_fast_interface(filtered)
                 await self.switch_to_interface(chosen_iface.server)
                 return
             else:
@@ -581,7 +683,7 @@ class Network(PrintError):
                                interfaces))
         if filtered:
             self.print_error("switching to best chain")
-            chosen_iface = random.choice(filtered)
+            chosen_iface = self._pick_fast_interface(filtered)
             await self.switch_to_interface(chosen_iface.server)
         else:
             # FIXME switch to best available?
@@ -638,6 +740,7 @@ class Network(PrintError):
         self.recent_servers.insert(0, server)
         self.recent_servers = self.recent_servers[0:20]
         self._save_recent_servers()
+        self._save_server_stats()
 
     async def connection_down(self, interface: Interface):
         '''A connection to server either went down, or was never made.
@@ -648,34 +751,57 @@ class Network(PrintError):
         if server == self.default_server:
             self._set_status('disconnected')
         await self._close_interface(interface)
+        self._save_server_stats()
+        self._wake_up_maintain_sessions()
         self.trigger_callback('network_updated')
 
-    def get_network_timeout_seconds(self, request_type=NetworkTimeout.Generic) -> int:
+    def get_network_timeout_seconds(self, request_type=NetworkTimeout.Generic, server: str=None) -> int:
+        """If server is given, the timeout adapts to the latency observed for it."""
         if self.oneserver and not self.auto_connect:
             return request_type.MOST_RELAXED
         if self.proxy:
-            return request_type.RELAXED
-        return request_type.NORMAL
+            timeout, max_timeout = request_type.RELAXED, request_type.MOST_RELAXED
+        else:
+            timeout, max_timeout = request_type.NORMAL, request_type.RELAXED
+        if server is not None:
+            with self.recent_servers_lock:
+                stats = self.server_stats.get(server)
+                adaptive_timeout = stats.get_timeout(request_type, max_timeout=max_timeout) if stats else None
+            if adaptive_timeout is not None:
+                timeout = adaptive_timeout
+        return timeout
+
+    def get_bulk_timeout_seconds(self, request_type=NetworkTimeout.Generic) -> int:
+        """Timeout for batch requests and header chunks. They take longer than
+        single requests, so it does not adapt to the latency of the server."""
+        if self.oneserver and not self.auto_connect or self.proxy:
+            return request_type.MOST_RELAXED
+        return request_type.RELAXED
 
     @ignore_exceptions  # do not kill main_taskgroup
     @log_exceptions
     async def _run_new_interface(self, server):
         interface = Interface(self, server, self.proxy)
         timeout = self.get_network_timeout_seconds(NetworkTimeout.Urgent)
+        start = time.time()
         try:
             await asyncio.wait_for(interface.ready, timeout)
         except BaseException as e:
             #traceback.print_exc()
             self.print_error(f"couldn't launch iface {server} -- {repr(e)}")
+            if not isinstance(e, asyncio.CancelledError):
+                self.get_server_stats(server).record_connect_failure()
             await interface.close()
             return
         else:
+            self.get_server_stats(server).record_connect(time.time() - start)
             with self.interfaces_lock:
                 assert server not in self.interfaces
                 self.interfaces[server] = interface
         finally:
             try: self.connecting.remove(server)
             except KeyError: pass
+            self._wake_up_maintain_sessions()
 
         if server == self.default_server:
             await self.switch_to_interface(server)
@@ -687,13 +813,14 @@ class Network(PrintError):
         b = blockchain.get_best_chain()
         filename = b.path()
         length = HEADER_SIZE * len(constants.net.CHECKPOINTS) * 2016
-        if not os.path.exists(filename) or os.path.getsize(filename) < length:
-            with open(filename, 'wb') as f:
-                if length > 0:
-                    f.seek(length-1)
-                    f.write(b'\x00')
-            util.ensure_sparse_file(filename)
         with b.lock:
+            if not os.path.exists(filename) or os.path.getsize(filename) < length:
+                b.close_headers_file()
+                with open(filename, 'wb') as f:
+                    if length > 0:
+                        f.seek(length-1)
+                        f.write(b'\x00')
+                util.ensure_sparse_file(filename)
             b.update_size()
 
     def best_effort_reliable(func):
@@ -727,15 +854,163 @@ class Network(PrintError):
             raise Exception('no interface to do request on... gave up.')
         return make_reliable_wrapper
 
-    @best_effort_reliable
+    def _get_interface_for_readonly_request(self, *, same_chain: bool=False) -> Optional[Interface]:
+        """Picks a connected interface for a request whose result can be
+        verified, weighted by the observed latency and error rate of the servers.
+        """
+        with self.interfaces_lock: interfaces = list(self.interfaces.values())
+        candidates, weights = [], []
+        for iface in interfaces:
+            if not iface.ready.done() or iface.ready.cancelled():
+                continue
+            if iface.session is None or iface.session.is_closing():
+                continue
+            if same_chain and iface.blockchain != self.blockchain():
+                continue
+            candidates.append(iface)
+            weights.append(self._get_routing_weight(iface.session))
+        if not candidates:
+            return self.interface
+        return random.choices(candidates, weights=weights)[0]
+
+    @staticmethod
+    def _get_routing_weight(session) -> float:
+        latency = session.latency if session.latency is not None else 1.0
+        success_rate = (1 + session.num_requests - session.num_errors) / (1 + session.num_requests)
+        return success_rate ** 2 / max(latency, 0.01)
+
+    async def _send_request_to_other_interface(self, iface: Interface, method: str,
+                                               params: list, *, timeout=None):
+        """Returns None instead of raising if the request fails,
+        so that the caller can fall back to the main interface.
+        """
+        return await self._run_on_other_interface(
+            iface, iface.session.send_request(method, params, timeout=timeout), method)
+
+    async def _run_on_other_interface(self, iface: Interface, coro, description: str):
+        fut = asyncio.ensure_future(coro)
+        try:
+            await asyncio.wait([fut, iface.got_disconnected], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not fut.done():
+                fut.cancel()
+        if not fut.done() or fut.cancelled():
+            # the interface got disconnected; fut settles on a later iteration
+            return None
+        if fut.exception():
+            self.print_error(f"{description} on {iface.server} failed: {repr(fut.exception())}")
+            return None
+        return fut.result()
+
+    async def _send_request_batches(self, requests: Sequence[Tuple[str, list]], *,
+                                    is_valid, same_chain: bool=False, timeout=None,
+                                    priority=RequestPriority.INTERACTIVE) -> list:
+        """Sends requests in JSON-RPC batches, each to an interface picked like for
+        single requests. Items that fail there, or whose result does not pass
+        is_valid(request, result), are sent to the main interface.
+        The result of a request that failed on the main interface is the exception.
+        """
+        results = []
+        for i in range(0, len(requests), MAX_BATCH_REQUEST_SIZE):
+            batch = requests[i:i + MAX_BATCH_REQUEST_SIZE]
+            batch_results = [None] * len(batch)
+            iface = self._get_interface_for_readonly_request(same_chain=same_chain)
+            if iface is not None and iface is not self.interface:
+                other_results = await self._run_on_other_interface(
+                    iface, iface.session.send_request_batch(batch, timeout=timeout, priority=priority),
+                    'batch request')
+                for j, result in enumerate(other_results or []):
+                    if not isinstance(result, Exception) and is_valid(batch[j], result):
+                        batch_results[j] = result
+            missing = [j for j, result in enumerate(batch_results) if result is None]
+            if missing:
+                main_results = await self.interface.session.send_request_batch(
+                    [batch[j] for j in missing], timeout=timeout, priority=priority)
+                for j, result in zip(missing, main_results):
+                    batch_results[j] = result
+            results.extend(batch_results)
+        return results
+
+    def _is_valid_merkle_proof(self, tx_hash: str, merkle: dict) -> bool:
+        try:
+            tx_height = merkle.get('block_height')
+            header = self.blockchain().read_header(tx_height)
+            verify_tx_is_in_block(tx_hash, merkle.get('merkle'), merkle.get('pos'), header, tx_height)
+        except Exception as e:
+            self.print_error(f"invalid merkle proof for {tx_hash}: {repr(e)}")
+            return False
+        return True
+
+    async def _run_cache_io(self, func, *args):
+        """Runs func, which uses the network cache, in a thread, as the
+        cache does file I/O. Returns None if the cache is disabled."""
+        if not self.network_cache.is_enabled():
+            return None
+        return await run_in_thread(func, *args)
+
+    def _get_cached_merkle(self, tx_hash: str, tx_height: int) -> Optional[dict]:
+        try:
+            block_hash = self.blockchain().get_hash(tx_height)
+        except Exception:  # e.g. MissingHeader
+            return None
+        return self.network_cache.get_merkle(tx_hash, block_hash)
+
+    def _cache_merkle(self, tx_hash: str, merkle) -> None:
+        if not isinstance(merkle, dict) or not self._is_valid_merkle_proof(tx_hash, merkle):
+            return
+        block_hash = self.blockchain().get_hash(merkle['block_height'])
+        self.network_cache.put_merkle(tx_hash, block_hash, merkle)
+
     async def get_merkle_for_transaction(self, tx_hash: str, tx_height: int) -> dict:
+        merkle = await self._run_cache_io(self._get_cached_merkle, tx_hash, tx_height)
+        if merkle is None:
+            merkle = await self._get_merkle_for_transaction(tx_hash, tx_height)
+            await self._run_cache_io(self._cache_merkle, tx_hash, merkle)
+        return merkle
+
+    @best_effort_reliable
+    async def _get_merkle_for_transaction(self, tx_hash: str, tx_height: int) -> dict:
+        iface = self._get_interface_for_readonly_request(same_chain=True)
+        if iface is not None and iface is not self.interface:
+            merkle = await self._send_request_to_other_interface(
+                iface, 'blockchain.transaction.get_merkle', [tx_hash, tx_height])
+            if merkle is not None and self._is_valid_merkle_proof(tx_hash, merkle):
+                return merkle
         return await self.interface.session.send_request('blockchain.transaction.get_merkle', [tx_hash, tx_height])
 
+    async def get_merkles_for_transactions(self, txs: Sequence[Tuple[str, int]], *,
+                                           priority=RequestPriority.INTERACTIVE) -> List[Union[dict, Exception]]:
+        """Batched get_merkle_for_transaction for (tx_hash, tx_height) pairs.
+        Returns the results in order; an exception (e.g. RPCError) for failed requests.
+        """
+        def get_cached():
+            return [self._get_cached_merkle(tx_hash, tx_height) for tx_hash, tx_height in txs]
+        def put_cached(items):
+            for tx_hash, merkle in items:
+                self._cache_merkle(tx_hash, merkle)
+        results = await self._run_cache_io(get_cached) or [None] * len(txs)
+        missing = [i for i, merkle in enumerate(results) if merkle is None]
+        if missing:
+            fetched = await self._get_merkles_for_transactions([txs[i] for i in missing], priority=priority)
+            for i, merkle in zip(missing, fetched):
+                results[i] = merkle
+            await self._run_cache_io(put_cached, [(txs[i][0], results[i]) for i in missing])
+        return results
+
+    @best_effort_reliable
+    async def _get_merkles_for_transactions(self, txs: Sequence[Tuple[str, int]], *,
+                                            priority) -> List[Union[dict, Exception]]:
+        requests = [('blockchain.transaction.get_merkle', [tx_hash, tx_height]) for tx_hash, tx_height in txs]
+        return await self._send_request_batches(
+            requests, same_chain=True, priority=priority,
+            is_valid=lambda request, merkle: self._is_valid_merkle_proof(request[1][0], merkle))
+
     @best_effort_reliable
     async def broadcast_transaction(self, tx, *, timeout=None):
         if timeout is None:
             timeout = self.get_network_timeout_seconds(NetworkTimeout.Urgent)
-        out = await self.interface.session.send_request('blockchain.transaction.broadcast', [str(tx)], timeout=timeout)
+        out = await self.interface.session.send_request('blockchain.transaction.broadcast', [str(tx)], timeout=timeout,
+                                                        priority=RequestPriority.URGENT)
         if out != tx.txid():
             # note: this is untrusted input from the server
             raise Exception(out)
@@ -745,14 +1020,66 @@ class Network(PrintError):
     async def request_chunk(self, height, tip=None, *, can_return_early=False):
         return await self.interface.request_chunk(height, tip=tip, can_return_early=can_return_early)
 
-    @best_effort_reliable
     async def get_transaction(self, tx_hash: str, *, timeout=None) -> str:
+        raw_tx = await self._run_cache_io(self.network_cache.get_transaction, tx_hash)
+        if raw_tx is None:
+            raw_tx = await self._get_transaction(tx_hash, timeout=timeout)
+            await self._run_cache_io(self.network_cache.put_transaction, tx_hash, raw_tx)
+        return raw_tx
+
+    @best_effort_reliable
+    async def _get_transaction(self, tx_hash: str, *, timeout=None) -> str:
+        iface = self._get_interface_for_readonly_request()
+        if iface is not None and iface is not self.interface:
+            raw_tx = await self._send_request_to_other_interface(
+                iface, 'blockchain.transaction.get', [tx_hash], timeout=timeout)
+            if raw_tx is not None and self._is_tx_with_txid(raw_tx, tx_hash):
+                return raw_tx
         return await self.interface.session.send_request('blockchain.transaction.get', [tx_hash],
                                                          timeout=timeout)
 
+    async def get_transactions(self, tx_hashes: Sequence[str], *, timeout=None,
+                               priority=RequestPriority.INTERACTIVE) -> Dict[str, Union[str, Exception]]:
+        """Batched get_transaction. Maps txid to raw tx, or to an exception
+        (e.g. RPCError) if the request for that txid failed.
+        """
+        def get_cached():
+            return {tx_hash: self.network_cache.get_transaction(tx_hash) for tx_hash in tx_hashes}
+        def put_cached(items):
+            for tx_hash, raw_tx in items:
+                self.network_cache.put_transaction(tx_hash, raw_tx)
+        results = await self._run_cache_io(get_cached) or dict.fromkeys(tx_hashes)
+        missing = [tx_hash for tx_hash, raw_tx in results.items() if raw_tx is None]
+        if missing:
+            fetched = await self._get_transactions(missing, timeout=timeout, priority=priority)
+            results.update(fetched)
+            await self._run_cache_io(put_cached, [(tx_hash, raw_tx) for tx_hash, raw_tx in fetched.items()
+                                                  if not isinstance(raw_tx, Exception)])
+        return results
+
+    @best_effort_reliable
+    async def _get_transactions(self, tx_hashes: Sequence[str], *, timeout=None,
+                                priority) -> Dict[str, Union[str, Exception]]:
+        requests = [('blockchain.transaction.get', [tx_hash]) for tx_hash in tx_hashes]
+        results = await self._send_request_batches(
+            requests, timeout=timeout, priority=priority,
+            is_valid=lambda request, raw_tx: self._is_tx_with_txid(raw_tx, request[1][0]))
+        return dict(zip(tx_hashes, results))
+
+    def _is_tx_with_txid(self, raw_tx: str, tx_hash: str) -> bool:
+        try:
+            txid = Transaction(raw_tx).txid()
+        except Exception:
+            txid = None
+        if txid != tx_hash:
+            self.print_error(f"received tx does not match expected txid {tx_hash}")
+            return False
+        return True
+
     @best_effort_reliable
-    async def get_history_for_scripthash(self, sh: str) -> List[dict]:
-        return await self.interface.session.send_request('blockchain.scripthash.get_history', [sh])
+    async def get_history_for_scripthash(self, sh: str, *, priority=RequestPriority.INTERACTIVE) -> List[dict]:
+        return await self.interface.session.send_request('blockchain.scripthash.get_history', [sh],
+                                                         priority=priority)
 
     @best_effort_reliable
     async def listunspent_for_scripthash(self, sh: str) -> List[dict]:
@@ -833,10 +1160,15 @@ class Network(PrintError):
         assert not self.connecting and not self.server_queue
         self.print_error('starting network')
         self.disconnected_servers = set([])
+        if self.local_server:
+            if not self.local_server.server:
+                await self.local_server.start()
+            self.default_server = self.local_server.get_server_str()
         self.protocol = deserialize_server(self.default_server)[2]
         self.server_queue = queue.Queue()
+        self._maintain_sessions_event = asyncio.Event()
         self._set_proxy(deserialize_proxy(self.config.get('proxy')))
-        self._set_oneserver(self.config.get('oneserver', False))
+        self._set_oneserver(self.config.get('oneserver', False) or self.local_server is not None)
         self._start_interface(self.default_server)
 
         async def main():
@@ -846,6 +1178,8 @@ class Network(PrintError):
                 # will NOT raise, and the group will keep the other tasks running
                 async with main_taskgroup as group:
                     await group.spawn(self._maintain_sessions())
+                    if self.config.get('rpc_stats_file'):
+                        await group.spawn(self._dump_rpc_stats_periodically())
                     [await group.spawn(job) for job in self._jobs]
             except Exception as e:
                 traceback.print_exc(file=sys.stderr)
@@ -870,6 +1204,14 @@ class Network(PrintError):
         self.interfaces = {}  # type: Dict[str, Interface]
         self.connecting.clear()
         self.server_queue = None
+        blockchain.flush_blockchains()
+        self._save_server_stats()
+        if self.config.get('rpc_stats_file'):
+            self.dump_rpc_stats(self.config.get('rpc_stats_file'))
+        if full_shutdown:
+            self._close_http_session()
+            if self.local_server:
+                await self.local_server.stop()
         if not full_shutdown:
             self.trigger_callback('network_updated')
 
@@ -920,13 +1262,41 @@ class Network(PrintError):
                 await launch_already_queued_up_new_interfaces()
                 await maybe_queue_new_interfaces_to_be_launched_later()
                 await maintain_main_interface()
+                blockchain.flush_blockchains(force=False)
             except asyncio.CancelledError:
                 # suppress spurious cancellations
                 group = self.main_taskgroup
                 if not group or group._closed:
                     raise
-            await asyncio.sleep(0.1)
+            try:
+                await asyncio.wait_for(self._maintain_sessions_event.wait(), MAINTAIN_SESSIONS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._maintain_sessions_event.clear()
+
+    def _wake_up_maintain_sessions(self):
+        """Have _maintain_sessions run now, e.g. because an interface
+        was queued or went down. Thread-safe."""
+        event = self._maintain_sessions_event
+        if event is not None and not event.is_set():
+            self.asyncio_loop.call_soon_threadsafe(event.set)
+
+    async def _dump_rpc_stats_periodically(self):
+        path = self.config.get('rpc_stats_file')
+        interval = self.config.get('rpc_stats_interval', 60)
+        while True:
+            await asyncio.sleep(interval)
+            self.dump_rpc_stats(path)
 
+    def dump_rpc_stats(self, path: str) -> None:
+        s = json.dumps(self.rpc_stats.to_json(), indent=4, sort_keys=True)
+        temp_path = "%s.tmp.%s" % (path, os.getpid())
+        try:
+            with open(temp_path, "w", encoding='utf-8') as f:
+                f.write(s)
+            os.replace(temp_path, path)
+        except OSError as e:
+            self.print_error(f"failed to write rpc stats: {repr(e)}")
 
     async def _send_http_on_proxy(self, method: str, url: str, params: str = None, body: bytes = None, json: dict = None, headers=None, on_finish=None):
         async def default_on_finish(resp: ClientResponse):
@@ -936,20 +1306,20 @@ class Network(PrintError):
             headers = {}
         if on_finish is None:
             on_finish = default_on_finish
-        async with make_aiohttp_session(self.proxy) as session:
-            if method == 'get':
-                async with session.get(url, params=params, headers=headers) as resp:
+        session = self.get_http_session()
+        if method == 'get':
+            async with session.get(url, params=params, headers=headers) as resp:
+                return await on_finish(resp)
+        elif method == 'post':
+            assert body is not None or json is not None, 'body or json must be supplied if method is post'
+            if body is not None:
+                async with session.post(url, data=body, headers=headers) as resp:
                     return await on_finish(resp)
-            elif method == 'post':
-                assert body is not None or json is not None, 'body or json must be supplied if method is post'
-                if body is not None:
-                    async with session.post(url, data=body, headers=headers) as resp:
-                        return await on_finish(resp)
-                elif json is not None:
-                    async with session.post(url, json=json, headers=headers) as resp:
-                        return await on_finish(resp)
-            else:
-                assert False
+            elif json is not None:
+                async with session.post(url, json=json, headers=headers) as resp:
+                    return await on_finish(resp)
+        else:
+            assert False
 
     @staticmethod
     def send_http_on_proxy(method, url, **kwargs):
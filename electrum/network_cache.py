@@ -0,0 +1,196 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2018 The Electrum developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .transaction import Transaction
+from .util import PrintError, make_dir, bfh, bh2u
+
+
+DEFAULT_NETWORK_CACHE_SIZE = 0  # bytes; disabled unless configured
+
+
+def _is_hex_hash(s) -> bool:
+    if not isinstance(s, str) or len(s) != 64:
+        return False
+    try:
+        bytes.fromhex(s)
+    except ValueError:
+        return False
+    return True
+
+
+class NetworkCache(PrintError):
+    """Persistent cache for server responses that never change:
+    raw transactions, keyed by their txid, and merkle proofs, keyed by
+    (txid, block hash). Entries are files in the 'network_cache' directory;
+    the least recently used ones are evicted when the total size exceeds
+    the 'network_cache_size' budget (in bytes).
+
+    Only what the caller has verified should be stored: raw txs are checked
+    against their txid here, merkle proofs must be checked by the caller.
+
+    The cache is disabled by default: it is shared by all wallets and not
+    encrypted, so it exposes the transactions of encrypted wallets, and
+    outlives deleted ones. Its methods do blocking file I/O.
+    """
+
+    verbosity_filter = 'n'
+
+    def __init__(self, config):
+        self.max_size = config.get('network_cache_size', DEFAULT_NETWORK_CACHE_SIZE)
+        self.path = os.path.join(config.path, 'network_cache') if config.path else None
+        self.lock = threading.RLock()
+        self._entries = None  # type: Optional[OrderedDict]  # relative path -> size; in LRU order
+        self._total_size = 0
+
+    def is_enabled(self) -> bool:
+        return self.path is not None and self.max_size > 0
+
+    def _load_entries(self) -> None:
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        self._total_size = 0
+        files = []
+        make_dir(self.path)
+        for subdir in ('txs', 'merkle'):
+            dir_path = os.path.join(self.path, subdir)
+            make_dir(dir_path)
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if not entry.is_file():
+                        continue
+                    if '.tmp.' in entry.name:  # leftover of an interrupted write
+                        self._remove_file(entry.path)
+                        continue
+                    st = entry.stat()
+                    files.append((st.st_mtime, os.path.join(subdir, entry.name), st.st_size))
+        for mtime, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_size += size
+        self._evict()
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _read(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            if not self.is_enabled():
+                return None
+            self._load_entries()
+            if name not in self._entries:
+                return None
+            path = os.path.join(self.path, name)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)  # so that the LRU order survives a restart
+            except OSError as e:
+                self.print_error(f"cannot read {name}: {repr(e)}")
+                self._total_size -= self._entries.pop(name)
+                self._remove_file(path)
+                return None
+            self._entries.move_to_end(name)
+            return data
+
+    def _write(self, name: str, data: bytes) -> None:
+        with self.lock:
+            if not self.is_enabled() or len(data) > self.max_size:
+                return
+            self._load_entries()
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                return
+            path = os.path.join(self.path, name)
+            tmp_path = "%s.tmp.%s" % (path, os.getpid())
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                self.print_error(f"cannot write {name}: {repr(e)}")
+                self._remove_file(tmp_path)
+                return
+            self._entries[name] = len(data)
+            self._total_size += len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._total_size > self.max_size and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total_size -= size
+            self._remove_file(os.path.join(self.path, name))
+
+    def get_transaction(self, tx_hash: str) -> Optional[str]:
+        if not _is_hex_hash(tx_hash):
+            return None
+        data = self._read(os.path.join('txs', tx_hash))
+        return bh2u(data) if data is not None else None
+
+    def put_transaction(self, tx_hash: str, raw_tx: str) -> None:
+        if not _is_hex_hash(tx_hash) or not self.is_enabled():
+            return
+        try:
+            txid = Transaction(raw_tx).txid()
+        except Exception:
+            txid = None
+        if txid != tx_hash:
+            self.print_error(f"not caching tx that does not match txid {tx_hash}")
+            return
+        self._write(os.path.join('txs', tx_hash), bfh(raw_tx))
+
+    def get_merkle(self, tx_hash: str, block_hash: str) -> Optional[dict]:
+        if not _is_hex_hash(tx_hash) or not _is_hex_hash(block_hash):
+            return None
+        data = self._read(os.path.join('merkle', tx_hash + '_' + block_hash))
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode('ascii'))
+        except ValueError:
+            return None
+
+    def put_merkle(self, tx_hash: str, block_hash: str, merkle: dict) -> None:
+        if not _is_hex_hash(tx_hash) or not _is_hex_hash(block_hash):
+            return
+        self._write(os.path.join('merkle', tx_hash + '_' + block_hash), self._serialize_merkle(merkle))
+
+    @staticmethod
+    def _serialize_merkle(merkle: dict) -> bytes:
+        return json.dumps(merkle, sort_keys=True).encode('ascii')
+
+    def get_size(self) -> int:
+        with self.lock:
+            if not self.is_enabled():
+                return 0
+            self._load_entries()
+            return self._total_size
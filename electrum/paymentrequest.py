@@ -39,7 +39,7 @@ except ImportError:
     sys.exit("Error: could not find paymentrequest_pb2.py. Create it with 'protoc --proto_path=electrum/ --python_out=electrum/ electrum/paymentrequest.proto'")
 
 from . import bitcoin, ecc, util, transaction, x509, rsakey
-from .util import print_error, bh2u, bfh, export_meta, import_meta, make_aiohttp_session
+from .util import print_error, bh2u, bfh, export_meta, import_meta
 from .crypto import sha256
 from .bitcoin import TYPE_ADDRESS
 from .transaction import TxOutput
@@ -73,20 +73,19 @@ async def get_payment_request(url: str) -> 'PaymentRequest':
     if u.scheme in ('http', 'https'):
         resp_content = None
         try:
-            proxy = Network.get_instance().proxy
-            async with make_aiohttp_session(proxy, headers=REQUEST_HEADERS) as session:
-                async with session.get(url) as response:
-                    resp_content = await response.read()
-                    response.raise_for_status()
-                    # Guard against `bitcoin:`-URIs with invalid payment request URLs
-                    if "Content-Type" not in response.headers \
-                    or response.headers["Content-Type"] != "application/bitcoin-paymentrequest":
-                        data = None
-                        error = "payment URL not pointing to a payment request handling server"
-                    else:
-                        data = resp_content
-                    data_len = len(data) if data is not None else None
-                    print_error('fetched payment request', url, data_len)
+            session = Network.get_instance().get_http_session()
+            async with session.get(url, headers=REQUEST_HEADERS) as response:
+                resp_content = await response.read()
+                response.raise_for_status()
+                # Guard against `bitcoin:`-URIs with invalid payment request URLs
+                if "Content-Type" not in response.headers \
+                or response.headers["Content-Type"] != "application/bitcoin-paymentrequest":
+                    data = None
+                    error = "payment URL not pointing to a payment request handling server"
+                else:
+                    data = resp_content
+                data_len = len(data) if data is not None else None
+                print_error('fetched payment request', url, data_len)
         except aiohttp.ClientError as e:
             error = f"Error while contacting payment URL:\n{repr(e)}"
             if isinstance(e, aiohttp.ClientResponseError) and e.status == 400 and resp_content:
@@ -285,18 +284,17 @@ class PaymentRequest:
         payurl = urllib.parse.urlparse(pay_det.payment_url)
         resp_content = None
         try:
-            proxy = Network.get_instance().proxy
-            async with make_aiohttp_session(proxy, headers=ACK_HEADERS) as session:
-                async with session.post(payurl.geturl(), data=pm) as response:
-                    resp_content = await response.read()
-                    response.raise_for_status()
-                    try:
-                        paymntack = pb2.PaymentACK()
-                        paymntack.ParseFromString(resp_content)
-                    except Exception:
-                        return False, "PaymentACK could not be processed. Payment was sent; please manually verify that payment was received."
-                    print(f"PaymentACK message received: {paymntack.memo}")
-                    return True, paymntack.memo
+            session = Network.get_instance().get_http_session()
+            async with session.post(payurl.geturl(), data=pm, headers=ACK_HEADERS) as response:
+                resp_content = await response.read()
+                response.raise_for_status()
+                try:
+                    paymntack = pb2.PaymentACK()
+                    paymntack.ParseFromString(resp_content)
+                except Exception:
+                    return False, "PaymentACK could not be processed. Payment was sent; please manually verify that payment was received."
+                print(f"PaymentACK message received: {paymntack.memo}")
+                return True, paymntack.memo
         except aiohttp.ClientError as e:
             error = f"Payment Message/PaymentACK Failed:\n{repr(e)}"
             if isinstance(e, aiohttp.ClientResponseError) and e.status == 400 and resp_content:
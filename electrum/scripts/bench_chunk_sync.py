@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Measures header catch-up (Interface.sync_until) against a local server
+# that serves synthetic regtest headers with injected latency, for
+# different values of the 'chunk_pipeline_size' config option.
+#
+# usage: bench_chunk_sync.py [num_chunks] [latency_ms]
+
+import os
+import sys
+import time
+import asyncio
+import shutil
+import tempfile
+import threading
+
+import aiorpcx
+from aiorpcx import RPCSession
+
+from electrum import constants, blockchain
+from electrum.interface import Interface, NotificationSession
+from electrum.simple_config import SimpleConfig
+from electrum.util import bfh, bh2u, make_dir
+
+
+REGTEST_GENESIS_HEADER = {
+    'version': 1,
+    'prev_block_hash': '00' * 32,
+    'merkle_root': '4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b',
+    'timestamp': 1296688602,
+    'bits': 0x207fffff,
+    'nonce': 2,
+    'block_height': 0,
+}
+
+
+def make_headers(num_headers):
+    headers = [bfh(blockchain.serialize_header(REGTEST_GENESIS_HEADER))]
+    prev_hash = constants.net.GENESIS
+    for height in range(1, num_headers):
+        header = dict(REGTEST_GENESIS_HEADER, prev_block_hash=prev_hash,
+                      timestamp=REGTEST_GENESIS_HEADER['timestamp'] + height, block_height=height)
+        headers.append(bfh(blockchain.serialize_header(header)))
+        prev_hash = blockchain.hash_header(header)
+    return b''.join(headers)
+
+
+def make_server_session(headers, latency):
+    class HeadersServerSession(RPCSession):
+        async def handle_request(self, request):
+            await asyncio.sleep(latency)
+            if request.method == 'blockchain.block.headers':
+                start_height, count = request.args
+                data = headers[start_height * 80 : (start_height + count) * 80]
+                return {'hex': bh2u(data), 'count': len(data) // 80, 'max': 2016}
+            raise aiorpcx.RPCError(aiorpcx.JSONRPC.METHOD_NOT_FOUND, request.method)
+    return HeadersServerSession
+
+
+class DummyTaskGroup:
+    async def spawn(self, x):
+        x.close()
+
+
+class DummyNetwork:
+    main_taskgroup = DummyTaskGroup()
+
+    def __init__(self, config):
+        self.config = config
+        self.asyncio_loop = asyncio.get_event_loop()
+        self.interfaces = {}
+        self.interfaces_lock = threading.Lock()
+
+    def trigger_callback(self, event, *args):
+        pass
+
+
+async def sync(headers, port, pipeline_size):
+    data_dir = tempfile.mkdtemp()
+    try:
+        make_dir(os.path.join(data_dir, 'forks'))
+        config = SimpleConfig({'electrum_path': data_dir, 'chunk_pipeline_size': pipeline_size})
+        network = DummyNetwork(config)
+        interface = Interface(network, 'localhost:{}:t'.format(port), None)
+        interface.blockchain = blockchain.Blockchain(config=config, forkpoint=0, parent=None,
+                                                     forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        with open(interface.blockchain.path(), 'wb') as f:
+            f.write(headers[:80])
+        interface.blockchain.update_size()
+        interface.tip = len(headers) // 80 - 1
+        async with aiorpcx.Connector(NotificationSession, host='localhost', port=port) as session:
+            interface.session = session
+            t0 = time.time()
+            await interface.sync_until(1)
+            dt = time.time() - t0
+        assert interface.blockchain.height() == interface.tip
+        interface.blockchain.close_headers_file()
+        return dt
+    finally:
+        shutil.rmtree(data_dir)
+
+
+async def main():
+    num_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 100) / 1000
+    headers = make_headers(num_chunks * 2016)
+    server = aiorpcx.Server(make_server_session(headers, latency), 'localhost', 0)
+    await server.listen()
+    port = server.server.sockets[0].getsockname()[1]
+    print("{} chunks, {:.0f} ms latency".format(num_chunks, latency * 1000))
+    try:
+        for pipeline_size in (1, 2, 4, 8):
+            dt = await sync(headers, port, pipeline_size)
+            print("chunk_pipeline_size {:<3} {:>8.2f} s {:>10.0f} headers/s".format(
+                pipeline_size, dt, len(headers) // 80 / dt))
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    constants.set_regtest()
+    asyncio.get_event_loop().run_until_complete(main())
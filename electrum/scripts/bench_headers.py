@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#
+# Benchmarks header lookups on a synthetic headers file.
+#
+# "baseline" opens the headers file, seeks, reads, deserializes and
+# re-hashes the header on every lookup (how Blockchain used to do it).
+# "Blockchain" goes through the memory-mapped file and in-memory hash index.
+#
+# usage: bench_headers.py [num_headers] [num_lookups]
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from electrum import constants
+from electrum.blockchain import (Blockchain, HEADER_SIZE, deserialize_header,
+                                 hash_header)
+from electrum.simple_config import SimpleConfig
+from electrum.util import make_dir
+
+
+def baseline_read_header(path, height):
+    with open(path, 'rb') as f:
+        f.seek(height * HEADER_SIZE)
+        h = f.read(HEADER_SIZE)
+    return deserialize_header(h, height)
+
+
+def bench(name, func, heights):
+    t0 = time.time()
+    for height in heights:
+        func(height)
+    dt = time.time() - t0
+    print("{:<30} {:>12.0f} lookups/s".format(name, len(heights) / dt))
+
+
+def main():
+    num_headers = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    constants.set_regtest()
+    data_dir = tempfile.mkdtemp()
+    try:
+        make_dir(os.path.join(data_dir, 'forks'))
+        config = SimpleConfig({'electrum_path': data_dir})
+        chain = Blockchain(config=config, forkpoint=0, parent=None,
+                           forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        path = chain.path()
+        with open(path, 'wb') as f:
+            f.write(os.urandom(num_headers * HEADER_SIZE))
+        chain.update_size()
+        print("{} headers, {} random lookups".format(num_headers, num_lookups))
+        heights = [random.randrange(1, num_headers) for _ in range(num_lookups)]
+
+        bench("baseline read_header", lambda h: baseline_read_header(path, h), heights)
+        bench("baseline get_hash", lambda h: hash_header(baseline_read_header(path, h)), heights)
+        bench("Blockchain.read_header", chain.read_header, heights)
+        bench("Blockchain.get_hash (cold)", chain.get_hash, heights)
+        bench("Blockchain.get_hash (warm)", chain.get_hash, heights)
+        chain.close_headers_file()
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Measures wallet restore time (header sync, address synchronization and
+# SPV verification) against the local stand-in server (local_server.py),
+# serving a synthetic regtest chain in which every address of the wallet
+# has received payments. No network connection is needed.
+#
+# usage: bench_restore.py [num_addresses] [latency_ms] [error_rate]
+
+import os
+import sys
+import time
+import asyncio
+import shutil
+import tempfile
+
+from electrum import constants, keystore
+from electrum.local_server import ServerDataset
+from electrum.mnemonic import Mnemonic
+from electrum.network import Network
+from electrum.simple_config import SimpleConfig
+from electrum.storage import WalletStorage
+from electrum.util import create_and_start_event_loop
+from electrum.wallet import Wallet
+
+
+def make_wallet(path, seed, gap_limit):
+    storage = WalletStorage(path)
+    storage.put('keystore', keystore.from_seed(seed, '', False).dump())
+    storage.put('wallet_type', 'standard')
+    storage.put('gap_limit', gap_limit)
+    wallet = Wallet(storage)
+    wallet.synchronize()
+    return wallet
+
+
+def main():
+    num_addresses = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    constants.set_regtest()
+    data_dir = tempfile.mkdtemp()
+    loop, stopping_fut, loop_thread = create_and_start_event_loop()
+    try:
+        seed = Mnemonic('en').make_seed()
+        # a wallet with num_addresses receiving addresses, to know what to pay to
+        wallet = make_wallet(os.path.join(data_dir, 'template'), seed, num_addresses)
+        addresses = wallet.get_receiving_addresses()[:num_addresses]
+        dataset = ServerDataset.make_synthetic(addresses, num_blocks=4032, txs_per_address=2)
+        dataset_path = os.path.join(data_dir, 'dataset.json')
+        dataset.save(dataset_path)
+        print("{} addresses, {} txs, {} blocks, {:.0f} ms latency, error rate {}".format(
+            len(addresses), len(dataset.transactions), dataset.height() + 1, latency * 1000, error_rate))
+
+        config = SimpleConfig({
+            'electrum_path': data_dir,
+            'local_server': {'dataset': dataset_path, 'latency': latency,
+                             'error_rate': error_rate, 'seed': 0},
+        })
+        network = Network(config)
+        network.start()
+        # restore: same seed, but the wallet only knows the first gap_limit addresses
+        wallet = make_wallet(os.path.join(data_dir, 'restored'), seed, 20)
+        t0 = time.time()
+        wallet.start_network(network)
+        while not (wallet.is_up_to_date() and len(wallet.verified_tx) == len(dataset.transactions)):
+            time.sleep(0.01)
+        dt = time.time() - t0
+        print("restored in {:.2f} s, {:.0f} txs/s, {} addresses".format(
+            dt, len(dataset.transactions) / dt, len(wallet.get_addresses())))
+        wallet.stop_threads()
+        network.stop()
+    finally:
+        loop.call_soon_threadsafe(stopping_fut.set_result, 1)
+        loop_thread.join(timeout=1)
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# Benchmarks Blockchain.verify_chunk over a recorded mainnet headers file,
+# e.g. the blockchain_headers file of a synced Electrum data directory.
+#
+# "baseline" deserializes every header into a dict and re-hashes it via
+# hex (how verify_chunk used to do it). Both passes verify against an
+# empty chain, so only checkpointed chunks can be checked.
+#
+# usage: bench_verify_chunk.py headers_file [num_chunks]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from electrum import constants
+from electrum.blockchain import (Blockchain, HEADER_SIZE, MissingHeader,
+                                 deserialize_header, hash_header)
+from electrum.simple_config import SimpleConfig
+from electrum.util import make_dir
+
+
+def baseline_verify_chunk(chain, index, data):
+    num = len(data) // HEADER_SIZE
+    start_height = index * 2016
+    prev_hash = chain.get_hash(start_height - 1)
+    target = chain.get_target(index-1)
+    for i in range(num):
+        height = start_height + i
+        try:
+            expected_header_hash = chain.get_hash(height)
+        except MissingHeader:
+            expected_header_hash = None
+        raw_header = data[i*HEADER_SIZE : (i+1)*HEADER_SIZE]
+        header = deserialize_header(raw_header, height)
+        chain.verify_header(header, prev_hash, target, expected_header_hash)
+        prev_hash = hash_header(header)
+
+
+def bench(name, func, chain, chunks):
+    t0 = time.time()
+    for index, data in enumerate(chunks):
+        func(index, data)
+    dt = time.time() - t0
+    num_headers = sum(len(data) for data in chunks) // HEADER_SIZE
+    print("{:<30} {:>8.2f} s {:>12.0f} headers/s".format(name, dt, num_headers / dt))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: {} headers_file [num_chunks]".format(sys.argv[0]))
+        sys.exit(1)
+    path = sys.argv[1]
+    num_chunks = len(constants.net.CHECKPOINTS)
+    if len(sys.argv) > 2:
+        num_chunks = min(num_chunks, int(sys.argv[2]))
+    with open(path, 'rb') as f:
+        raw = f.read(num_chunks * 2016 * HEADER_SIZE)
+    chunks = [raw[i:i + 2016 * HEADER_SIZE] for i in range(0, len(raw), 2016 * HEADER_SIZE)]
+    data_dir = tempfile.mkdtemp()
+    try:
+        make_dir(os.path.join(data_dir, 'forks'))
+        config = SimpleConfig({'electrum_path': data_dir})
+        chain = Blockchain(config=config, forkpoint=0, parent=None,
+                           forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        print("{} chunks".format(len(chunks)))
+        bench("baseline verify_chunk", lambda i, d: baseline_verify_chunk(chain, i, d), chain, chunks)
+        bench("Blockchain.verify_chunk", chain.verify_chunk, chain, chunks)
+        chain.close_headers_file()
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
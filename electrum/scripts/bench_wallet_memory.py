@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Measures the memory taken by the transaction maps of a wallet (txi, txo,
+# spent_outpoints, history, verified_tx, transactions) when it is loaded
+# from disk. The wallet file is filled with synthetic transactions paying
+# to the wallet addresses, each spending an output of the previous one.
+# The footprint of each map is also shown; objects shared by several maps
+# (interned txids and addresses) are counted in the first one listed.
+#
+# usage: bench_wallet_memory.py [num_txs] [num_addresses]
+
+import os
+import gc
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+from electrum.address_synchronizer import AddressSynchronizer
+from electrum.bitcoin import hash160_to_p2pkh, int_to_hex, var_int, address_to_script
+from electrum.storage import WalletStorage
+from electrum.transaction import Transaction
+from electrum.util import TxMinedInfo, bh2u, bfh
+
+TXS_PER_BLOCK = 100
+MAPS = ('txi', 'txo', 'spent_outpoints', 'history', 'verified_tx', '_txo_address')
+
+
+def make_tx(prevout_hash, prevout_n, outputs):
+    s = '01000000' + '01' + bh2u(bfh(prevout_hash)[::-1]) + int_to_hex(prevout_n, 4) + '00' + 'ffffffff'
+    s += var_int(len(outputs))
+    for addr, value in outputs:
+        script = address_to_script(addr)
+        s += int_to_hex(value, 8) + var_int(len(script) // 2) + script
+    return Transaction(s + '00000000')
+
+
+def make_wallet_file(path, num_txs, num_addresses):
+    adb = AddressSynchronizer(WalletStorage(path))
+    addresses = [hash160_to_p2pkh(os.urandom(20)) for i in range(num_addresses)]
+    for addr in addresses:
+        adb.history[addr] = []
+    prevout_hash = bh2u(os.urandom(32))
+    for i in range(num_txs):
+        addr = addresses[i % num_addresses]
+        external = hash160_to_p2pkh(os.urandom(20))
+        tx = make_tx(prevout_hash, 0, [(addr, 100000000 - i), (external, 1000)])
+        tx_hash = prevout_hash = tx.txid()
+        height = 1 + i // TXS_PER_BLOCK
+        adb.history[addr].append((tx_hash, height))
+        adb.add_transaction(tx_hash, tx)
+        adb._set_verified_tx(tx_hash, TxMinedInfo(height=height, timestamp=1500000000 + height,
+                                                  txpos=i % TXS_PER_BLOCK,
+                                                  header_hash='%064x' % height))
+    adb.save_transactions()
+    adb.save_verified_tx(write=True)
+
+
+def deep_size(obj, seen) -> int:
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(x, seen) for x in obj)
+    return size
+
+
+def measure(func):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.time()
+    result = func()
+    dt = time.time() - t0
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, dt
+
+
+def main():
+    num_txs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_addresses = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    data_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(data_dir, 'wallet')
+        make_wallet_file(path, num_txs, num_addresses)
+        print("{} txs, {} addresses, wallet file {:.1f} MB".format(
+            num_txs, num_addresses, os.path.getsize(path) / 1e6))
+        storage, storage_size, dt = measure(lambda: WalletStorage(path))
+        print("storage: {:.1f} MB, loaded in {:.2f} s".format(storage_size / 1e6, dt))
+        adb, adb_size, dt = measure(lambda: AddressSynchronizer(storage))
+        print("tx maps: {:.1f} MB, loaded in {:.2f} s".format(adb_size / 1e6, dt))
+        seen = set()
+        for name in MAPS:
+            print("  {}: {:.1f} MB".format(name, deep_size(getattr(adb, name), seen) / 1e6))
+        print("  transactions: {:.1f} MB".format(deep_size(adb.transactions._raw_txs, seen) / 1e6))
+        print("total per 100k txs: {:.0f} MB".format((storage_size + adb_size) / 1e6 * 100000 / num_txs))
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -44,7 +44,7 @@ from .keystore import bip44_derivation
 
 OLD_SEED_VERSION = 4        # electrum versions < 2.0
 NEW_SEED_VERSION = 11       # electrum versions >= 2.0
-FINAL_SEED_VERSION = 18     # electrum >= 2.7 will set this to prevent
+FINAL_SEED_VERSION = 19     # electrum >= 2.7 will set this to prevent
                             # old versions from overwriting new format
 
 
@@ -76,12 +76,14 @@ class JsonDB(PrintError):
         self.path = os.path.normcase(os.path.abspath(path))
         self.modified = False
 
-    def get(self, key, default=None):
+    def get(self, key, default=None, *, readonly=False):
+        """Returns a copy of the stored value. If readonly, the stored
+        value itself is returned, and must not be modified."""
         with self.db_lock:
             v = self.data.get(key)
             if v is None:
                 v = default
-            else:
+            elif not readonly:
                 v = copy.deepcopy(v)
         return v
 
@@ -354,6 +356,7 @@ class WalletStorage(JsonDB):
         self.convert_version_16()
         self.convert_version_17()
         self.convert_version_18()
+        self.convert_version_19()
 
         self.put('seed_version', FINAL_SEED_VERSION)  # just to be sure
         self.write()
@@ -575,7 +578,26 @@ class WalletStorage(JsonDB):
         self.put('verified_tx3', None)
         self.put('seed_version', 18)
 
-    # def convert_version_19(self):
+    def convert_version_19(self):
+        # txo and txi become keyed by output index and by outpoint
+        if not self._is_upgrade_method_needed(18, 18):
+            return
+
+        txo = self.get('txo', {})  # txid -> addr -> [(n, v, is_cb)]
+        for txid, d in txo.items():
+            for addr, outputs in d.items():
+                d[addr] = {n: (v, is_cb) for n, v, is_cb in outputs}
+        self.put('txo', txo)
+
+        txi = self.get('txi', {})  # txid -> addr -> [(prevout_ser, v)]
+        for txid, d in txi.items():
+            for addr, inputs in d.items():
+                d[addr] = {ser: v for ser, v in inputs}
+        self.put('txi', txi)
+
+        self.put('seed_version', 19)
+
+    # def convert_version_20(self):
     #     TODO for "next" upgrade:
     #       - move "pw_hash_version" from keystore to storage
     #     pass
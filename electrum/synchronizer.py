@@ -24,20 +24,30 @@
 # SOFTWARE.
 import asyncio
 import hashlib
-from typing import Dict, List, TYPE_CHECKING
+import time
+from typing import Dict, List, Iterable, Optional, Tuple, TYPE_CHECKING
 from collections import defaultdict
 
-from aiorpcx import TaskGroup, run_in_thread
+from aiorpcx import run_in_thread
 
 from .transaction import Transaction
-from .util import bh2u, make_aiohttp_session, NetworkJobOnDefaultServer
+from .util import bh2u, NetworkJobOnDefaultServer
 from .bitcoin import address_to_scripthash, is_address
+from .interface import RequestPriority
 
 if TYPE_CHECKING:
     from .network import Network
     from .address_synchronizer import AddressSynchronizer
 
 
+# defaults of the 'max_inflight_subscriptions' and 'max_inflight_history_requests'
+# config options, which bound the concurrency (and memory) of synchronizers
+DEFAULT_MAX_INFLIGHT_SUBSCRIPTIONS = 50
+DEFAULT_MAX_INFLIGHT_HISTORY_REQUESTS = 10
+# Synchronizer.main checks the wallet when woken up, but not more often than this (seconds)
+SYNCHRONIZE_MIN_INTERVAL = 0.1
+
+
 def history_status(h):
     if not h:
         return None
@@ -47,9 +57,136 @@ def history_status(h):
     return bh2u(hashlib.sha256(status.encode('ascii')).digest())
 
 
+class SubscriptionManager(NetworkJobOnDefaultServer):
+    """Scripthash subscriptions shared by all the SynchronizerBase instances
+    of a network (wallets, Notifier, BalanceMonitor).
+
+    A scripthash is subscribed to once on the server, however many consumers
+    are interested in it; status changes are put on the queue of each consumer.
+    The history of a scripthash is fetched once per status, see get_history.
+    """
+    def __init__(self, network: 'Network'):
+        self.asyncio_loop = network.asyncio_loop
+        # scripthash -> status queues of the consumers; a subscription lives while this is not empty
+        self.consumers = defaultdict(list)  # type: Dict[str, List[asyncio.Queue]]
+        # scripthash -> resolved when the server first tells us its status
+        self._first_status = {}  # type: Dict[str, asyncio.Future]
+        NetworkJobOnDefaultServer.__init__(self, network)
+
+    def _reset(self):
+        super()._reset()
+        self.statuses = {}  # type: Dict[str, Optional[str]]  # as announced by the current server
+        # scripthash -> (status, future of the history for that status)
+        self._histories = {}  # type: Dict[str, Tuple[Optional[str], asyncio.Future]]
+        self._subscribed = set()  # scripthashes subscribed to on the current server
+        self.add_queue = asyncio.Queue()
+        self.status_queue = asyncio.Queue()
+        max_inflight = self.network.config.get('max_inflight_subscriptions', DEFAULT_MAX_INFLIGHT_SUBSCRIPTIONS)
+        self._subscription_slots = asyncio.Semaphore(max_inflight)
+        self.num_inflight_subscriptions = 0
+
+    async def _start_tasks(self):
+        for h in list(self.consumers):
+            await self.add_queue.put(h)
+        try:
+            async with self.group as group:
+                await group.spawn(self.send_subscriptions())
+                await group.spawn(self.handle_status())
+        finally:
+            # we are being cancelled now
+            self.session.unsubscribe(self.status_queue)
+
+    async def subscribe(self, h: str, queue: asyncio.Queue) -> None:
+        """Put the status of scripthash h on queue, and then every change of
+        it. Returns once the server has told us the status.
+        """
+        self.consumers[h].append(queue)
+        if h in self.statuses:
+            await queue.put((h, self.statuses[h]))
+            return
+        fut = self._first_status.get(h)
+        if fut is None:
+            fut = self._first_status[h] = asyncio.Future()
+            await self.add_queue.put(h)
+        await asyncio.shield(fut)
+
+    def unsubscribe(self, scripthashes: Iterable[str], queue: asyncio.Queue) -> None:
+        # note: we can't unsubscribe from the server, so we keep
+        # receiving notifications for scripthashes nobody wants anymore
+        for h in scripthashes:
+            queues = self.consumers.get(h)
+            if queues is None or queue not in queues:
+                continue
+            queues.remove(queue)
+            if not queues:
+                del self.consumers[h]
+                self._histories.pop(h, None)
+
+    async def get_history(self, h: str, status: Optional[str]) -> List[dict]:
+        """History of scripthash h, as returned by the server after it
+        announced status. Consumers asking for the same status share the
+        request and the (read-only) result.
+        """
+        cached = self._histories.get(h)
+        if cached is not None and cached[0] == status:
+            fut = cached[1]
+        else:
+            fut = asyncio.ensure_future(
+                self.network.get_history_for_scripthash(h, priority=RequestPriority.BULK))
+            histories = self._histories
+            def forget_on_error(f):
+                if (f.cancelled() or f.exception() is not None) and histories.get(h, (None, None))[1] is f:
+                    del histories[h]
+            fut.add_done_callback(forget_on_error)
+            if h in self.consumers:
+                self._histories[h] = (status, fut)
+        return await asyncio.shield(fut)
+
+    async def send_subscriptions(self):
+        async def subscribe_to_scripthash(h):
+            try:
+                await self.session.subscribe('blockchain.scripthash.subscribe', [h], self.status_queue,
+                                             priority=RequestPriority.BULK)
+            finally:
+                self.num_inflight_subscriptions -= 1
+                self._subscription_slots.release()
+
+        while True:
+            h = await self.add_queue.get()
+            if h in self._subscribed or h not in self.consumers:
+                continue
+            self._subscribed.add(h)
+            await self._subscription_slots.acquire()
+            self.num_inflight_subscriptions += 1
+            await self.group.spawn(subscribe_to_scripthash(h))
+
+    async def handle_status(self):
+        while True:
+            h, status = await self.status_queue.get()
+            self.statuses[h] = status
+            fut = self._first_status.pop(h, None)
+            if fut is not None and not fut.done():
+                fut.set_result(None)
+            for queue in list(self.consumers.get(h, [])):
+                await queue.put((h, status))
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        return {
+            'scripthashes': len(self.consumers),
+            'subscriptions_queued': self.add_queue.qsize(),
+            'subscriptions_in_flight': self.num_inflight_subscriptions,
+        }
+
+
 class SynchronizerBase(NetworkJobOnDefaultServer):
     """Subscribe over the network to a set of addresses, and monitor their statuses.
     Every time a status changes, run a coroutine provided by the subclass.
+
+    At most 'max_inflight_subscriptions' subscriptions and
+    'max_inflight_history_requests' status changes are handled at a time;
+    adding addresses blocks while the subscription queue is full. Pending
+    status changes are coalesced per address, and those of an address are
+    handled one at a time.
     """
     def __init__(self, network: 'Network'):
         self.asyncio_loop = network.asyncio_loop
@@ -60,22 +197,41 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         self.requested_addrs = set()
         self.scripthash_to_address = {}
         self._processed_some_notifications = False  # so that we don't miss them
+        config = self.network.config
+        max_inflight_subscriptions = config.get('max_inflight_subscriptions', DEFAULT_MAX_INFLIGHT_SUBSCRIPTIONS)
+        max_inflight_histories = config.get('max_inflight_history_requests', DEFAULT_MAX_INFLIGHT_HISTORY_REQUESTS)
+        self._subscription_slots = asyncio.Semaphore(max_inflight_subscriptions)
+        self._status_slots = asyncio.Semaphore(max_inflight_histories)
+        self.num_inflight_subscriptions = 0
+        self.pending_statuses = {}  # type: Dict[str, Optional[str]]  # addr -> latest status, not handled yet
+        self.processing_addrs = set()  # addresses whose status is being handled
+        self.progress_event = asyncio.Event()  # set when a subscription or status change was handled
         # Queues
-        self.add_queue = asyncio.Queue()
+        self.add_queue = asyncio.Queue(maxsize=max_inflight_subscriptions)
         self.status_queue = asyncio.Queue()
+        self.pending_status_queue = asyncio.Queue()  # addresses in pending_statuses
 
     async def _start_tasks(self):
+        # on a restart, _reset replaces these before we get cancelled
+        scripthash_to_address, status_queue = self.scripthash_to_address, self.status_queue
         try:
             async with self.group as group:
                 await group.spawn(self.send_subscriptions())
                 await group.spawn(self.handle_status())
+                await group.spawn(self.process_statuses())
                 await group.spawn(self.main())
         finally:
             # we are being cancelled now
-            self.session.unsubscribe(self.status_queue)
+            self.network.subscription_manager.unsubscribe(scripthash_to_address, status_queue)
 
     def add(self, addr):
-        asyncio.run_coroutine_threadsafe(self._add_address(addr), self.asyncio_loop)
+        if not is_address(addr): raise ValueError(f"invalid bitcoin address {addr}")
+        asyncio.run_coroutine_threadsafe(self._spawn_add_address(addr), self.asyncio_loop)
+
+    async def _spawn_add_address(self, addr: str):
+        # in self.group, so that a restart cancels us if we are blocked on
+        # the old add_queue; main adds the addresses again after a restart
+        await self.group.spawn(self._add_address(addr))
 
     async def _add_address(self, addr: str):
         if not is_address(addr): raise ValueError(f"invalid bitcoin address {addr}")
@@ -89,22 +245,63 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
 
     async def send_subscriptions(self):
         async def subscribe_to_address(addr):
-            h = address_to_scripthash(addr)
-            self.scripthash_to_address[h] = addr
-            await self.session.subscribe('blockchain.scripthash.subscribe', [h], self.status_queue)
-            self.requested_addrs.remove(addr)
+            try:
+                h = address_to_scripthash(addr)
+                self.scripthash_to_address[h] = addr
+                await self.network.subscription_manager.subscribe(h, self.status_queue)
+                self.requested_addrs.remove(addr)
+                self.progress_event.set()
+            finally:
+                self.num_inflight_subscriptions -= 1
+                self._subscription_slots.release()
 
         while True:
             addr = await self.add_queue.get()
-            await self.group.spawn(subscribe_to_address, addr)
+            await self._subscription_slots.acquire()
+            self.num_inflight_subscriptions += 1
+            await self.group.spawn(subscribe_to_address(addr))
 
     async def handle_status(self):
         while True:
             h, status = await self.status_queue.get()
             addr = self.scripthash_to_address[h]
-            await self.group.spawn(self._on_address_status, addr, status)
+            already_pending = addr in self.pending_statuses
+            self.pending_statuses[addr] = status
+            if not already_pending and addr not in self.processing_addrs:
+                await self.pending_status_queue.put(addr)
             self._processed_some_notifications = True
 
+    async def process_statuses(self):
+        async def process_status(addr, status):
+            try:
+                await self._on_address_status(addr, status)
+            finally:
+                self.processing_addrs.discard(addr)
+                self._status_slots.release()
+                self.progress_event.set()
+            # a newer status arrived meanwhile
+            if addr in self.pending_statuses:
+                await self.pending_status_queue.put(addr)
+
+        while True:
+            addr = await self.pending_status_queue.get()
+            await self._status_slots.acquire()
+            status = self.pending_statuses.pop(addr)
+            self.processing_addrs.add(addr)
+            await self.group.spawn(process_status(addr, status))
+
+    def wake_up(self):
+        """Thread-safe."""
+        self.asyncio_loop.call_soon_threadsafe(self.progress_event.set)
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        return {
+            'subscriptions_queued': self.add_queue.qsize(),
+            'subscriptions_in_flight': self.num_inflight_subscriptions,
+            'statuses_queued': len(self.pending_statuses),
+            'statuses_in_flight': len(self.processing_addrs),
+        }
+
     async def main(self):
         raise NotImplementedError()  # implemented by subclasses
 
@@ -125,12 +322,16 @@ class Synchronizer(SynchronizerBase):
         super()._reset()
         self.requested_tx = {}
         self.requested_histories = {}
+        # fetched txs, given to the wallet in batches by main; still in requested_tx
+        self.received_txs = {}  # type: Dict[str, Transaction]
 
     def diagnostic_name(self):
         return '{}:{}'.format(self.__class__.__name__, self.wallet.diagnostic_name())
 
     def is_up_to_date(self):
         return (not self.requested_addrs
+                and not self.pending_statuses
+                and not self.processing_addrs
                 and not self.requested_histories
                 and not self.requested_tx)
 
@@ -143,7 +344,7 @@ class Synchronizer(SynchronizerBase):
         # request address history
         self.requested_histories[addr] = status
         h = address_to_scripthash(addr)
-        result = await self.network.get_history_for_scripthash(h)
+        result = await self.network.subscription_manager.get_history(h, status)
         self.print_error("receiving history", addr, len(result))
         hashes = set(map(lambda item: item['tx_hash'], result))
         hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
@@ -177,12 +378,21 @@ class Synchronizer(SynchronizerBase):
             self.requested_tx[tx_hash] = tx_height
 
         if not transaction_hashes: return
-        async with TaskGroup() as group:
-            for tx_hash in transaction_hashes:
-                await group.spawn(self._get_transaction, tx_hash)
+        results = await self.network.get_transactions(transaction_hashes, priority=RequestPriority.BULK)
+        errors = []
+        for tx_hash in transaction_hashes:
+            result = results[tx_hash]
+            if isinstance(result, Exception):
+                # stays in requested_tx, so that we are not up to date
+                self.print_error("cannot get transaction {}: {}".format(tx_hash, repr(result)))
+                errors.append(result)
+                continue
+            self._receive_transaction(tx_hash, result)
+        if errors:
+            # the others are kept; the job is restarted and requests the missing ones
+            raise errors[0]
 
-    async def _get_transaction(self, tx_hash):
-        result = await self.network.get_transaction(tx_hash)
+    def _receive_transaction(self, tx_hash, result):
         tx = Transaction(result)
         try:
             tx.deserialize()
@@ -193,12 +403,20 @@ class Synchronizer(SynchronizerBase):
             self.print_error("received tx does not match expected txid ({} != {})"
                              .format(tx_hash, tx.txid()))
             return
-        tx_height = self.requested_tx.pop(tx_hash)
-        self.wallet.receive_tx_callback(tx_hash, tx, tx_height)
-        self.print_error("received tx %s height: %d bytes: %d" %
-                         (tx_hash, tx_height, len(tx.raw)))
-        # callbacks
-        self.wallet.network.trigger_callback('new_transaction', self.wallet, tx)
+        self.received_txs[tx_hash] = tx
+
+    async def _add_received_txs(self):
+        if not self.received_txs:
+            return
+        txs, self.received_txs = self.received_txs, {}
+        batch = [(tx_hash, tx, self.requested_tx[tx_hash]) for tx_hash, tx in txs.items()]
+        await run_in_thread(self.wallet.receive_tx_batch_callback, batch)
+        for tx_hash, tx, tx_height in batch:
+            self.requested_tx.pop(tx_hash, None)
+            self.print_error("received tx %s height: %d bytes: %d" %
+                             (tx_hash, tx_height, len(tx.raw)))
+            # callbacks
+            self.wallet.network.trigger_callback('new_transaction', self.wallet, tx)
 
     async def main(self):
         self.wallet.set_up_to_date(False)
@@ -211,9 +429,10 @@ class Synchronizer(SynchronizerBase):
         # add addresses to bootstrap
         for addr in self.wallet.get_addresses():
             await self._add_address(addr)
-        # main loop
+        # main loop: runs when something happened, see progress_event
         while True:
-            await asyncio.sleep(0.1)
+            last_run = time.time()
+            await self._add_received_txs()
             await run_in_thread(self.wallet.synchronize)
             up_to_date = self.is_up_to_date()
             if (up_to_date != self.wallet.is_up_to_date()
@@ -221,6 +440,10 @@ class Synchronizer(SynchronizerBase):
                 self._processed_some_notifications = False
                 self.wallet.set_up_to_date(up_to_date)
                 self.wallet.network.trigger_callback('wallet_updated', self.wallet)
+            await self.progress_event.wait()
+            # coalesce bursts of events
+            await asyncio.sleep(max(0, last_run + SYNCHRONIZE_MIN_INTERVAL - time.time()))
+            self.progress_event.clear()
 
 
 class Notifier(SynchronizerBase):
@@ -248,9 +471,9 @@ class Notifier(SynchronizerBase):
         data = {'address': addr, 'status': status}
         for url in self.watched_addresses[addr]:
             try:
-                async with make_aiohttp_session(proxy=self.network.proxy, headers=headers) as session:
-                    async with session.post(url, json=data, headers=headers) as resp:
-                        await resp.text()
+                session = self.network.get_http_session()
+                async with session.post(url, json=data, headers=headers) as resp:
+                    await resp.text()
             except Exception as e:
                 self.print_error(str(e))
             else:
@@ -4,12 +4,99 @@ import os
 
 from electrum import constants, blockchain
 from electrum.simple_config import SimpleConfig
-from electrum.blockchain import Blockchain, deserialize_header, hash_header
+from electrum.blockchain import Blockchain, deserialize_header, serialize_header, hash_header
 from electrum.util import bh2u, bfh, make_dir
 
 from . import SequentialTestCase
 
 
+class TestVerifyChunk(SequentialTestCase):
+
+    # mainnet genesis and block 1
+    CHUNK_0 = bfh("0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c"
+                  "010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299")
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        make_dir(os.path.join(self.data_dir, 'forks'))
+        self.config = SimpleConfig({'electrum_path': self.data_dir})
+        self.chain = Blockchain(config=self.config, forkpoint=0, parent=None,
+                                forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.data_dir)
+
+    def test_valid_chunk(self):
+        self.chain.verify_chunk(0, self.CHUNK_0)
+
+    def test_genesis_mismatch(self):
+        data = bytearray(self.CHUNK_0)
+        data[0] = 2  # version of genesis
+        with self.assertRaisesRegex(Exception, "hash mismatches with expected"):
+            self.chain.verify_chunk(0, bytes(data))
+
+    def test_prev_hash_mismatch(self):
+        data = bytearray(self.CHUNK_0)
+        data[80 + 4] ^= 1  # prev_block_hash of block 1
+        with self.assertRaisesRegex(Exception, "prev hash mismatch"):
+            self.chain.verify_chunk(0, bytes(data))
+
+    def test_bits_mismatch(self):
+        data = bytearray(self.CHUNK_0)
+        data[80 + 72] ^= 1  # bits of block 1
+        with self.assertRaisesRegex(Exception, "bits mismatch"):
+            self.chain.verify_chunk(0, bytes(data))
+
+    def test_insufficient_pow(self):
+        data = bytearray(self.CHUNK_0)
+        data[80 + 76] ^= 1  # nonce of block 1
+        with self.assertRaisesRegex(Exception, "insufficient proof of work"):
+            self.chain.verify_chunk(0, bytes(data))
+
+
+class TestChainworkCache(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        make_dir(os.path.join(self.data_dir, 'forks'))
+        self.config = SimpleConfig({'electrum_path': self.data_dir})
+        self.chain = Blockchain(config=self.config, forkpoint=0, parent=None,
+                                forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        self._orig_cache = dict(blockchain._CHAINWORK_CACHE)
+
+    def tearDown(self):
+        super().tearDown()
+        self._clear_cache()
+        shutil.rmtree(self.data_dir)
+
+    def _clear_cache(self):
+        blockchain._CHAINWORK_CACHE.clear()
+        blockchain._CHAINWORK_CACHE.update(self._orig_cache)
+
+    def test_chainwork_cache_persists(self):
+        self._clear_cache()
+        height = 10 * 2016 + 5
+        work = self.chain.get_chainwork(height)
+        blockchain.save_chainwork_cache(self.config)
+        self._clear_cache()
+        blockchain.load_chainwork_cache(self.config)
+        last_retarget_hash = self.chain.get_hash(10 * 2016 - 1)
+        self.assertEqual(10 * 2016 - 1, blockchain._CHAINWORK_CACHE[last_retarget_hash][0])
+        self.assertEqual(work, self.chain.get_chainwork(height))
+
+    def test_chainwork_cache_entry_at_wrong_height_is_ignored(self):
+        self._clear_cache()
+        work = self.chain.get_chainwork(3 * 2016)
+        block_hash = self.chain.get_hash(3 * 2016 - 1)
+        height, cached_work = blockchain._CHAINWORK_CACHE[block_hash]
+        blockchain._CHAINWORK_CACHE[block_hash] = (height + 2016, cached_work + 1)
+        self.assertEqual(None, self.chain._get_cached_chainwork(3 * 2016 - 1))
+        self.assertEqual(work, self.chain.get_chainwork(3 * 2016))
+
+
 class TestBlockchain(SequentialTestCase):
 
     HEADERS = {
@@ -59,8 +146,11 @@ class TestBlockchain(SequentialTestCase):
         super().setUp()
         self.data_dir = tempfile.mkdtemp()
         make_dir(os.path.join(self.data_dir, 'forks'))
-        self.config = SimpleConfig({'electrum_path': self.data_dir})
+        # write headers through, so that file sizes can be checked
+        self.config = SimpleConfig({'electrum_path': self.data_dir,
+                                    'headers_flush_interval': 0})
         blockchain.blockchains = {}
+        blockchain._HASH_INDEX.clear()
 
     def tearDown(self):
         super().tearDown()
@@ -237,3 +327,111 @@ class TestBlockchain(SequentialTestCase):
 
         for b in (chain_u, chain_l, chain_z):
             self.assertTrue(all([b.can_connect(b.read_header(i), False) for i in range(b.height())]))
+
+    def test_cached_header_hashes_follow_truncation(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain.path(), 'w+').close()
+        for name in 'ABCDEFOP':
+            self._append_header(chain, self.HEADERS[name])
+        self.assertEqual(hash_header(self.HEADERS['O']), chain.get_hash(6))
+        self.assertEqual(hash_header(self.HEADERS['P']), chain.get_hash(7))
+
+        # overwrite height 6 with a competing header, truncating the rest
+        chain.write(bfh(serialize_header(self.HEADERS['G'])), 6 * 80)
+        self.assertEqual(6, chain.height())
+        self.assertEqual(hash_header(self.HEADERS['G']), chain.get_hash(6))
+        self.assertEqual(self.HEADERS['G'], chain.read_header(6))
+        self.assertIsNone(chain.read_header(7))
+        with self.assertRaises(blockchain.MissingHeader):
+            chain.get_hash(7)
+        self._append_header(chain, self.HEADERS['H'])
+        self.assertEqual(hash_header(self.HEADERS['H']), chain.get_hash(7))
+
+    def test_appended_headers_are_written_in_batches(self):
+        config = SimpleConfig({'electrum_path': self.data_dir})
+        blockchain.blockchains[constants.net.GENESIS] = chain = Blockchain(
+            config=config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain.path(), 'w+').close()
+        for name in 'ABC':
+            self._append_header(chain, self.HEADERS[name])
+        self.assertEqual(2, chain.height())
+        self.assertEqual(0, os.stat(chain.path()).st_size)
+        self.assertEqual(self.HEADERS['C'], chain.read_header(2))
+        blockchain.flush_blockchains()
+        self.assertEqual(3 * 80, os.stat(chain.path()).st_size)
+        # pending headers are written out before anything else is
+        for name in 'DEF':
+            self._append_header(chain, self.HEADERS[name])
+        chain.write(bfh(serialize_header(self.HEADERS['E'])), 4 * 80, truncate=False)
+        self.assertEqual(6 * 80, os.stat(chain.path()).st_size)
+        self.assertEqual(self.HEADERS['E'], chain.read_header(4))
+        self.assertEqual(self.HEADERS['F'], chain.read_header(5))
+
+    def test_partially_written_header_is_truncated(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        with open(chain.path(), 'wb') as f:
+            f.write(bfh(serialize_header(self.HEADERS['A'])))
+            f.write(bfh(serialize_header(self.HEADERS['B']))[:30])
+        chain = Blockchain(config=self.config, forkpoint=0, parent=None,
+                           forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        self.assertEqual(0, chain.height())
+        self.assertEqual(80, os.stat(chain.path()).st_size)
+        self._append_header(chain, self.HEADERS['B'])
+        self.assertEqual(self.HEADERS['B'], chain.read_header(1))
+
+    def _build_forked_chains(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        for name in 'ABCDEFOPQRSTU':
+            self._append_header(chain_u, self.HEADERS[name])
+        chain_l = chain_u.fork(self.HEADERS['G'])
+        for name in 'HIJKL':
+            self._append_header(chain_l, self.HEADERS[name])
+        return chain_u, chain_l
+
+    def test_check_header_uses_hash_index(self):
+        chain_u, chain_l = self._build_forked_chains()
+        self.assertEqual((chain_u.get_id(), 12), blockchain._HASH_INDEX[hash_header(self.HEADERS['U'])])
+        self.assertEqual((chain_l.get_id(), 6), blockchain._HASH_INDEX[hash_header(self.HEADERS['G'])])
+        for name in 'ABCDEFOPQRSTU':
+            self.assertEqual(chain_u, blockchain.check_header(self.HEADERS[name]))
+        for name in 'GHIJKL':
+            self.assertEqual(chain_l, blockchain.check_header(self.HEADERS[name]))
+        self.assertIsNone(blockchain.check_header(self.HEADERS['M']))
+        self.assertIsNone(blockchain.can_connect(self.HEADERS['M']))
+        self.assertIsNone(blockchain.can_connect(self.HEADERS['Z']))
+
+    def test_check_header_outside_hash_index_window(self):
+        window = blockchain.HASH_INDEX_WINDOW
+        blockchain.HASH_INDEX_WINDOW = 3
+        try:
+            chain_u, chain_l = self._build_forked_chains()
+            self.assertNotIn(hash_header(self.HEADERS['B']), blockchain._HASH_INDEX)
+            self.assertNotIn(hash_header(self.HEADERS['H']), blockchain._HASH_INDEX)
+            for name in 'ABCDEFOPQRSTU':
+                self.assertEqual(chain_u, blockchain.check_header(self.HEADERS[name]))
+            for name in 'GHIJKL':
+                self.assertEqual(chain_l, blockchain.check_header(self.HEADERS[name]))
+        finally:
+            blockchain.HASH_INDEX_WINDOW = window
+
+    def test_hash_index_follows_swap(self):
+        chain_u, chain_l = self._build_forked_chains()
+        chain_z = chain_l.fork(self.HEADERS['M'])
+        for name in 'NXYZ':
+            self._append_header(chain_z, self.HEADERS[name])
+        # chain_z became the best chain and took over the main headers file
+        self.assertEqual(constants.net.GENESIS, chain_z.get_id())
+        for name in 'ABCDEFGHIMNXYZ':
+            self.assertEqual(chain_z, blockchain.check_header(self.HEADERS[name]))
+        for name in 'OPQRSTU':
+            self.assertEqual(chain_u, blockchain.check_header(self.HEADERS[name]))
+        for name in 'JKL':
+            self.assertEqual(chain_l, blockchain.check_header(self.HEADERS[name]))
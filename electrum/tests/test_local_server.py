@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+
+from aiorpcx import RPCError
+
+from electrum import blockchain, constants
+from electrum.bitcoin import hash160_to_p2pkh, address_to_scripthash
+from electrum.local_server import ServerDataset, LocalServerHandler, LocalServer, merkle_root_and_branches
+from electrum.simple_config import SimpleConfig
+from electrum.synchronizer import history_status
+from electrum.transaction import Transaction
+from electrum.verifier import verify_tx_is_in_block, SPV
+
+from . import SequentialTestCase
+
+
+class TestLocalServer(SequentialTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        constants.set_regtest()
+        cls.addresses = [hash160_to_p2pkh(bytes([i]) * 20) for i in range(1, 6)]
+        cls.dataset = ServerDataset.make_synthetic(cls.addresses, num_blocks=100, txs_per_address=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        constants.set_mainnet()
+
+    def setUp(self):
+        super().setUp()
+        self.handler = LocalServerHandler(self.dataset)
+
+    def test_merkle_branches(self):
+        tx_hashes = [bytes([i]).hex() * 32 for i in range(5)]
+        root, branches = merkle_root_and_branches(tx_hashes)
+        for pos, tx_hash in enumerate(tx_hashes):
+            self.assertEqual(root, SPV.hash_merkle_root(branches[pos], tx_hash, pos))
+        self.assertEqual((tx_hashes[0], [[]]), merkle_root_and_branches(tx_hashes[:1]))
+
+    def test_headers_form_a_chain(self):
+        self.assertEqual(99, self.dataset.height())
+        tip = self.handler.handle('blockchain.headers.subscribe', [])
+        self.assertEqual(99, tip['height'])
+        self.assertEqual(constants.net.GENESIS,
+                         blockchain.hash_raw_header(self.handler.handle('blockchain.block.header', [0])))
+        chunk = self.handler.handle('blockchain.block.headers', [0, 5000])
+        self.assertEqual(100, chunk['count'])
+        self.assertEqual(2016, chunk['max'])
+        prev_hash = constants.net.GENESIS
+        for height in range(1, 100):
+            header = blockchain.deserialize_header(bytes.fromhex(chunk['hex'][height * 160:(height + 1) * 160]), height)
+            self.assertEqual(prev_hash, header['prev_block_hash'])
+            prev_hash = blockchain.hash_header(header)
+        self.assertEqual(tip['hex'], chunk['hex'][-160:])
+        with self.assertRaises(RPCError):
+            self.handler.handle('blockchain.block.header', [100])
+
+    def test_history_transactions_and_proofs(self):
+        for addr in self.addresses:
+            sh = address_to_scripthash(addr)
+            history = self.handler.handle('blockchain.scripthash.get_history', [sh])
+            self.assertEqual(3, len(history))
+            status = history_status([(item['tx_hash'], item['height']) for item in history])
+            self.assertEqual(status, self.handler.handle('blockchain.scripthash.subscribe', [sh]))
+            for item in history:
+                tx_hash, height = item['tx_hash'], item['height']
+                tx = Transaction(self.handler.handle('blockchain.transaction.get', [tx_hash]))
+                self.assertEqual(tx_hash, tx.txid())
+                self.assertEqual(addr, tx.outputs()[0].address)
+                merkle = self.handler.handle('blockchain.transaction.get_merkle', [tx_hash, height])
+                header = blockchain.deserialize_header(self.dataset.get_header(height), height)
+                verify_tx_is_in_block(tx_hash, merkle['merkle'], merkle['pos'], header, height)
+                with self.assertRaises(RPCError):
+                    self.handler.handle('blockchain.transaction.get_merkle', [tx_hash, height + 1])
+            utxos = self.handler.handle('blockchain.scripthash.listunspent', [sh])
+            balance = self.handler.handle('blockchain.scripthash.get_balance', [sh])
+            self.assertEqual(3, len(utxos))
+            self.assertEqual({'confirmed': sum(u['value'] for u in utxos), 'unconfirmed': 0}, balance)
+
+    def test_unknown_scripthash_and_method(self):
+        self.assertIsNone(self.handler.handle('blockchain.scripthash.subscribe', ['00' * 32]))
+        self.assertEqual([], self.handler.handle('blockchain.scripthash.get_history', ['00' * 32]))
+        with self.assertRaises(RPCError):
+            self.handler.handle('blockchain.transaction.get', ['00' * 32])
+        with self.assertRaises(RPCError):
+            self.handler.handle('blockchain.nonexistent', [])
+        with self.assertRaises(RPCError):
+            self.handler.handle('blockchain.block.header', [])
+
+    def test_save_and_load(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(data_dir, 'dataset.json')
+            self.dataset.save(path)
+            dataset = ServerDataset.load(path)
+        finally:
+            shutil.rmtree(data_dir)
+        self.assertEqual(self.dataset.headers, dataset.headers)
+        self.assertEqual(self.dataset.histories, dataset.histories)
+        self.assertEqual(self.dataset.transactions, dataset.transactions)
+        self.assertEqual(self.dataset.merkles, dataset.merkles)
+
+    def test_add_block(self):
+        dataset = ServerDataset.make_synthetic(self.addresses[:1], num_blocks=10, txs_per_address=1)
+        sh = address_to_scripthash(self.addresses[0])
+        status = dataset.get_status(sh)
+        tx_hash = next(iter(dataset.transactions))
+        raw_tx = dataset.transactions[tx_hash]
+        height = dataset.add_block({'ab' * 32: raw_tx}, scripthashes={'ab' * 32: [sh]})
+        self.assertEqual(10, height)
+        self.assertNotEqual(status, dataset.get_status(sh))
+        self.assertEqual({'block_height': 10, 'merkle': [], 'pos': 0}, dataset.merkles['ab' * 32])
+
+    def test_from_config_requires_regtest(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        config = SimpleConfig({'electrum_path': data_dir, 'local_server': {'num_blocks': 10}})
+        self.assertEqual(10 * 80, len(LocalServer.from_config(config).dataset.headers))
+        constants.set_mainnet()
+        try:
+            with self.assertRaises(Exception):
+                LocalServer.from_config(config)
+        finally:
+            constants.set_regtest()
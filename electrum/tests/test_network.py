@@ -1,13 +1,19 @@
 import asyncio
 import tempfile
+import threading
 import unittest
 
+import aiorpcx
+
 from electrum import constants
 from electrum.simple_config import SimpleConfig
 from electrum import blockchain
-from electrum.interface import Interface
+from electrum.interface import (Interface, ServerStats, NetworkTimeout, RequestPriority,
+                                PrioritySemaphore, MethodStats, RpcStats)
+from electrum.network import Network, pick_random_server
+from electrum.local_server import REGTEST_GENESIS_HEADER
 from electrum.crypto import sha256
-from electrum.util import bh2u
+from electrum.util import bh2u, bfh
 
 
 class MockTaskGroup:
@@ -16,6 +22,10 @@ class MockTaskGroup:
 class MockNetwork:
     main_taskgroup = MockTaskGroup()
     asyncio_loop = asyncio.get_event_loop()
+    def __init__(self):
+        self.interfaces = {}
+        self.interfaces_lock = threading.Lock()
+    def trigger_callback(self, event, *args): return
 
 class MockInterface(Interface):
     def __init__(self, config):
@@ -114,6 +124,483 @@ class TestNetwork(unittest.TestCase):
         self.assertEqual(self.interface.q.qsize(), 0)
 
 
+def make_regtest_headers(num_headers, salt=0, start=None):
+    """Returns a chain of serialized regtest headers, starting with the genesis."""
+    headers = start[:] if start else [bfh(blockchain.serialize_header(REGTEST_GENESIS_HEADER))]
+    prev_hash = blockchain.hash_raw_header(bh2u(headers[-1]))
+    for height in range(len(headers), num_headers):
+        header = dict(REGTEST_GENESIS_HEADER, prev_block_hash=prev_hash,
+                      timestamp=REGTEST_GENESIS_HEADER['timestamp'] + height, nonce=salt, block_height=height)
+        headers.append(bfh(blockchain.serialize_header(header)))
+        prev_hash = blockchain.hash_header(header)
+    return headers
+
+class MockHeadersSession:
+    bulk_timeout = NetworkTimeout.Generic.RELAXED
+    def __init__(self, headers):
+        self.headers = headers
+        self.requested = []
+    async def send_request(self, method, params, timeout=None):
+        assert method == 'blockchain.block.headers', method
+        start_height, count = params
+        self.requested.append(start_height // 2016)
+        await asyncio.sleep(0.01)
+        data = b''.join(self.headers[start_height:start_height + count])
+        return {'hex': bh2u(data), 'count': len(data) // 80, 'max': 2016}
+    def is_closing(self):
+        return False
+
+class TestChunkPipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        constants.set_regtest()
+        cls.headers = make_regtest_headers(5 * 2016 + 100)
+        cls.tip = len(cls.headers) - 1
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        constants.set_mainnet()
+
+    def setUp(self):
+        blockchain.blockchains = {}
+        self.config = SimpleConfig({'electrum_path': tempfile.mkdtemp(prefix="test_network"),
+                                    'chunk_pipeline_size': 3})
+        self.interface = self._make_interface(self.headers)
+        chain = self.interface.blockchain
+        chain._size = 0
+        with open(chain.path(), 'wb') as f:
+            f.write(self.headers[0])
+        chain.update_size()
+
+    def _make_interface(self, headers, server='mock-server:50000:t'):
+        ifa = MockInterface(self.config)
+        ifa.server = server
+        ifa.session = MockHeadersSession(headers)
+        ifa.tip = len(headers) - 1
+        ifa.tip_header = blockchain.deserialize_header(headers[-1], ifa.tip)
+        ifa.network.interfaces[server] = ifa
+        return ifa
+
+    def _add_helper(self, headers):
+        helper = self._make_interface(headers, server='mock-helper:50000:t')
+        helper.ready.set_result(1)
+        self.interface.network.interfaces[helper.server] = helper
+        return helper
+
+    def test_pipelined_catchup(self):
+        ifa = self.interface
+        self.assertEqual(('catchup', self.tip + 1), asyncio.get_event_loop().run_until_complete(ifa.sync_until(1)))
+        self.assertEqual(self.tip, ifa.blockchain.height())
+        self.assertEqual(blockchain.hash_raw_header(bh2u(self.headers[-1])), ifa.blockchain.get_hash(self.tip))
+        self.assertEqual([0, 1, 2, 3, 4, 5], sorted(ifa.session.requested))
+
+    def test_chunks_are_spread_across_interfaces(self):
+        ifa = self.interface
+        helper = self._add_helper(self.headers)
+        self.assertEqual(('catchup', self.tip + 1), asyncio.get_event_loop().run_until_complete(ifa.sync_until(1)))
+        self.assertEqual(self.tip, ifa.blockchain.height())
+        self.assertTrue(helper.session.requested)
+        self.assertEqual([0, 1, 2, 3, 4, 5], sorted(ifa.session.requested + helper.session.requested))
+
+    def test_helper_on_other_chain_is_not_used(self):
+        ifa = self.interface
+        other_chain = make_regtest_headers(len(self.headers), salt=1, start=self.headers[:2016])
+        helper = self._add_helper(other_chain)
+        self.assertEqual(('catchup', self.tip + 1), asyncio.get_event_loop().run_until_complete(ifa.sync_until(1)))
+        self.assertEqual(blockchain.hash_raw_header(bh2u(self.headers[-1])), ifa.blockchain.get_hash(self.tip))
+        self.assertEqual([], helper.session.requested)
+
+    def test_bad_chunk_from_helper_is_refetched(self):
+        ifa = self.interface
+        bad_headers = self.headers[:]
+        bad_headers[2016 + 5] = bytes(80)
+        helper = self._add_helper(bad_headers)
+        helper.tip_header = ifa.tip_header
+        self.assertEqual(('catchup', self.tip + 1), asyncio.get_event_loop().run_until_complete(ifa.sync_until(1)))
+        self.assertEqual(blockchain.hash_raw_header(bh2u(self.headers[-1])), ifa.blockchain.get_hash(self.tip))
+        self.assertIn(1, helper.session.requested)
+        self.assertIn(1, ifa.session.requested)
+
+class MockSessionStats:
+    def __init__(self, latency, num_requests=0, num_errors=0, closing=False):
+        self.latency = latency
+        self.num_requests = num_requests
+        self.num_errors = num_errors
+        self.closing = closing
+    def is_closing(self):
+        return self.closing
+
+class MockBatchSession(MockSessionStats):
+    def __init__(self, latency, results):
+        super().__init__(latency)
+        self.results = results  # request -> result
+        self.batches = []
+    async def send_request_batch(self, requests, *, timeout=None, priority=None):
+        self.batches.append(list(requests))
+        return [self.results[(method, tuple(params))] for method, params in requests]
+
+class MockRoutingInterface:
+    def __init__(self, session, chain='main', ready=True):
+        self.session = session
+        self.blockchain = chain
+        self.server = 'mock-server'
+        self.ready = asyncio.Future()
+        self.got_disconnected = asyncio.Future()
+        if ready:
+            self.ready.set_result(1)
+
+class MockRoutingNetwork:
+    _get_interface_for_readonly_request = Network._get_interface_for_readonly_request
+    _get_routing_weight = staticmethod(Network._get_routing_weight)
+    _send_request_batches = Network._send_request_batches
+    _run_on_other_interface = Network._run_on_other_interface
+    def print_error(self, *args): pass
+    def __init__(self, interfaces):
+        self.interfaces = {str(i): iface for i, iface in enumerate(interfaces)}
+        self.interfaces_lock = threading.Lock()
+        self.interface = interfaces[0]
+    def blockchain(self):
+        return 'main'
+
+class TestRequestRouting(unittest.TestCase):
+
+    def test_unusable_interfaces_are_skipped(self):
+        main = MockRoutingInterface(MockSessionStats(0.1))
+        network = MockRoutingNetwork([
+            main,
+            MockRoutingInterface(MockSessionStats(0.01), ready=False),
+            MockRoutingInterface(MockSessionStats(0.01, closing=True)),
+            MockRoutingInterface(MockSessionStats(0.01), chain='fork'),
+        ])
+        for _ in range(20):
+            self.assertIs(main, network._get_interface_for_readonly_request(same_chain=True))
+
+    def test_fork_interface_only_without_same_chain(self):
+        fork = MockRoutingInterface(MockSessionStats(0.01), chain='fork')
+        network = MockRoutingNetwork([MockRoutingInterface(MockSessionStats(10)), fork])
+        picks = [network._get_interface_for_readonly_request() for _ in range(200)]
+        self.assertIn(fork, picks)
+
+    def test_weighted_by_latency_and_errors(self):
+        main = MockRoutingInterface(MockSessionStats(0.1))
+        fast = MockRoutingInterface(MockSessionStats(0.01))
+        flaky = MockRoutingInterface(MockSessionStats(0.01, num_requests=10, num_errors=9))
+        network = MockRoutingNetwork([main, fast, flaky])
+        picks = [network._get_interface_for_readonly_request() for _ in range(1000)]
+        self.assertGreater(picks.count(fast), picks.count(main))
+        self.assertGreater(picks.count(main), picks.count(flaky))
+
+    def test_batch_items_failing_on_other_interface_go_to_main(self):
+        error = aiorpcx.jsonrpc.RPCError(1, 'not found')
+        main = MockRoutingInterface(MockBatchSession(10, {
+            ('get', ('a',)): 'A', ('get', ('b',)): 'B', ('get', ('c',)): error}))
+        fast = MockRoutingInterface(MockBatchSession(0.001, {
+            ('get', ('a',)): 'A', ('get', ('b',)): 'bad', ('get', ('c',)): error}))
+        network = MockRoutingNetwork([main, fast])
+        network.interfaces.pop('0')  # only pick the other one
+        requests = [('get', ['a']), ('get', ['b']), ('get', ['c'])]
+        results = asyncio.get_event_loop().run_until_complete(network._send_request_batches(
+            requests, is_valid=lambda request, result: result != 'bad'))
+        self.assertEqual(['A', 'B', error], results)
+        self.assertEqual([requests], fast.session.batches)
+        self.assertEqual([[('get', ['b']), ('get', ['c'])]], main.session.batches)
+
+    def test_other_interface_disconnecting_falls_back_to_main(self):
+        main = MockRoutingInterface(MockBatchSession(10, {('get', ('a',)): 'A'}))
+        other = MockRoutingInterface(MockBatchSession(0.001, {}))
+        network = MockRoutingNetwork([main, other])
+        network.interfaces.pop('0')  # only pick the other one
+        async def hang(requests, *, timeout=None, priority=None):
+            other.got_disconnected.set_result(1)
+            await asyncio.sleep(10)
+        other.session.send_request_batch = hang
+        requests = [('get', ['a'])]
+        results = asyncio.get_event_loop().run_until_complete(asyncio.wait_for(network._send_request_batches(
+            requests, is_valid=lambda request, result: True), 1))
+        self.assertEqual(['A'], results)
+        self.assertEqual([requests], main.session.batches)
+
+    def test_requests_are_split_into_batches(self):
+        main = MockRoutingInterface(MockBatchSession(0.1, {('get', (i,)): i for i in range(250)}))
+        network = MockRoutingNetwork([main])
+        requests = [('get', [i]) for i in range(250)]
+        results = asyncio.get_event_loop().run_until_complete(network._send_request_batches(
+            requests, is_valid=lambda request, result: True))
+        self.assertEqual(list(range(250)), results)
+        self.assertEqual([100, 100, 50], [len(batch) for batch in main.session.batches])
+
+
+def make_server_stats(latency, num_samples=20, num_attempts=0, num_failures=0):
+    stats = ServerStats()
+    for _ in range(num_samples):
+        stats.record_request(latency)
+    stats.num_attempts += num_attempts
+    stats.num_failures += num_failures
+    return stats
+
+class MockTimeoutNetwork:
+    get_network_timeout_seconds = Network.get_network_timeout_seconds
+    get_bulk_timeout_seconds = Network.get_bulk_timeout_seconds
+    def __init__(self, server_stats, proxy=None):
+        self.server_stats = server_stats
+        self.recent_servers_lock = threading.RLock()
+        self.oneserver = False
+        self.auto_connect = True
+        self.proxy = proxy
+
+class TestServerStats(unittest.TestCase):
+
+    def test_latency_percentiles(self):
+        stats = ServerStats()
+        for i in range(ServerStats.MIN_LATENCY_SAMPLES - 1):
+            stats.record_request(i / 100)
+        self.assertIsNone(stats.get_latency_percentile(50))
+        self.assertEqual(ServerStats.DEFAULT_LATENCY, stats.get_expected_latency())
+        stats.record_ping(0.5)
+        self.assertEqual(0.5, stats.get_expected_latency())
+        for i in range(ServerStats.MIN_LATENCY_SAMPLES - 1, 100):
+            stats.record_request(i / 100)
+        self.assertEqual(0.5, stats.get_latency_percentile(50))
+        self.assertEqual(0.95, stats.get_latency_percentile(95))
+        self.assertEqual(0.99, stats.get_latency_percentile(100))
+        stats.record_request(2)  # oldest sample is dropped
+        self.assertEqual(ServerStats.MAX_LATENCY_SAMPLES, len(stats.latencies))
+        self.assertEqual(2, stats.get_latency_percentile(100))
+
+    def test_json_roundtrip(self):
+        stats = make_server_stats(0.2, num_failures=3)
+        stats.record_connect(0.3)
+        stats.record_ping(0.1)
+        self.assertEqual(stats.to_json(), ServerStats(stats.to_json()).to_json())
+
+    def test_score(self):
+        fast = make_server_stats(0.05)
+        slow = make_server_stats(0.5)
+        flaky = make_server_stats(0.05, num_attempts=30, num_failures=40)
+        self.assertGreater(fast.get_score(), slow.get_score())
+        self.assertGreater(fast.get_score(), ServerStats().get_score())
+        self.assertGreater(slow.get_score(), flaky.get_score())
+
+    def test_pick_random_server_prefers_fast_servers(self):
+        hostmap = {'fast': {'s': '50002'}, 'slow': {'s': '50002'}, 'unknown': {'s': '50002'}}
+        server_stats = {'fast:50002:s': make_server_stats(0.05), 'slow:50002:s': make_server_stats(2)}
+        picks = [pick_random_server(hostmap, 's', server_stats=server_stats) for _ in range(1000)]
+        self.assertGreater(picks.count('fast:50002:s'), picks.count('unknown:50002:s'))
+        self.assertGreater(picks.count('unknown:50002:s'), picks.count('slow:50002:s'))
+        self.assertEqual('slow:50002:s', pick_random_server(hostmap, 's', {'fast:50002:s', 'unknown:50002:s'},
+                                                            server_stats=server_stats))
+
+    def test_adaptive_timeouts(self):
+        network = MockTimeoutNetwork({
+            'fast': make_server_stats(0.01),
+            'normal': make_server_stats(1.2),
+            'slow': make_server_stats(60),
+            'new': ServerStats(),
+        })
+        Generic, Urgent = NetworkTimeout.Generic, NetworkTimeout.Urgent
+        self.assertEqual(Generic.NORMAL, network.get_network_timeout_seconds(Generic))
+        self.assertEqual(Generic.NORMAL, network.get_network_timeout_seconds(Generic, 'new'))
+        self.assertEqual(Generic.NORMAL, network.get_network_timeout_seconds(Generic, 'unknown'))
+        self.assertEqual(Generic.MIN, network.get_network_timeout_seconds(Generic, 'fast'))
+        self.assertEqual(Urgent.MIN, network.get_network_timeout_seconds(Urgent, 'fast'))
+        self.assertEqual(12, network.get_network_timeout_seconds(Urgent, 'normal'))
+        self.assertEqual(Generic.RELAXED, network.get_network_timeout_seconds(Generic, 'slow'))
+        network.proxy = {'mode': 'socks5'}
+        self.assertEqual(Generic.MOST_RELAXED, network.get_network_timeout_seconds(Generic, 'slow'))
+
+    def test_bulk_timeouts_do_not_adapt(self):
+        network = MockTimeoutNetwork({'fast': make_server_stats(0.01)})
+        Generic = NetworkTimeout.Generic
+        self.assertEqual(Generic.MIN, network.get_network_timeout_seconds(Generic, 'fast'))
+        self.assertEqual(Generic.RELAXED, network.get_bulk_timeout_seconds(Generic))
+        network.proxy = {'mode': 'socks5'}
+        self.assertEqual(Generic.MOST_RELAXED, network.get_bulk_timeout_seconds(Generic))
+
+
+class MockHttpNetwork:
+    get_http_session = Network.get_http_session
+    _close_http_session = Network._close_http_session
+    def __init__(self):
+        self.asyncio_loop = asyncio.get_event_loop()
+        self._http_session = None
+        self.proxy = None
+
+class TestHttpSession(unittest.TestCase):
+
+    def test_session_is_shared_until_closed(self):
+        network = MockHttpNetwork()
+        async def f():
+            session = network.get_http_session()
+            self.assertIs(session, network.get_http_session())
+            network._close_http_session()  # e.g. proxy changed
+            await asyncio.sleep(0.1)
+            self.assertTrue(session.closed)
+            new_session = network.get_http_session()
+            self.assertIsNot(session, new_session)
+            await new_session.close()
+            self.assertIsNot(new_session, network.get_http_session())
+            network._close_http_session()
+            await asyncio.sleep(0.1)
+        asyncio.get_event_loop().run_until_complete(f())
+
+
+class TestPrioritySemaphore(unittest.TestCase):
+
+    URGENT, INTERACTIVE, BULK = RequestPriority.URGENT, RequestPriority.INTERACTIVE, RequestPriority.BULK
+
+    def _make_semaphore(self, size=4, limits=None):
+        return PrioritySemaphore(size, limits or {self.URGENT: 4, self.INTERACTIVE: 4, self.BULK: 4})
+
+    def _run_requests(self, semaphore, priorities):
+        """Occupies all slots, queues requests of the given priorities,
+        then frees the slots. Returns the priorities in the order they ran."""
+        order = []
+        async def request(i, priority):
+            async with semaphore.slot(priority):
+                order.append(i)
+                await asyncio.sleep(0)
+        async def f():
+            blockers = [asyncio.Event() for _ in range(semaphore.size)]
+            async def block(event):
+                async with semaphore.slot(self.URGENT):
+                    await event.wait()
+            tasks = [asyncio.ensure_future(block(event)) for event in blockers]
+            await asyncio.sleep(0)
+            tasks += [asyncio.ensure_future(request(i, priority)) for i, priority in enumerate(priorities)]
+            await asyncio.sleep(0)
+            for event in blockers:
+                event.set()
+            await asyncio.gather(*tasks)
+        asyncio.get_event_loop().run_until_complete(f())
+        return [priorities[i] for i in order]
+
+    def test_higher_priority_runs_first(self):
+        semaphore = self._make_semaphore(size=1)
+        priorities = [self.BULK, self.BULK, self.INTERACTIVE, self.URGENT, self.BULK, self.URGENT]
+        self.assertEqual(sorted(priorities), self._run_requests(semaphore, priorities))
+        self.assertEqual(0, semaphore.num_in_use)
+
+    def test_no_starvation(self):
+        semaphore = self._make_semaphore(size=1)
+        priorities = [self.BULK] + [self.URGENT] * 30
+        order = self._run_requests(semaphore, priorities)
+        self.assertEqual(PrioritySemaphore.MAX_SKIPS, order.index(self.BULK))
+
+    def test_limits_reserve_slots_for_higher_priorities(self):
+        semaphore = self._make_semaphore(size=4, limits={self.URGENT: 4, self.INTERACTIVE: 4, self.BULK: 2})
+        max_bulk_in_use = 0
+        async def f():
+            nonlocal max_bulk_in_use
+            release = asyncio.Event()
+            async def bulk():
+                nonlocal max_bulk_in_use
+                async with semaphore.slot(self.BULK):
+                    max_bulk_in_use = max(max_bulk_in_use, semaphore.in_use[self.BULK])
+                    await release.wait()
+            bulk_tasks = [asyncio.ensure_future(bulk()) for _ in range(10)]
+            await asyncio.sleep(0)
+            self.assertEqual({self.URGENT: 0, self.INTERACTIVE: 0, self.BULK: 8}, semaphore.get_queue_sizes())
+            # not blocked by the bulk requests
+            async with semaphore.slot(self.URGENT):
+                pass
+            release.set()
+            await asyncio.gather(*bulk_tasks)
+        asyncio.get_event_loop().run_until_complete(f())
+        self.assertEqual(2, max_bulk_in_use)
+        self.assertEqual(0, semaphore.num_in_use)
+
+    def test_cancelled_waiter_gives_up_its_place(self):
+        semaphore = self._make_semaphore(size=1)
+        async def f():
+            await semaphore.acquire(self.URGENT)
+            waiter = asyncio.ensure_future(semaphore.acquire(self.BULK))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.sleep(0)
+            semaphore.release(self.URGENT)
+            self.assertEqual(0, semaphore.num_in_use)
+            await semaphore.acquire(self.BULK)
+            semaphore.release(self.BULK)
+        asyncio.get_event_loop().run_until_complete(f())
+        self.assertEqual(0, semaphore.num_in_use)
+
+    def test_release_before_cancelled_waiter_runs(self):
+        semaphore = self._make_semaphore(size=1)
+        async def f():
+            await semaphore.acquire(self.URGENT)
+            waiter = asyncio.ensure_future(semaphore.acquire(self.BULK))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            # the slot is freed before the waiter handles its cancellation
+            semaphore.release(self.URGENT)
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(0, semaphore.num_in_use)
+            self.assertEqual({self.URGENT: 0, self.INTERACTIVE: 0, self.BULK: 0}, semaphore.get_queue_sizes())
+            await semaphore.acquire(self.BULK)
+            semaphore.release(self.BULK)
+        asyncio.get_event_loop().run_until_complete(f())
+        self.assertEqual(0, semaphore.num_in_use)
+
+
+class TestRpcStats(unittest.TestCase):
+
+    def test_method_stats(self):
+        stats = MethodStats()
+        self.assertIsNone(stats.get_latency_percentile(50))
+        for latency in [0.005] * 50 + [0.2] * 45 + [3] * 4 + [100]:
+            stats.record_request(latency, 10, 20)
+        stats.record_timeout(10)
+        self.assertEqual(0.01, stats.get_latency_percentile(50))
+        self.assertEqual(0.25, stats.get_latency_percentile(95))
+        self.assertEqual(5, stats.get_latency_percentile(99))
+        self.assertEqual(100, stats.get_latency_percentile(100))
+        d = stats.to_json()
+        self.assertEqual(101, d['count'])
+        self.assertEqual(1, d['timeouts'])
+        self.assertEqual(1010, d['bytes_out'])
+        self.assertEqual(2000, d['bytes_in'])
+        self.assertEqual(100, d['latency_max'])
+        self.assertEqual(50, d['latency_histogram']['<=0.01'])
+        self.assertEqual(1, d['latency_histogram']['>30'])
+        self.assertEqual(100, sum(d['latency_histogram'].values()))
+
+    def test_per_server_and_method(self):
+        rpc_stats = RpcStats(measure_sizes=True)
+        a, b = rpc_stats.for_server('a'), rpc_stats.for_server('b')
+        a.record_request('blockchain.transaction.get', ['00' * 32], 'ab' * 100, 0.1)
+        a.record_request('blockchain.transaction.get', ['00' * 32],
+                         aiorpcx.jsonrpc.RPCError(2, 'not found'), 0.1)
+        a.record_request('server.ping', [], None, 0.1)
+        b.record_timeout('server.ping', [])
+        d = rpc_stats.to_json()
+        tx_get = d['servers']['a']['blockchain.transaction.get']
+        self.assertEqual(2, tx_get['count'])
+        self.assertEqual({'2': 1}, tx_get['errors'])
+        self.assertEqual(2 * (len('blockchain.transaction.get') + 68), tx_get['bytes_out'])
+        self.assertEqual(202 + len('"not found"'), tx_get['bytes_in'])
+        self.assertEqual(1, d['servers']['b']['server.ping']['timeouts'])
+        summary = rpc_stats.get_summary()
+        self.assertEqual({'count': 3, 'timeouts': 0, 'errors': 1,
+                          'bytes_out': 2 * 94 + len('server.ping') + 2,
+                          'bytes_in': 202 + 11 + 4}, summary['a'])
+        self.assertEqual(1, summary['b']['timeouts'])
+        rpc_stats.clear()
+        self.assertEqual({}, rpc_stats.to_json()['servers'])
+
+    def test_sizes_not_measured_by_default(self):
+        rpc_stats = RpcStats()
+        rpc_stats.for_server('a').record_request('blockchain.scripthash.get_history', ['00' * 32],
+                                                 [{'tx_hash': '00' * 32, 'height': 1}], 0.1)
+        d = rpc_stats.to_json()
+        self.assertFalse(d['sizes_measured'])
+        get_history = d['servers']['a']['blockchain.scripthash.get_history']
+        self.assertEqual((1, 0, 0), (get_history['count'], get_history['bytes_out'], get_history['bytes_in']))
+
+
 if __name__=="__main__":
     constants.set_regtest()
     unittest.main()
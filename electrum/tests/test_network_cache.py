@@ -0,0 +1,132 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from electrum.network import Network
+from electrum.network_cache import NetworkCache
+from electrum.simple_config import SimpleConfig
+
+from . import SequentialTestCase
+
+
+# from test_transaction
+RAW_TX = '010000000118231a31d2df84f884ced6af11dc24306319577d4d7c340124a7e2dd9c314077000000004847304402200b6c45891aed48937241907bc3e3868ee4c792819821fcde33311e5a3da4789a02205021b59692b652a01f5f009bd481acac2f647a7d9c076d71d85869763337882e01fdffffff016c95052a010000001976a9149c4891e7791da9e622532c97f43863768264faaf88ac00000000'
+TXID = '90ba90a5b115106d26663fce6c6215b8699c5d4b2672dd30756115f3337dddf9'
+RAW_TX_SIZE = len(RAW_TX) // 2
+BLOCK_HASH_1 = '11' * 32
+BLOCK_HASH_2 = '22' * 32
+
+
+class NetworkCacheTestCase(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.data_dir)
+
+    def _make_cache(self, **kwargs):
+        kwargs.setdefault('network_cache_size', 10 ** 6)
+        config = SimpleConfig(dict(electrum_path=self.data_dir, **kwargs))
+        return NetworkCache(config)
+
+    def _make_merkle(self, i):
+        return {'block_height': i, 'merkle': [BLOCK_HASH_1], 'pos': i}
+
+
+class TestNetworkCache(NetworkCacheTestCase):
+
+    def test_transaction_roundtrip_persists(self):
+        cache = self._make_cache()
+        self.assertIsNone(cache.get_transaction(TXID))
+        cache.put_transaction(TXID, RAW_TX)
+        self.assertEqual(RAW_TX, cache.get_transaction(TXID))
+        self.assertEqual(RAW_TX, self._make_cache().get_transaction(TXID))
+
+    def test_transaction_not_matching_txid_is_not_stored(self):
+        cache = self._make_cache()
+        cache.put_transaction(BLOCK_HASH_1, RAW_TX)
+        cache.put_transaction(TXID, RAW_TX[:-2] + '01')
+        cache.put_transaction(TXID, 'not a tx')
+        self.assertIsNone(cache.get_transaction(BLOCK_HASH_1))
+        self.assertIsNone(cache.get_transaction(TXID))
+        self.assertEqual(0, cache.get_size())
+
+    def test_merkle_keyed_by_block_hash(self):
+        cache = self._make_cache()
+        cache.put_merkle(TXID, BLOCK_HASH_1, self._make_merkle(1))
+        self.assertEqual(self._make_merkle(1), cache.get_merkle(TXID, BLOCK_HASH_1))
+        self.assertIsNone(cache.get_merkle(TXID, BLOCK_HASH_2))
+        self.assertIsNone(cache.get_merkle('../' + TXID, BLOCK_HASH_1))
+
+    def test_lru_eviction(self):
+        merkle_size = len(NetworkCache._serialize_merkle(self._make_merkle(0)))
+        cache = self._make_cache(network_cache_size=RAW_TX_SIZE + 2 * merkle_size - 1)
+        cache.put_transaction(TXID, RAW_TX)
+        cache.put_merkle(TXID, BLOCK_HASH_1, self._make_merkle(0))
+        self.assertIsNotNone(cache.get_transaction(TXID))  # now most recently used
+        cache.put_merkle(TXID, BLOCK_HASH_2, self._make_merkle(0))
+        self.assertIsNone(cache.get_merkle(TXID, BLOCK_HASH_1))
+        self.assertEqual(RAW_TX, cache.get_transaction(TXID))
+        self.assertIsNotNone(cache.get_merkle(TXID, BLOCK_HASH_2))
+        self.assertEqual(RAW_TX_SIZE + merkle_size, cache.get_size())
+        # a smaller budget is enforced when the cache is loaded, in LRU order
+        cache = self._make_cache(network_cache_size=RAW_TX_SIZE)
+        self.assertIsNone(cache.get_transaction(TXID))
+        self.assertIsNotNone(cache.get_merkle(TXID, BLOCK_HASH_2))
+
+    def test_disabled(self):
+        cache = self._make_cache(network_cache_size=0)
+        cache.put_transaction(TXID, RAW_TX)
+        self.assertIsNone(cache.get_transaction(TXID))
+        self.assertFalse(os.path.exists(os.path.join(self.data_dir, 'network_cache')))
+
+    def test_disabled_by_default(self):
+        config = SimpleConfig(dict(electrum_path=self.data_dir))
+        self.assertFalse(NetworkCache(config).is_enabled())
+
+
+class MockCachingNetwork:
+    get_transactions = Network.get_transactions
+    get_transaction = Network.get_transaction
+    _run_cache_io = Network._run_cache_io
+    def __init__(self, network_cache):
+        self.network_cache = network_cache
+        self.requested = []
+    async def _get_transaction(self, tx_hash, *, timeout=None):
+        self.requested.append(tx_hash)
+        return RAW_TX
+    async def _get_transactions(self, tx_hashes, *, timeout=None, priority=None):
+        self.requested.extend(tx_hashes)
+        return {tx_hash: RAW_TX if tx_hash == TXID else Exception() for tx_hash in tx_hashes}
+
+
+class TestNetworkServedFromCache(NetworkCacheTestCase):
+
+    def _run(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def test_get_transaction(self):
+        network = MockCachingNetwork(self._make_cache())
+        self.assertEqual(RAW_TX, self._run(network.get_transaction(TXID)))
+        self.assertEqual(RAW_TX, self._run(network.get_transaction(TXID)))
+        self.assertEqual([TXID], network.requested)
+
+    def test_get_transactions(self):
+        network = MockCachingNetwork(self._make_cache())
+        network.network_cache.put_transaction(TXID, RAW_TX)
+        results = self._run(network.get_transactions([TXID, BLOCK_HASH_1]))
+        self.assertEqual(RAW_TX, results[TXID])
+        self.assertIsInstance(results[BLOCK_HASH_1], Exception)
+        self.assertEqual([BLOCK_HASH_1], network.requested)
+
+    def test_get_transactions_without_cache(self):
+        network = MockCachingNetwork(self._make_cache(network_cache_size=0))
+        results = self._run(network.get_transactions([TXID, BLOCK_HASH_1]))
+        self.assertEqual(RAW_TX, results[TXID])
+        self.assertIsInstance(results[BLOCK_HASH_1], Exception)
+        self.assertEqual(RAW_TX, self._run(network.get_transaction(TXID)))
+        self.assertEqual([TXID, BLOCK_HASH_1, TXID], network.requested)
@@ -0,0 +1,335 @@
+import asyncio
+
+from aiorpcx import TaskGroup
+
+from electrum.bitcoin import hash160_to_p2pkh, address_to_scripthash
+from electrum.synchronizer import SubscriptionManager, SynchronizerBase, Synchronizer
+from electrum.verifier import SPV
+
+from . import SequentialTestCase
+
+
+SH_1 = '11' * 32
+SH_2 = '22' * 32
+
+
+class MockSession:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.subscribed = []
+    async def subscribe(self, method, params, queue, *, priority=None):
+        self.subscribed.append(params[0])
+        await queue.put(params + [self.statuses.get(params[0])])
+    def unsubscribe(self, queue):
+        pass
+
+
+class MockInterface:
+    def __init__(self, statuses):
+        self.session = MockSession(statuses)
+        self.group = TaskGroup()
+
+
+class MockNetwork:
+    def __init__(self, loop, histories, config=None):
+        self.asyncio_loop = loop
+        self.config = config or {}
+        self.interface = None
+        self.histories = histories
+        self.requested = []
+    def register_callback(self, callback, events):
+        pass
+    async def get_history_for_scripthash(self, sh, *, priority=None):
+        self.requested.append(sh)
+        await asyncio.sleep(0)
+        return self.histories[sh]
+
+
+class TestSubscriptionManager(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.get_event_loop()
+        self.network = MockNetwork(self.loop, {SH_1: [{'tx_hash': 'aa' * 32, 'height': 1}]})
+        self.manager = SubscriptionManager(self.network)
+
+    def tearDown(self):
+        self._run(self.manager.stop())
+        super().tearDown()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 1))
+
+    def _connect(self, statuses):
+        self.network.interface = MockInterface(statuses)
+        self._run(self.manager._restart())
+        return self.network.interface.session
+
+    def test_subscription_is_shared(self):
+        session = self._connect({SH_1: 'status1'})
+        q1, q2 = asyncio.Queue(), asyncio.Queue()
+        async def subscribe_both():
+            await asyncio.gather(self.manager.subscribe(SH_1, q1), self.manager.subscribe(SH_1, q2))
+        self._run(subscribe_both())
+        self.assertEqual([SH_1], session.subscribed)
+        self.assertEqual((SH_1, 'status1'), self._run(q1.get()))
+        self.assertEqual((SH_1, 'status1'), self._run(q2.get()))
+        # a later consumer gets the known status without a request
+        q3 = asyncio.Queue()
+        self._run(self.manager.subscribe(SH_1, q3))
+        self.assertEqual((SH_1, 'status1'), self._run(q3.get()))
+        self.assertEqual([SH_1], session.subscribed)
+        # notifications are fanned out
+        self._run(self.manager.status_queue.put([SH_1, 'status2']))
+        for q in (q1, q2, q3):
+            self.assertEqual((SH_1, 'status2'), self._run(q.get()))
+
+    def test_unsubscribe(self):
+        self._connect({})
+        q1, q2 = asyncio.Queue(), asyncio.Queue()
+        self._run(self.manager.subscribe(SH_1, q1))
+        self._run(self.manager.subscribe(SH_1, q2))
+        self._run(self.manager.subscribe(SH_2, q2))
+        self.manager.unsubscribe([SH_1, SH_2], q2)
+        self.assertEqual({SH_1: [q1]}, dict(self.manager.consumers))
+        self.manager.unsubscribe([SH_1], q1)
+        self.assertEqual({}, dict(self.manager.consumers))
+
+    def test_history_fetched_once_per_status(self):
+        self._connect({SH_1: 'status1'})
+        self._run(self.manager.subscribe(SH_1, asyncio.Queue()))
+        async def get_twice(status):
+            return await asyncio.gather(self.manager.get_history(SH_1, status),
+                                        self.manager.get_history(SH_1, status))
+        h1, h2 = self._run(get_twice('status1'))
+        self.assertEqual(self.network.histories[SH_1], h1)
+        self.assertEqual(h1, h2)
+        self.assertEqual([SH_1], self.network.requested)
+        self._run(self.manager.get_history(SH_1, 'status1'))
+        self.assertEqual([SH_1], self.network.requested)
+        self._run(self.manager.get_history(SH_1, 'status2'))
+        self.assertEqual([SH_1, SH_1], self.network.requested)
+
+    def test_resubscribe_on_new_server(self):
+        self._connect({SH_1: 'status1'})
+        q = asyncio.Queue()
+        self._run(self.manager.subscribe(SH_1, q))
+        self.assertEqual((SH_1, 'status1'), self._run(q.get()))
+        session = self._connect({SH_1: 'status2'})
+        self.assertEqual((SH_1, 'status2'), self._run(q.get()))
+        self.assertEqual([SH_1], session.subscribed)
+
+
+class MockSubscriptionManager:
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.subscribed = []
+        self.consumers = {}
+    async def subscribe(self, h, queue):
+        self.consumers.setdefault(h, []).append(queue)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.subscribed.append(h)
+        self.in_flight -= 1
+        await queue.put((h, None))
+    def unsubscribe(self, scripthashes, queue):
+        for h in scripthashes:
+            self.consumers[h].remove(queue)
+
+
+class MockSynchronizer(SynchronizerBase):
+    def __init__(self, network):
+        SynchronizerBase.__init__(self, network)
+        self.handled = []
+        self.unblock = asyncio.Event()
+    async def _on_address_status(self, addr, status):
+        if status is not None:
+            await self.unblock.wait()
+            self.handled.append((addr, status))
+    async def main(self):
+        pass
+
+
+class TestSynchronizerPipeline(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.get_event_loop()
+        self.network = MockNetwork(self.loop, {}, config={'max_inflight_subscriptions': 3,
+                                                          'max_inflight_history_requests': 2})
+        self.network.subscription_manager = MockSubscriptionManager()
+        self.network.interface = MockInterface({})
+        self.synchronizer = MockSynchronizer(self.network)
+        self._run(self.synchronizer._restart())
+        self.addresses = [hash160_to_p2pkh(bytes([i]) * 20) for i in range(20)]
+
+    def tearDown(self):
+        self._run(self.synchronizer.stop())
+        super().tearDown()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 1))
+
+    async def _wait_until(self, predicate):
+        while not predicate():
+            await asyncio.sleep(0.001)
+
+    def test_subscriptions_are_bounded(self):
+        async def add_all():
+            for addr in self.addresses:
+                await self.synchronizer._add_address(addr)
+                self.assertLessEqual(self.synchronizer.add_queue.qsize(), 3)
+            await self._wait_until(lambda: not self.synchronizer.requested_addrs)
+        self._run(add_all())
+        manager = self.network.subscription_manager
+        self.assertEqual(set(map(address_to_scripthash, self.addresses)), set(manager.subscribed))
+        self.assertEqual(3, manager.max_in_flight)
+        self.assertEqual({'subscriptions_queued': 0, 'subscriptions_in_flight': 0,
+                          'statuses_queued': 0, 'statuses_in_flight': 0},
+                         self.synchronizer.get_queue_depths())
+
+    def test_statuses_are_coalesced_per_address(self):
+        addr1, addr2, addr3 = self.addresses[:3]
+        async def run():
+            for addr in (addr1, addr2, addr3):
+                await self.synchronizer._add_address(addr)
+            await self._wait_until(lambda: not self.synchronizer.requested_addrs)
+            for status in ('a', 'b', 'c'):
+                for addr in (addr1, addr2, addr3):
+                    await self.synchronizer.status_queue.put((address_to_scripthash(addr), status))
+            await self._wait_until(lambda: self.synchronizer.status_queue.empty())
+            await asyncio.sleep(0.01)
+            # two addresses in flight; the pending statuses are coalesced to one per address
+            depths = self.synchronizer.get_queue_depths()
+            self.assertEqual(2, depths['statuses_in_flight'])
+            self.assertEqual(3, depths['statuses_queued'] + depths['statuses_in_flight'])
+            self.synchronizer.unblock.set()
+            await self._wait_until(lambda: not (self.synchronizer.pending_statuses
+                                                or self.synchronizer.processing_addrs))
+        self._run(run())
+        handled = self.synchronizer.handled
+        for addr in (addr1, addr2, addr3):
+            statuses = [status for a, status in handled if a == addr]
+            self.assertEqual('c', statuses[-1])
+            self.assertLessEqual(len(statuses), 2)
+
+    def test_restart_unsubscribes_old_queue(self):
+        addr = self.addresses[0]
+        h = address_to_scripthash(addr)
+        manager = self.network.subscription_manager
+        async def run():
+            for i in range(3):
+                await self.synchronizer._add_address(addr)
+                await self._wait_until(lambda: not self.synchronizer.requested_addrs)
+                await self.synchronizer._restart()
+                await self._wait_until(lambda: not manager.consumers[h])
+        self._run(run())
+        self.assertEqual(3, len(manager.subscribed))
+
+    def test_restart_cancels_blocked_adds(self):
+        manager = self.network.subscription_manager
+        async def subscribe(h, queue):
+            manager.consumers.setdefault(h, []).append(queue)
+            await asyncio.Event().wait()
+        manager.subscribe = subscribe
+        def blocked_adds():
+            return [task for task in asyncio.all_tasks(self.loop)
+                    if task._coro.__name__ == '_add_address' and not task.done()]
+        async def run():
+            for addr in self.addresses:
+                self.synchronizer.add(addr)
+            await self._wait_until(self.synchronizer.add_queue.full)
+            await asyncio.sleep(0.01)
+            self.assertTrue(blocked_adds())
+            await self.synchronizer._restart()
+            await asyncio.sleep(0.01)
+            self.assertEqual([], blocked_adds())
+        self._run(run())
+
+    def test_add_rejects_invalid_address(self):
+        with self.assertRaises(ValueError):
+            self.synchronizer.add('not an address')
+
+
+class MockTxNetwork:
+    def __init__(self, results):
+        self.results = results
+    async def get_transactions(self, tx_hashes, *, priority=None):
+        return {tx_hash: self.results[tx_hash] for tx_hash in tx_hashes}
+
+
+class MockTxSynchronizer:
+    _request_missing_txs = Synchronizer._request_missing_txs
+    _receive_transaction = Synchronizer._receive_transaction
+    def __init__(self, network):
+        self.network = network
+        self.wallet = MockWallet()
+        self.wallet.transactions = {}
+        self.requested_tx = {}
+        self.received_txs = {}
+    def print_error(self, *args): pass
+
+
+class TestRequestMissingTxs(SequentialTestCase):
+
+    def test_failed_tx_stays_requested(self):
+        # from test_transaction
+        raw_tx = '010000000118231a31d2df84f884ced6af11dc24306319577d4d7c340124a7e2dd9c314077000000004847304402200b6c45891aed48937241907bc3e3868ee4c792819821fcde33311e5a3da4789a02205021b59692b652a01f5f009bd481acac2f647a7d9c076d71d85869763337882e01fdffffff016c95052a010000001976a9149c4891e7791da9e622532c97f43863768264faaf88ac00000000'
+        txid = '90ba90a5b115106d26663fce6c6215b8699c5d4b2672dd30756115f3337dddf9'
+        error = Exception('not found')
+        synchronizer = MockTxSynchronizer(MockTxNetwork({txid: raw_tx, SH_1: error}))
+        with self.assertRaises(Exception) as ctx:
+            asyncio.get_event_loop().run_until_complete(
+                synchronizer._request_missing_txs([(txid, 1), (SH_1, 2)]))
+        self.assertIs(error, ctx.exception)
+        self.assertEqual([txid], list(synchronizer.received_txs))
+        self.assertEqual({txid: 1, SH_1: 2}, synchronizer.requested_tx)
+
+
+class MockBlockchain:
+    def height(self):
+        return 100
+
+
+class MockWallet:
+    def __init__(self):
+        self.num_checks = 0
+    def get_unverified_txs(self):
+        self.num_checks += 1
+        return {}
+    def diagnostic_name(self):
+        return 'mock'
+
+
+class TestSPVWakeups(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.get_event_loop()
+        self.network = MockNetwork(self.loop, {})
+        chain = MockBlockchain()
+        self.network.blockchain = lambda: chain
+        self.network.interface = MockInterface({})
+        self.wallet = MockWallet()
+        self.spv = SPV(self.network, self.wallet)
+        self._run(self.spv._restart())
+
+    def tearDown(self):
+        self._run(self.spv.stop())
+        super().tearDown()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 1))
+
+    def test_no_polling_when_idle(self):
+        self._run(asyncio.sleep(0.3))
+        self.assertEqual(1, self.wallet.num_checks)
+        self.spv.wake_up()
+        self._run(asyncio.sleep(0.2))
+        self.assertEqual(2, self.wallet.num_checks)
+        self.spv.on_blockchain_updated('blockchain_updated')
+        self.spv.on_blockchain_updated('blockchain_updated')
+        self._run(asyncio.sleep(0.2))
+        self.assertEqual(3, self.wallet.num_checks)
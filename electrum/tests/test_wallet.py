@@ -10,9 +10,13 @@ import time
 from io import StringIO
 from electrum.storage import WalletStorage, FINAL_SEED_VERSION
 from electrum.wallet import Abstract_Wallet
+from electrum.address_synchronizer import (AddressSynchronizer, LazyTransactions, sort_by_dependencies,
+                                           TX_HEIGHT_UNCONFIRMED)
+from electrum.transaction import Transaction
 from electrum.exchange_rate import ExchangeBase, FxThread
-from electrum.util import TxMinedInfo
-from electrum.bitcoin import COIN
+from electrum.util import TxMinedInfo, bfh, bh2u
+from electrum.bitcoin import COIN, COINBASE_MATURITY, int_to_hex, var_int
+from electrum.blockchain import hash_header
 
 from . import SequentialTestCase
 
@@ -75,6 +79,75 @@ class TestWalletStorage(WalletTestCase):
             contents = f.read()
         self.assertEqual(some_dict, json.loads(contents))
 
+    def test_convert_version_19(self):
+        txid = '11' * 32
+        some_dict = {
+            "seed_version": 18,
+            "txo": {txid: {"addr1": [[0, 1000, False], [2, 3000, False]]}},
+            "txi": {txid: {"addr2": [["22" * 32 + ":1", 5000]]}}}
+        with open(self.wallet_path, "w") as f:
+            f.write(json.dumps(some_dict))
+
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertTrue(storage.requires_upgrade())
+        storage.upgrade()
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertEqual(FINAL_SEED_VERSION, storage.get_seed_version())
+        self.assertEqual({txid: {"addr1": {"0": [1000, False], "2": [3000, False]}}}, storage.get('txo'))
+        self.assertEqual({txid: {"addr2": {"22" * 32 + ":1": 5000}}}, storage.get('txi'))
+
+def make_header(height, nonce=0):
+    return {'version': 1, 'prev_block_hash': '00' * 32, 'merkle_root': '00' * 32,
+            'timestamp': 0, 'bits': 0, 'nonce': nonce, 'block_height': height}
+
+
+class FakeBlockchain:
+
+    def __init__(self, headers):
+        self.headers = {header['block_height']: header for header in headers}
+
+    def read_header(self, height):
+        return self.headers.get(height)
+
+
+class TestUndoVerifications(WalletTestCase):
+
+    def setUp(self):
+        super().setUp()
+        storage = WalletStorage(self.wallet_path)
+        self.adb = AddressSynchronizer(storage)
+
+    def _add_verified_tx(self, txid, header):
+        info = TxMinedInfo(height=header['block_height'], conf=None, timestamp=0, txpos=0,
+                           header_hash=hash_header(header))
+        with self.adb.lock:
+            self.adb.unverified_tx.pop(txid, None)
+            self.adb._set_verified_tx(txid, info)
+
+    def test_undo_verifications_only_touches_reorged_heights(self):
+        h100, h200, h300 = make_header(100), make_header(200), make_header(300)
+        self._add_verified_tx('aa', h100)
+        self._add_verified_tx('bb', h200)
+        self._add_verified_tx('cc', h200)
+        self._add_verified_tx('dd', h300)
+        self.assertEqual([100, 200, 300], self.adb._verified_tx_heights)
+        chain = FakeBlockchain([h100, h200, make_header(300, nonce=1)])
+        self.assertEqual({'dd'}, self.adb.undo_verifications(chain, 150))
+        self.assertEqual({'aa', 'bb', 'cc'}, set(self.adb.verified_tx))
+        self.assertEqual({'dd': 300}, self.adb.get_unverified_txs())
+        self.assertEqual([100, 200], self.adb._verified_tx_heights)
+        chain = FakeBlockchain([h100])
+        self.assertEqual({'bb', 'cc'}, self.adb.undo_verifications(chain, 150))
+        self.assertEqual({'aa'}, set(self.adb.verified_tx))
+        self.assertEqual({100: {'aa'}}, self.adb._verified_tx_by_height)
+
+    def test_reverifying_at_other_height_moves_tx_in_index(self):
+        self._add_verified_tx('aa', make_header(100))
+        self._add_verified_tx('aa', make_header(101))
+        self.assertEqual({101: {'aa'}}, self.adb._verified_tx_by_height)
+        self.assertEqual([101], self.adb._verified_tx_heights)
+
+
 class FakeExchange(ExchangeBase):
     def __init__(self, rate):
         super().__init__(lambda self: None, lambda self: None)
@@ -138,3 +211,190 @@ class TestFiat(TestCase):
     def test_save_garbage(self):
         self.assertEqual(False, Abstract_Wallet.set_fiat_value(self.wallet, txid, ccy, 'garbage', self.fx, self.value_sat))
         self.assertNotIn(ccy, self.fiat_value)
+
+
+class FakeNetwork:
+    def __init__(self, local_height):
+        self.local_height = local_height
+    def get_local_height(self):
+        return self.local_height
+    def trigger_callback(self, event, *args):
+        pass
+
+
+class TestBulkTransactionImport(WalletTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.adb = AddressSynchronizer(WalletStorage(self.wallet_path))
+        # parent <- child <- grandchild
+        self.txs = []
+        prevout_hash = '11' * 32
+        for i in range(3):
+            tx = Transaction(self._make_tx(prevout_hash, i))
+            prevout_hash = tx.txid()
+            self.txs.append((tx.txid(), tx, 100 + i))
+
+    @staticmethod
+    def _make_tx(prevout_hash, n):
+        script = '76a914' + '22' * 20 + '88ac'
+        return ('01000000' + '01' + bh2u(bfh(prevout_hash)[::-1]) + '00000000' + '00' + 'ffffffff'
+                + '01' + int_to_hex(10000 - n, 8) + var_int(len(script) // 2) + script + '00000000')
+
+    def test_sort_by_dependencies(self):
+        parent, child, grandchild = self.txs
+        self.assertEqual(self.txs, sort_by_dependencies([grandchild, child, parent]))
+        self.assertEqual(self.txs, sort_by_dependencies([child, grandchild, parent, child]))
+        self.assertEqual([child, grandchild], sort_by_dependencies([grandchild, child]))
+
+    def test_receive_tx_batch(self):
+        parent, child, grandchild = self.txs
+        self.adb.receive_tx_batch_callback([grandchild, parent, child])
+        self.assertEqual({parent[0], child[0], grandchild[0]}, set(self.adb.transactions))
+        self.assertEqual({0: child[0]}, self.adb.spent_outpoints[parent[0]])
+        self.assertEqual({0: grandchild[0]}, self.adb.spent_outpoints[child[0]])
+        self.assertEqual({parent[0]: 100, child[0]: 101, grandchild[0]: 102}, self.adb.get_unverified_txs())
+
+    def test_outpoint_index(self):
+        parent, child, grandchild = self.txs
+        addr = parent[1].outputs()[0].address
+        self.adb.history[addr] = []
+        # the child is added before its parent; its input is resolved when the parent arrives
+        for tx_hash, tx, tx_height in (child, parent):
+            self.adb.receive_tx_callback(tx_hash, tx, tx_height)
+        self.assertEqual((addr, 10000, False), self.adb.get_txo(parent[0], 0))
+        self.assertEqual((addr, 9999, False), self.adb.get_txo(child[0], 0))
+        self.assertIsNone(self.adb.get_txo(parent[0], 1))
+        self.assertEqual({addr: {0: (10000, False)}}, self.adb.txo[parent[0]])
+        self.assertEqual({addr: {parent[0] + ':0': 10000}}, self.adb.txi[child[0]])
+        self.assertEqual(addr, self.adb.get_txin_address(grandchild[1].inputs()[0]))
+        self.assertEqual((True, True, -1, 1), self.adb.get_wallet_delta(child[1]))
+        # the index survives a save and reload
+        self.adb.save_transactions(write=True)
+        adb = AddressSynchronizer(WalletStorage(self.wallet_path))
+        self.assertEqual(self.adb.txo, adb.txo)
+        self.assertEqual(self.adb.txi, adb.txi)
+        self.assertEqual((addr, 9999, False), adb.get_txo(child[0], 0))
+        self.adb.remove_transaction(child[0])
+        self.assertIsNone(self.adb.get_txo(child[0], 0))
+
+    def test_lazy_transactions(self):
+        parent, child, grandchild = self.txs
+        txs = LazyTransactions({parent[0]: str(parent[1]), child[0]: str(child[1])}, cache_size=1)
+        self.assertIn(parent[0], txs)
+        self.assertNotIn(grandchild[0], txs)
+        self.assertEqual({}, txs._cache)
+        self.assertEqual(parent[0], txs[parent[0]].txid())
+        self.assertIs(txs[parent[0]], txs[parent[0]])
+        self.assertEqual(child[0], txs.get(child[0]).txid())
+        self.assertEqual([child[0]], list(txs._cache))
+        txs[grandchild[0]] = grandchild[1]
+        self.assertIs(grandchild[1], txs[grandchild[0]])
+        self.assertEqual(str(grandchild[1]), txs.get_raw(grandchild[0]))
+        self.assertEqual(3, len(txs))
+        del txs[grandchild[0]]
+        self.assertEqual({parent[0], child[0]}, set(txs))
+        self.assertIsNone(txs.get(grandchild[0]))
+        # transactions are deserialized when used after a reload
+        self.adb.receive_tx_batch_callback([parent, child])
+        self.adb.save_transactions(write=True)
+        adb = AddressSynchronizer(WalletStorage(self.wallet_path))
+        self.assertEqual({parent[0], child[0]}, set(adb.transactions))
+        self.assertEqual({}, adb.transactions._cache)
+        self.assertEqual(child[0], adb.transactions[child[0]].txid())
+
+    def test_pack_txo_addresses(self):
+        pack = AddressSynchronizer._pack_txo_addresses
+        self.assertEqual(('a', None, 'b'), pack({0: 'a', 2: 'b'}))
+        self.assertEqual({100: 'a'}, pack({100: 'a'}))
+
+    def _check_balance_cache(self, addr):
+        adb = self.adb
+        self.assertEqual(adb._compute_addr_balance(addr), adb.get_addr_balance(addr))
+        self.assertEqual(adb._compute_addr_balance(addr), adb.get_balance())
+        self.assertEqual(adb.get_balance(), adb.get_balance([addr]))
+        return adb.get_balance()
+
+    def test_balance_cache(self):
+        parent, child, grandchild = self.txs
+        addr = parent[1].outputs()[0].address
+        self.adb.history[addr] = []
+        self.adb.network = FakeNetwork(200)
+        self.assertEqual((0, 0, 0), self._check_balance_cache(addr))
+        self.adb.receive_tx_callback(*parent)
+        self.assertEqual((10000, 0, 0), self._check_balance_cache(addr))
+        self.adb.receive_tx_callback(child[0], child[1], TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual((10000, -1, 0), self._check_balance_cache(addr))
+        self.adb.add_verified_tx(child[0], TxMinedInfo(height=101, timestamp=0, txpos=1, header_hash='00'))
+        self.assertEqual((9999, 0, 0), self._check_balance_cache(addr))
+        self.adb.remove_transaction(child[0])
+        self.assertEqual((10000, 0, 0), self._check_balance_cache(addr))
+
+    def test_utxo_cache(self):
+        parent, child, grandchild = self.txs
+        addr = parent[1].outputs()[0].address
+        self.adb.history[addr] = []
+        self.adb.network = FakeNetwork(200)
+        self.adb.receive_tx_callback(*parent)
+        self.adb.receive_tx_callback(child[0], child[1], TX_HEIGHT_UNCONFIRMED)
+        coins = self.adb.get_utxos()
+        self.assertEqual([{'address': addr, 'value': 9999, 'prevout_n': 0, 'prevout_hash': child[0],
+                           'height': TX_HEIGHT_UNCONFIRMED, 'coinbase': False}], coins)
+        self.assertEqual(coins, self.adb.get_utxos([addr]))
+        self.assertEqual({child[0] + ':0': coins[0]}, self.adb.get_addr_utxo(addr))
+        self.assertEqual([], self.adb.get_utxos(confirmed_only=True))
+        self.assertEqual([], self.adb.get_utxos(excluded={addr}))
+        # coins are copies
+        coins[0]['value'] = 0
+        self.assertEqual(9999, self.adb.get_utxos()[0]['value'])
+        self.adb.add_verified_tx(child[0], TxMinedInfo(height=101, timestamp=0, txpos=1, header_hash='00'))
+        self.assertEqual(101, self.adb.get_utxos(confirmed_only=True)[0]['height'])
+        self.adb.remove_transaction(child[0])
+        self.assertEqual([parent[0]], [coin['prevout_hash'] for coin in self.adb.get_utxos()])
+
+    def test_history_cache(self):
+        parent, child, grandchild = self.txs
+        addr = parent[1].outputs()[0].address
+        self.adb.history[addr] = []
+        self.adb.network = FakeNetwork(200)
+        self.adb.receive_tx_callback(*parent)
+        self.adb.receive_tx_callback(child[0], child[1], TX_HEIGHT_UNCONFIRMED)
+        hist = [(tx_hash, delta, balance) for tx_hash, tx_mined_status, delta, balance in self.adb.get_history()]
+        self.assertEqual([(parent[0], 10000, 10000), (child[0], -1, 9999)], hist)
+        self.assertEqual(self.adb.get_history(), self.adb.get_history([addr]))
+        self.assertEqual([], self.adb.get_history(['1BitcoinEaterAddressDontSendf59kuE']))
+        # the child gets mined before its parent is verified
+        self.adb.add_verified_tx(child[0], TxMinedInfo(height=99, timestamp=0, txpos=1, header_hash='00'))
+        hist = [(tx_hash, tx_mined_status.conf, balance) for tx_hash, tx_mined_status, delta, balance in self.adb.get_history()]
+        self.assertEqual([(child[0], 102, -1), (parent[0], 0, 9999)], hist)
+        self.adb.remove_transaction(child[0])
+        self.assertEqual([(parent[0], 10000)], [(h[0], h[3]) for h in self.adb.get_history()])
+
+    def test_history_cache_address_added_later(self):
+        script1, script2 = ('76a914' + c * 20 + '88ac' for c in ('33', '44'))
+        tx = Transaction('01000000' + '01' + '11' * 32 + '00000000' + '00' + 'ffffffff' + '02'
+                         + int_to_hex(5000, 8) + var_int(len(script1) // 2) + script1
+                         + int_to_hex(7000, 8) + var_int(len(script2) // 2) + script2 + '00000000')
+        tx_hash = tx.txid()
+        addr1, addr2 = (o.address for o in tx.outputs())
+        self.adb.history[addr1] = []
+        self.adb.network = FakeNetwork(100)
+        self.adb.receive_tx_callback(tx_hash, tx, 100)
+        self.assertEqual([(tx_hash, 5000, 5000)], [(h[0], h[2], h[3]) for h in self.adb.get_history()])
+        # the history of the second address arrives later
+        self.adb.receive_history_callback(addr2, [(tx_hash, 100)], {})
+        self.assertEqual([(tx_hash, 12000, 12000)], [(h[0], h[2], h[3]) for h in self.adb.get_history()])
+
+    def test_balance_cache_coinbase_maturity(self):
+        script = '76a914' + '22' * 20 + '88ac'
+        tx = Transaction('01000000' + '01' + '00' * 32 + 'ffffffff' + '02' + '0101' + 'ffffffff'
+                         + '01' + int_to_hex(5000, 8) + var_int(len(script) // 2) + script + '00000000')
+        addr = tx.outputs()[0].address
+        self.adb.history[addr] = []
+        self.adb.network = FakeNetwork(100)
+        self.adb.receive_tx_callback(tx.txid(), tx, 100)
+        self.assertEqual((0, 0, 5000), self._check_balance_cache(addr))
+        self.assertEqual([], self.adb.get_utxos(mature=True))
+        self.adb.network.local_height = 100 + COINBASE_MATURITY
+        self.assertEqual((5000, 0, 0), self._check_balance_cache(addr))
+        self.assertEqual(1, len(self.adb.get_utxos(mature=True)))
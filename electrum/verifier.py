@@ -22,7 +22,8 @@
 # SOFTWARE.
 
 import asyncio
-from typing import Sequence, Optional, TYPE_CHECKING
+import time
+from typing import Sequence, Optional, TYPE_CHECKING, Tuple
 
 import aiorpcx
 
@@ -31,7 +32,7 @@ from .crypto import sha256d
 from .bitcoin import hash_decode, hash_encode
 from .transaction import Transaction
 from .blockchain import hash_header
-from .interface import GracefulDisconnect
+from .interface import GracefulDisconnect, MAX_BATCH_REQUEST_SIZE, RequestPriority
 from . import constants
 
 if TYPE_CHECKING:
@@ -45,17 +46,24 @@ class MerkleRootMismatch(MerkleVerificationFailure): pass
 class InnerNodeOfSpvProofIsValidTx(MerkleVerificationFailure): pass
 
 
+# SPV.main looks for work when woken up, but not more often than this (seconds)
+SPV_MIN_INTERVAL = 0.1
+
+
 class SPV(NetworkJobOnDefaultServer):
     """ Simple Payment Verification """
 
     def __init__(self, network: 'Network', wallet: 'AddressSynchronizer'):
         self.wallet = wallet
         NetworkJobOnDefaultServer.__init__(self, network)
+        network.register_callback(self.on_blockchain_updated, ['blockchain_updated'])
 
     def _reset(self):
         super()._reset()
         self.merkle_roots = {}  # txid -> merkle root (once it has been verified)
         self.requested_merkle = set()  # txid set of pending requests
+        # set on new headers, chain switches and new unverified txs
+        self.wakeup_event = asyncio.Event()
 
     async def _start_tasks(self):
         async with self.group as group:
@@ -67,14 +75,30 @@ class SPV(NetworkJobOnDefaultServer):
     async def main(self):
         self.blockchain = self.network.blockchain()
         while True:
+            last_run = time.time()
             await self._maybe_undo_verifications()
             await self._request_proofs()
-            await asyncio.sleep(0.1)
+            await self.wakeup_event.wait()
+            # coalesce bursts of events
+            await asyncio.sleep(max(0, last_run + SPV_MIN_INTERVAL - time.time()))
+            self.wakeup_event.clear()
+
+    def on_blockchain_updated(self, event, *args):
+        self.wakeup_event.set()
+
+    def wake_up(self):
+        """Thread-safe."""
+        if not self.wakeup_event.is_set():
+            self.network.asyncio_loop.call_soon_threadsafe(self.wakeup_event.set)
+
+    async def _request_chunk(self, height: int):
+        await self.network.request_chunk(height, None, can_return_early=True)
+        self.wakeup_event.set()  # the header might be there now
 
     async def _request_proofs(self):
         local_height = self.blockchain.height()
         unverified = self.wallet.get_unverified_txs()
-
+        to_request = []
         for tx_hash, tx_height in unverified.items():
             # do not request merkle branch if we already requested it
             if tx_hash in self.requested_merkle or tx_hash in self.merkle_roots:
@@ -86,22 +110,30 @@ class SPV(NetworkJobOnDefaultServer):
             header = self.blockchain.read_header(tx_height)
             if header is None:
                 if tx_height < constants.net.max_checkpoint():
-                    await self.group.spawn(self.network.request_chunk(tx_height, None, can_return_early=True))
+                    await self.group.spawn(self._request_chunk(tx_height))
                 continue
             # request now
             self.print_error('requested merkle', tx_hash)
             self.requested_merkle.add(tx_hash)
-            await self.group.spawn(self._request_and_verify_single_proof, tx_hash, tx_height)
+            to_request.append((tx_hash, tx_height))
+        # proofs are requested in batches
+        for i in range(0, len(to_request), MAX_BATCH_REQUEST_SIZE):
+            await self.group.spawn(self._request_and_verify_proofs, to_request[i:i + MAX_BATCH_REQUEST_SIZE])
+
+    async def _request_and_verify_proofs(self, txs: Sequence[Tuple[str, int]]):
+        results = await self.network.get_merkles_for_transactions(txs, priority=RequestPriority.BULK)
+        for (tx_hash, tx_height), merkle in zip(txs, results):
+            if isinstance(merkle, aiorpcx.jsonrpc.RPCError):
+                self.print_error('tx {} not at height {}'.format(tx_hash, tx_height))
+                self.wallet.remove_unverified_tx(tx_hash, tx_height)
+                try: self.requested_merkle.remove(tx_hash)
+                except KeyError: pass
+                continue
+            if isinstance(merkle, Exception):
+                raise merkle
+            await self._verify_proof(tx_hash, tx_height, merkle)
 
-    async def _request_and_verify_single_proof(self, tx_hash, tx_height):
-        try:
-            merkle = await self.network.get_merkle_for_transaction(tx_hash, tx_height)
-        except aiorpcx.jsonrpc.RPCError as e:
-            self.print_error('tx {} not at height {}'.format(tx_hash, tx_height))
-            self.wallet.remove_unverified_tx(tx_hash, tx_height)
-            try: self.requested_merkle.remove(tx_hash)
-            except KeyError: pass
-            return
+    async def _verify_proof(self, tx_hash, tx_height, merkle):
         # Verify the hash of the server-provided merkle branch to a
         # transaction matches the merkle root of its block
         if tx_height != merkle.get('block_height'):
@@ -587,7 +587,7 @@ class Abstract_Wallet(AddressSynchronizer):
             # is_mine outputs should not be spent yet
             # to avoid cancelling our own dependent transactions
             txid = tx.txid()
-            if any([self.is_mine(o.address) and self.spent_outpoints[txid].get(output_idx)
+            if any([self.is_mine(o.address) and self.spent_outpoints.get(txid, {}).get(output_idx)
                     for output_idx, o in enumerate(tx.outputs())]):
                 continue
             # all inputs should be is_mine
@@ -1175,14 +1175,9 @@ class Abstract_Wallet(AddressSynchronizer):
         return self.keystore.decrypt_message(index, message, password)
 
     def txin_value(self, txin):
-        txid = txin['prevout_hash']
-        prev_n = txin['prevout_n']
-        for address, d in self.txo.get(txid, {}).items():
-            for n, v, cb in d:
-                if n == prev_n:
-                    return v
-        # may occur if wallet is not synchronized
-        return None
+        txo = self.get_txo(txin['prevout_hash'], txin['prevout_n'])
+        # may be None if wallet is not synchronized
+        return txo[1] if txo else None
 
     def price_at_timestamp(self, txid, price_func):
         """Returns fiat price of bitcoin at the time tx got confirmed."""
@@ -1202,7 +1197,7 @@ class Abstract_Wallet(AddressSynchronizer):
         input_value = 0
         total_price = 0
         for addr, d in self.txi.get(txid, {}).items():
-            for ser, v in d:
+            for ser, v in d.items():
                 input_value += v
                 total_price += self.coin_price(ser.split(':')[0], price_func, ccy, v)
         return total_price / (input_value/Decimal(COIN))
@@ -1374,7 +1369,7 @@ class Imported_Wallet(Simple_Wallet):
             for tx_hash in transactions_to_remove:
                 self.remove_transaction(tx_hash)
                 self.tx_fees.pop(tx_hash, None)
-                self.verified_tx.pop(tx_hash, None)
+                self._pop_verified_tx(tx_hash)
                 self.unverified_tx.pop(tx_hash, None)
                 self.transactions.pop(tx_hash, None)
             self.save_verified_tx()
@@ -1386,6 +1381,10 @@ class Imported_Wallet(Simple_Wallet):
 
         pubkey = self.get_public_key(address)
         self.addresses.pop(address)
+        with self.lock, self.transaction_lock:
+            # drop it from the balance and utxo caches, and the history
+            self._dirty_addrs.add(address)
+            self._dirty_txs |= self._history_local.get(address, set())
         if pubkey:
             # delete key iff no other address uses it (e.g. p2pkh and p2wpkh for same key)
             for txin_type in bitcoin.WIF_SCRIPT_TYPES.keys():
@@ -1518,6 +1517,8 @@ class Deterministic_Wallet(Abstract_Wallet):
         if value >= self.gap_limit:
             self.gap_limit = value
             self.storage.put('gap_limit', self.gap_limit)
+            if self.synchronizer:
+                self.synchronizer.wake_up()
             return True
         elif value >= self.min_acceptable_gap():
             addresses = self.get_receiving_addresses()